@@ -0,0 +1,46 @@
+"""PostgreSQL backend that takes its connections from a pool of the process.
+
+Django opens a connection per thread and closes it at the end of each request, or with
+database_sync_to_async after each call. With this backend, closing returns the
+connection to the pool instead, so connections are reused across requests and threads.
+The pool is configured with the POOL setting of the database:
+
+    "POOL": {
+        "MAX_SIZE": 10,  # Connections per process, e.g., the ASGI threads
+        "MAX_LIFETIME": 3600,  # Seconds until a connection is recycled
+        "HEALTH_CHECK_AFTER": 30,  # Idle seconds until a connection is checked
+        "TIMEOUT": 10,  # Seconds to wait for a connection if all are in use
+    }
+"""
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+from .creation import DatabaseCreation
+from .pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(conn_params, self.settings_dict.get("POOL"))
+        connection = self.pool.get()
+
+        # Same as the PostgreSQL backend, for a new or a reused connection
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection)
@@ -0,0 +1,236 @@
+"""A thread-safe pool of psycopg2 connections.
+
+Each process has its own pools, so forked processes like the Celery workers never share
+a connection with their parent. Connections are handed out last in, first out, checked
+before reuse if they were idle for a while and closed once they exceed their lifetime."""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """A pool of at most max_size connections with the same parameters.
+
+    If all connections are in use, getting one waits up to timeout seconds for one to be
+    returned. Connections older than max_lifetime seconds are closed when they are
+    returned and idle connections are checked with a query after health_check_after
+    seconds."""
+
+    def __init__(
+        self,
+        conn_params: Dict,
+        max_size: int = 10,
+        max_lifetime: float = 3600,
+        health_check_after: float = 30,
+        timeout: float = 10,
+    ):
+        self.conn_params = conn_params
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        # Idle connections and the time they were returned, the last one is reused first
+        self._idle: List[Tuple[psycopg2.extensions.connection, float]] = []
+        # Creation time of all open connections of the pool
+        self._created: Dict[int, float] = {}
+        # Connections being opened count against the size as well
+        self._opening = 0
+        self._closed = False
+        self._pid = os.getpid()
+        self._stats = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+        }
+
+    @property
+    def size(self) -> int:
+        """The number of open connections, idle or in use"""
+
+        return len(self._created) + self._opening
+
+    def get(self) -> psycopg2.extensions.connection:
+        """Get a healthy connection, opening a new one if none is idle. Raises
+        psycopg2.OperationalError if none becomes available within the timeout."""
+
+        started = time.monotonic()
+        waited = False
+        while True:
+            with self._condition:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = started + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        logger.error("Connection pool exhausted: %s", self._stats)
+                        raise psycopg2.OperationalError(
+                            f"No database connection available within {self.timeout}s,"
+                            f" all {self.max_size} are in use"
+                        )
+                    waited = True
+                    self._condition.wait(remaining)
+                if waited:
+                    wait_time = time.monotonic() - started
+                    self._stats["waits"] += 1
+                    self._stats["wait_time_total"] += wait_time
+                    self._stats["wait_time_max"] = max(
+                        self._stats["wait_time_max"], wait_time
+                    )
+                    waited = False
+                    logger.info(
+                        "Waited %.3fs for a database connection (%d waits, max %.3fs)",
+                        wait_time,
+                        self._stats["waits"],
+                        self._stats["wait_time_max"],
+                    )
+                self._stats["checkouts"] += 1
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection = None
+                    self._opening += 1
+
+            if connection is None:
+                return self._open()
+            if self._is_healthy(connection, returned_at):
+                return connection
+            with self._condition:
+                self._stats["health_check_failures"] += 1
+            self._discard(connection)
+
+    def put(self, connection: psycopg2.extensions.connection):
+        """Return a connection to the pool. It is closed instead if it is broken, too
+        old or not from this pool."""
+
+        created_at = self._created.get(id(connection))
+        if created_at is None or os.getpid() != self._pid:
+            # A connection of another pool or the parent process must not be touched
+            return
+        reusable = (
+            not self._closed
+            and not connection.closed
+            and time.monotonic() - created_at < self.max_lifetime
+        )
+        if reusable and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                reusable = False
+        if not reusable:
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def close(self):
+        """Close the idle connections and the ones in use once they are returned"""
+
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                **self._stats,
+                "size": self.size,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+            }
+
+    def _open(self) -> psycopg2.extensions.connection:
+        try:
+            connection = psycopg2.connect(**self.conn_params)
+        except Exception:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._created[id(connection)] = time.monotonic()
+            self._stats["connections_opened"] += 1
+        return connection
+
+    def _discard(self, connection: psycopg2.extensions.connection):
+        with self._condition:
+            self._created.pop(id(connection), None)
+            self._stats["connections_closed"] += 1
+            self._condition.notify()
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, connection, returned_at: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return True
+        except psycopg2.Error as err:
+            logger.info("Discarding broken database connection: %s", err)
+            return False
+
+
+# The pools of this process by their connection parameters
+_pools: Dict[Tuple[int, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(conn_params: Dict, options: Optional[Dict] = None) -> ConnectionPool:
+    """Get the pool of this process for the connection parameters"""
+
+    key = (os.getpid(), repr(sorted(conn_params.items())))
+    with _pools_lock:
+        if key not in _pools:
+            options = options or {}
+            _pools[key] = ConnectionPool(
+                conn_params,
+                max_size=options.get("MAX_SIZE", 10),
+                max_lifetime=options.get("MAX_LIFETIME", 3600),
+                health_check_after=options.get("HEALTH_CHECK_AFTER", 30),
+                timeout=options.get("TIMEOUT", 10),
+            )
+        return _pools[key]
+
+
+def close_pools():
+    """Close all pools of this process, e.g., before dropping the database"""
+
+    with _pools_lock:
+        pools = [pool for (pid, _), pool in _pools.items() if pid == os.getpid()]
+        for key in [key for key in _pools if key[0] == os.getpid()]:
+            del _pools[key]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats() -> List[Dict]:
+    """The statistics of all pools of this process"""
+
+    with _pools_lock:
+        pools = [pool for (pid, _), pool in _pools.items() if pid == os.getpid()]
+    return [
+        {"database": pool.conn_params.get("database"), **pool.stats()} for pool in pools
+    ]
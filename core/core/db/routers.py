@@ -0,0 +1,128 @@
+"""Routes read-only work to the read replicas.
+
+Reads use the primary database by default. Code that only reads, e.g., GraphQL queries
+and exports, runs inside replica_reads() to send its reads to a replica. As soon as a
+write happens inside it, the remaining reads are pinned to the primary, so the code
+reads its own writes. Replicas whose replication lag exceeds the threshold, or which
+cannot be reached, are skipped until the next lag check."""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the replication lag checks of a replica
+LAG_CHECK_INTERVAL = 5
+
+_replica_reads: ContextVar[bool] = ContextVar("replica_reads", default=False)
+_pinned_to_primary: ContextVar[bool] = ContextVar("pinned_to_primary", default=False)
+
+# Time of the last check and the result of each replica, shared by the threads
+_replica_health: Dict[str, Tuple[float, bool]] = {}
+_replica_health_lock = threading.Lock()
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads within the context to a replica until the first write"""
+
+    reads_token = _replica_reads.set(True)
+    pinned_token = _pinned_to_primary.set(False)
+    try:
+        yield
+    finally:
+        _pinned_to_primary.reset(pinned_token)
+        _replica_reads.reset(reads_token)
+
+
+def iterate_with_replica_reads(iterable: Iterable) -> Iterator:
+    """Iterate with replica reads, e.g., the content of a streaming response that is
+    consumed after the view returned"""
+
+    iterator = iter(iterable)
+    while True:
+        with replica_reads():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def replica_lag(alias: str) -> float:
+    """Get the replication lag of a replica in seconds. It is zero if the replica
+    replayed everything it received."""
+
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT CASE
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+            END
+            """
+        )
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+
+def is_replica_healthy(alias: str) -> bool:
+    """Whether the replica is reachable and its lag below the threshold, checked at
+    most every LAG_CHECK_INTERVAL seconds"""
+
+    now = time.monotonic()
+    with _replica_health_lock:
+        checked_at, healthy = _replica_health.get(alias, (None, False))
+        if checked_at is not None and now - checked_at < LAG_CHECK_INTERVAL:
+            return healthy
+        # Other threads keep using the last result while this one checks
+        _replica_health[alias] = (now, healthy)
+    try:
+        lag = replica_lag(alias)
+        healthy = lag <= settings.DATABASE_REPLICA_MAX_LAG
+        if not healthy:
+            logger.warning("Replica %s lags %.1f seconds behind", alias, lag)
+    except DatabaseError as err:
+        logger.warning("Replica %s is unavailable: %s", alias, err)
+        healthy = False
+    with _replica_health_lock:
+        _replica_health[alias] = (time.monotonic(), healthy)
+    return healthy
+
+
+def choose_replica() -> Optional[str]:
+    """Choose a random healthy replica, None if there is none"""
+
+    replicas = [
+        alias for alias in settings.DATABASE_REPLICAS if is_replica_healthy(alias)
+    ]
+    return random.choice(replicas) if replicas else None
+
+
+class ReplicaRouter:
+    """Routes the reads within replica_reads() to a healthy replica and everything else
+    to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and not _pinned_to_primary.get():
+            return choose_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes
+        _pinned_to_primary.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # All databases contain the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,121 @@
+"""Concurrent execution of the root fields of GraphQL queries.
+
+The root fields of a query are independent, yet they are resolved one after the other,
+so a dashboard selecting several series waits for the sum of their database queries. A
+query operation is split into up to GRAPHQL_CONCURRENCY documents of consecutive root
+fields, which are executed in threads of their own, each with its own database
+connection and DataLoaders, and their results are merged in the order of the fields.
+
+The threads are GRAPHQL_CONCURRENCY_THREADS of a pool of their own. The requests run in
+the threads of the default executor, which would deadlock waiting for their root fields
+once all its threads were taken by requests.
+
+Operations whose root fields share a response name or are selected with fragments are
+executed as a whole."""
+import contextvars
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.type import GraphQLSchema
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from core.graphql import tracing
+
+
+def split_operation(
+    document: ast.Document, operation_name: Optional[str], parts: int
+) -> Optional[List[ast.Document]]:
+    """Split the query operation into up to parts documents of consecutive root fields,
+    None if it cannot be split"""
+
+    operation = get_operation_ast(document, operation_name)
+    if operation is None or operation.operation != "query" or parts < 2:
+        return None
+    selections = operation.selection_set.selections
+    if len(selections) < 2 or not all(
+        isinstance(selection, ast.Field) for selection in selections
+    ):
+        return None
+    names = {(field.alias or field.name).value for field in selections}
+    if len(names) != len(selections):
+        return None
+
+    fragments = [
+        definition
+        for definition in document.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    ]
+    size = -(-len(selections) // parts)
+    documents = []
+    for start in range(0, len(selections), size):
+        part = copy.copy(operation)
+        part.selection_set = ast.SelectionSet(selections[start : start + size])
+        documents.append(ast.Document([part] + fragments))
+    return documents
+
+
+def execute_concurrently(
+    schema: GraphQLSchema, documents: List[ast.Document], context_value, **kwargs
+) -> ExecutionResult:
+    """Execute the validated documents in threads of their own and merge their results.
+    Each document is executed with a copy of the context, so the request scoped
+    DataLoaders are not shared between threads, and of the context variables, like the
+    replica reads."""
+
+    futures = [
+        _get_executor().submit(
+            contextvars.copy_context().run,
+            _execute,
+            schema,
+            document,
+            copy.copy(context_value),
+            **kwargs,
+        )
+        for document in documents
+    ]
+    return merge([future.result() for future in futures])
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.GRAPHQL_CONCURRENCY_THREADS,
+                thread_name_prefix="graphql-root-fields",
+            )
+        return _executor
+
+
+def _execute(schema, document, context_value, **kwargs) -> ExecutionResult:
+    # Like in channels' database_sync_to_async, the connections of the thread are
+    # closed if they are obsolete or failed, before and after it uses them
+    close_old_connections()
+    try:
+        with tracing.recording_sql(context_value):
+            return execute(schema, document, context_value=context_value, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def merge(results: List[ExecutionResult]) -> ExecutionResult:
+    """Merge the results of the parts of an operation. If the data of a part is null,
+    after an error in a non null root field, the data of the operation is null."""
+
+    data = {}
+    errors = []
+    for result in results:
+        errors.extend(result.errors or [])
+        if data is not None:
+            data = None if result.data is None else {**data, **result.data}
+    return ExecutionResult(data=data, errors=errors or None)
@@ -0,0 +1,296 @@
+"""Static cost analysis of GraphQL operations.
+
+Nested connections let a small query ask for every data point of every peripheral
+component of every site. The analysis estimates the rows an operation loads from its
+document before it is executed, so expensive operations are rejected before they reach
+the database:
+
+- A connection costs its page size, given by first or last, else the maximum page size
+  of the connections, but at most the estimated number of rows of its model.
+- A list of model objects costs the estimated number of rows of the model.
+- Any other object field costs one.
+
+Each cost is multiplied by the number of times its field is resolved, i.e., the sizes of
+the enclosing connections and lists. Scalar fields and the structure of connections,
+their edges, nodes and page info, are free. The row estimates are taken from the table
+statistics of PostgreSQL. Introspection fields are neither counted nor limited.
+
+Each user has a budget of cost that is spent by the operations within a window. The
+budgets are kept in the default cache, which all server processes share."""
+import math
+import time
+from typing import Dict, NamedTuple, Optional, Tuple, Type
+
+from django.core.cache import cache
+from django.db import connections, models, router
+from graphene import relay
+from graphene_django import DjangoObjectType
+from graphene_django.settings import graphene_settings
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLNonNull, GraphQLSchema
+
+# Seconds the row estimates of a model are cached
+ROWS_TIMEOUT = 300
+
+
+class QueryCost(NamedTuple):
+    cost: int
+    depth: int
+
+
+def analyze(
+    schema: GraphQLSchema,
+    document: ast.Document,
+    operation_name: Optional[str] = None,
+    variables: Optional[Dict] = None,
+) -> QueryCost:
+    """Estimate the cost and the depth of the operation in the document. Invalid
+    documents, which fail validation on execution, are analyzed as far as possible."""
+
+    return _Analyzer(schema, document, variables or {}).analyze(operation_name)
+
+
+def estimated_rows(model: Type[models.Model]) -> Optional[int]:
+    """The estimated number of rows of the model's table, including the chunks of a
+    hypertable, from the table statistics. None if the table was not analyzed yet."""
+
+    cache_key = f"graphql_cost:rows:{model._meta.db_table}"
+    rows = cache.get(cache_key)
+    if rows is None:
+        connection = connections[router.db_for_read(model)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT coalesce(sum(greatest(reltuples, 0)), 0)
+                FROM pg_class
+                WHERE oid = %(table)s::regclass
+                OR oid IN (
+                    SELECT inhrelid FROM pg_inherits
+                    WHERE inhparent = %(table)s::regclass
+                )
+                """,
+                {"table": connection.ops.quote_name(model._meta.db_table)},
+            )
+            rows = int(cursor.fetchone()[0])
+        cache.set(cache_key, rows, ROWS_TIMEOUT)
+    # Tables that were not analyzed yet have no statistics
+    return rows or None
+
+
+def spend_budget(key: str, cost: int, budget: int, window: int) -> Optional[int]:
+    """Spend the cost from the budget of the key in the current window. Returns None if
+    the budget suffices, else the seconds until the next window."""
+
+    now = time.time()
+    cache_key = f"graphql_cost:budget:{key}:{int(now // window)}"
+    # Spending and checking in one step keeps concurrent operations from overspending
+    cache.add(cache_key, 0, window)
+    if cache.incr(cache_key, cost) > budget:
+        # Rejected operations do not spend the budget
+        cache.decr(cache_key, cost)
+        return math.ceil(window - now % window)
+    return None
+
+
+class _Analyzer:
+    def __init__(self, schema: GraphQLSchema, document: ast.Document, variables: Dict):
+        self.schema = schema
+        self.variables = variables
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+        self.operations = [
+            definition
+            for definition in document.definitions
+            if isinstance(definition, ast.OperationDefinition)
+        ]
+        self.rows: Dict[Type[models.Model], Optional[int]] = {}
+
+    def analyze(self, operation_name: Optional[str]) -> QueryCost:
+        operations = [
+            operation
+            for operation in self.operations
+            if operation_name is None
+            or (operation.name and operation.name.value == operation_name)
+        ]
+        if len(operations) != 1:
+            return QueryCost(0, 0)
+        operation = operations[0]
+        for definition in operation.variable_definitions or []:
+            name = definition.variable.name.value
+            if name not in self.variables and definition.default_value is not None:
+                self.variables[name] = self._value(definition.default_value)
+        root_type = {
+            "query": self.schema.get_query_type(),
+            "mutation": self.schema.get_mutation_type(),
+            "subscription": self.schema.get_subscription_type(),
+        }[operation.operation]
+        if root_type is None:
+            return QueryCost(0, 0)
+        return self._selections(operation.selection_set, root_type, 1, ())
+
+    def _selections(
+        self,
+        selection_set: Optional[ast.SelectionSet],
+        parent_type,
+        multiplier: int,
+        fragments: Tuple[str, ...],
+        page_size: Optional[int] = None,
+        in_edge: bool = False,
+    ) -> QueryCost:
+        """The cost and depth of the selections, each resolved multiplier times. The
+        page size is given for the selections of a connection, in_edge for the ones of
+        an edge."""
+
+        cost = depth = 0
+        for selection, selection_type, spread in self._fields(
+            selection_set, parent_type, fragments
+        ):
+            field_cost = self._field(
+                selection, selection_type, multiplier, spread, page_size, in_edge
+            )
+            cost += field_cost.cost
+            depth = max(depth, field_cost.depth)
+        return QueryCost(cost, depth)
+
+    def _fields(self, selection_set, parent_type, fragments: Tuple[str, ...]):
+        """Iterate over the fields of the selection set with the type they are selected
+        on and the fragments spread on the path, following the fragments"""
+
+        for selection in selection_set.selections if selection_set else []:
+            if isinstance(selection, ast.Field):
+                yield selection, parent_type, fragments
+            elif isinstance(selection, ast.InlineFragment):
+                yield from self._fields(
+                    selection.selection_set,
+                    self._condition_type(selection.type_condition, parent_type),
+                    fragments,
+                )
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                # Cyclic spreads are rejected by the validation
+                if name in fragments or name not in self.fragments:
+                    continue
+                fragment = self.fragments[name]
+                yield from self._fields(
+                    fragment.selection_set,
+                    self._condition_type(fragment.type_condition, parent_type),
+                    fragments + (name,),
+                )
+
+    def _field(
+        self,
+        selection: ast.Field,
+        parent_type,
+        multiplier: int,
+        fragments: Tuple[str, ...],
+        page_size: Optional[int],
+        in_edge: bool,
+    ) -> QueryCost:
+        name = selection.name.value
+        fields = getattr(parent_type, "fields", None) or {}
+        if name.startswith("__") or name not in fields:
+            return QueryCost(0, 1 if name == "__typename" else 0)
+        field_type = fields[name].type
+        is_list = False
+        while isinstance(field_type, (GraphQLList, GraphQLNonNull)):
+            is_list = is_list or isinstance(field_type, GraphQLList)
+            field_type = field_type.of_type
+        if not selection.selection_set:
+            return QueryCost(0, 1)
+
+        graphene_type = getattr(field_type, "graphene_type", None)
+        if page_size is not None:
+            # The edges and page info of a connection are free
+            cost = 0
+            if is_list:
+                children = self._selections(
+                    selection.selection_set,
+                    field_type,
+                    multiplier * page_size,
+                    fragments,
+                    in_edge=True,
+                )
+            else:
+                children = self._selections(
+                    selection.selection_set, field_type, multiplier, fragments
+                )
+        elif in_edge:
+            # The node of an edge is part of the page
+            cost = 0
+            children = self._selections(
+                selection.selection_set, field_type, multiplier, fragments
+            )
+        elif _is_connection(graphene_type):
+            size = self._page_size(selection, graphene_type._meta.node)
+            cost = multiplier * size
+            children = self._selections(
+                selection.selection_set, field_type, multiplier, fragments, size
+            )
+        else:
+            size = self._list_size(graphene_type) if is_list else 1
+            cost = multiplier * size
+            children = self._selections(
+                selection.selection_set, field_type, multiplier * size, fragments
+            )
+        return QueryCost(cost + children.cost, children.depth + 1)
+
+    def _page_size(self, selection: ast.Field, node_type) -> int:
+        arguments = {
+            argument.name.value: self._value(argument.value)
+            for argument in selection.arguments or []
+        }
+        size = arguments.get("first")
+        if size is None:
+            size = arguments.get("last")
+        if not isinstance(size, int) or size < 0:
+            size = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        rows = self._rows(node_type)
+        return min(size, rows) if rows is not None else size
+
+    def _list_size(self, graphene_type) -> int:
+        """The estimated length of a list, one for lists of other objects than models,
+        which are built from the arguments"""
+
+        if not _is_model_type(graphene_type):
+            return 1
+        rows = self._rows(graphene_type)
+        if rows is None:
+            return graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        return rows
+
+    def _rows(self, graphene_type) -> Optional[int]:
+        if not _is_model_type(graphene_type):
+            return None
+        model = graphene_type._meta.model
+        if model not in self.rows:
+            self.rows[model] = estimated_rows(model)
+        return self.rows[model]
+
+    def _condition_type(self, type_condition: Optional[ast.NamedType], parent_type):
+        if type_condition is None:
+            return parent_type
+        return self.schema.get_type(type_condition.name.value)
+
+    def _value(self, value: ast.Value):
+        """The Python value of a literal or variable, None for other values"""
+
+        if isinstance(value, ast.Variable):
+            return self.variables.get(value.name.value)
+        if isinstance(value, ast.IntValue):
+            return int(value.value)
+        return None
+
+
+def _is_connection(graphene_type) -> bool:
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, relay.Connection
+    )
+
+
+def _is_model_type(graphene_type) -> bool:
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, DjangoObjectType
+    )
@@ -0,0 +1,134 @@
+"""Persisted GraphQL queries and the cache of parsed and validated documents.
+
+Clients like the planner send the same few queries over and over. Instead of the query,
+a client may send its SHA-256 hash in the persisted query extension:
+
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "<hash>"}}}
+
+Queries are registered at build time in a manifest, a JSON object mapping hashes to
+queries, or on first use: if the hash is unknown, the response has a
+PersistedQueryNotFound error and the client repeats the request with the query and its
+hash. Registered queries are shared by all processes through the cache. Queries
+registered on first use expire unless they are used within
+GRAPHQL_PERSISTED_QUERY_TIMEOUT seconds, the queries of the manifest never do.
+
+Each document is parsed and validated once and kept in an LRU cache, so executing a
+known query skips both."""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql.backend import GraphQLCoreBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.language.parser import parse
+from graphql.validation import validate
+
+CACHE_PREFIX = "graphql_persisted:"
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def get_query(sha256_hash: str) -> Optional[str]:
+    """The query registered with the hash, None if there is none"""
+
+    if query := _manifest().get(sha256_hash):
+        return query
+    key = CACHE_PREFIX + sha256_hash
+    if query := cache.get(key):
+        cache.touch(key, settings.GRAPHQL_PERSISTED_QUERY_TIMEOUT)
+    return query
+
+
+def register_query(sha256_hash: str, query: str):
+    """Register the query with its hash. Raises ValueError if the hash does not match
+    the query."""
+
+    if query_hash(query) != sha256_hash:
+        raise ValueError("The hash does not match the query")
+    if sha256_hash not in _manifest():
+        cache.set(
+            CACHE_PREFIX + sha256_hash, query, settings.GRAPHQL_PERSISTED_QUERY_TIMEOUT
+        )
+
+
+_manifest_lock = threading.Lock()
+_manifest_queries: Optional[Dict[str, str]] = None
+
+
+def _manifest() -> Dict[str, str]:
+    """The queries of the manifest by their hashes, read on first use"""
+
+    global _manifest_queries  # pylint: disable=global-statement
+    if _manifest_queries is None:
+        with _manifest_lock:
+            if _manifest_queries is None:
+                path = settings.GRAPHQL_PERSISTED_QUERIES_MANIFEST
+                if path:
+                    with open(path) as manifest_file:
+                        _manifest_queries = json.load(manifest_file)
+                else:
+                    _manifest_queries = {}
+    return _manifest_queries
+
+
+class CachedBackend(GraphQLCoreBackend):
+    """A backend keeping the parsed and validated documents of the most recently used
+    queries. Documents failing validation return their errors when executed. The
+    validation errors of a document are kept in its validation_errors."""
+
+    def __init__(self, max_size: int, executor=None):
+        super().__init__(executor)
+        self.max_size = max_size
+        self._documents: "OrderedDict[tuple, GraphQLDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        if isinstance(document_string, ast.Document):
+            return super().document_from_string(schema, document_string)
+        key = (id(schema), document_string)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        # Syntax errors are raised and not cached
+        document_ast = parse(document_string)
+        validation_errors = validate(schema, document_ast)
+        if validation_errors:
+            execute_document = partial(_invalid, validation_errors)
+        else:
+            execute_document = partial(
+                execute, schema, document_ast, **self.execute_params
+            )
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=execute_document,
+        )
+        document.validation_errors = validation_errors
+        with self._lock:
+            self._documents[key] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+def _invalid(errors, *args, **kwargs) -> ExecutionResult:
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+backend = CachedBackend(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
@@ -0,0 +1,186 @@
+"""Cached responses of GraphQL queries for reference data.
+
+Reference data, like the enums, the data point types and the controller component types,
+almost never changes but is queried on every page load of the planner. Query operations
+whose root fields are all in GRAPHQL_REFERENCE_FIELDS, and whose nested fields only
+return node types of those root fields, are answered from a cache. Filters of those
+fields on relations to other models, e.g., the data point types of a peripheral
+component, depend on other data, so operations using them are not cached.
+
+The cache keys contain the version of the reference data, which is replaced whenever a
+reference model is saved or deleted (see farms.signals), so a change invalidates all
+cached responses and their ETags at once."""
+import hashlib
+import json
+import uuid
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from graphene import relay
+from graphene.utils.str_converters import to_camel_case
+from graphene_django import DjangoObjectType
+from graphql.language import ast
+from graphql.type import GraphQLSchema
+
+VERSION_KEY = "graphql_reference:version"
+
+# Seconds a response is cached
+RESPONSE_TIMEOUT = 24 * 3600
+
+
+def get_version() -> str:
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Invalidate the cached responses after a change of the reference data"""
+
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def cache_key(query: str, variables: Optional[Dict], operation_name: Optional[str]):
+    """The key of the response to the operation at the current version"""
+
+    request = json.dumps(
+        [get_version(), query, variables, operation_name], sort_keys=True
+    )
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+def get_response(key: str) -> Optional[bytes]:
+    return cache.get(f"graphql_reference:response:{key}")
+
+
+def set_response(key: str, content: bytes):
+    cache.set(f"graphql_reference:response:{key}", content, RESPONSE_TIMEOUT)
+
+
+def is_reference_operation(
+    schema: GraphQLSchema, document: ast.Document, operation_name: Optional[str] = None
+) -> bool:
+    """Whether the operation is a query that only selects reference data"""
+
+    operations = [
+        definition
+        for definition in document.definitions
+        if isinstance(definition, ast.OperationDefinition)
+        and (
+            operation_name is None
+            or (definition.name and definition.name.value == operation_name)
+        )
+    ]
+    if len(operations) != 1 or operations[0].operation != "query":
+        return False
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    }
+    query_type = schema.get_query_type()
+    root_fields = list(_fields(operations[0].selection_set, fragments))
+    if any(
+        field.name.value not in settings.GRAPHQL_REFERENCE_FIELDS
+        and field.name.value != "__typename"
+        for field, _ in root_fields
+    ):
+        return False
+    node_types = {
+        _node_type(query_type.fields[name].type)
+        for name in settings.GRAPHQL_REFERENCE_FIELDS
+        if name in query_type.fields
+    } - {None}
+    return _selects_only(operations[0].selection_set, query_type, node_types, fragments)
+
+
+def _selects_only(
+    selection_set, parent_type, node_types: Set, fragments: Dict, spread=()
+) -> bool:
+    """Whether the nested fields of the selection set only return the node types, or
+    types that are no nodes"""
+
+    for field, field_spread in _fields(selection_set, fragments, spread):
+        name = field.name.value
+        if name == "__typename":
+            continue
+        field_definition = getattr(parent_type, "fields", {}).get(name)
+        if field_definition is None:
+            return False
+        field_type = _unwrap(field_definition.type)
+        node_type = _node_type(field_type)
+        if node_type is not None and node_type not in node_types:
+            return False
+        if node_type is not None and {
+            argument.name.value for argument in field.arguments or []
+        } & _related_filters(node_type, node_types):
+            return False
+        if field.selection_set and not _selects_only(
+            field.selection_set, field_type, node_types, fragments, field_spread
+        ):
+            return False
+    return True
+
+
+def _related_filters(node_type, node_types: Set) -> Set[str]:
+    """The arguments of the filters of the node type on relations to models of other
+    than the node types"""
+
+    filter_fields = node_type._meta.filter_fields or {}
+    if not isinstance(filter_fields, dict):
+        filter_fields = {name: ["exact"] for name in filter_fields}
+    models = {node._meta.model for node in node_types}
+    arguments = set()
+    for name, lookups in filter_fields.items():
+        model = node_type._meta.model
+        for part in name.split("__"):
+            field = model._meta.get_field(part)
+            if not field.is_relation:
+                break
+            model = field.related_model
+            if model not in models:
+                arguments.update(
+                    to_camel_case(name if lookup == "exact" else f"{name}__{lookup}")
+                    for lookup in lookups
+                )
+                break
+    return arguments
+
+
+def _fields(
+    selection_set, fragments: Dict, spread: Tuple[str, ...] = ()
+) -> Iterator[Tuple[ast.Field, Tuple[str, ...]]]:
+    """Iterate over the fields of the selection set and the fragments spread on their
+    path, following the fragments that were not spread on the path yet"""
+
+    for selection in selection_set.selections if selection_set else []:
+        if isinstance(selection, ast.Field):
+            yield selection, spread
+        elif isinstance(selection, ast.InlineFragment):
+            yield from _fields(selection.selection_set, fragments, spread)
+        elif selection.name.value in fragments and selection.name.value not in spread:
+            yield from _fields(
+                fragments[selection.name.value].selection_set,
+                fragments,
+                spread + (selection.name.value,),
+            )
+
+
+def _unwrap(field_type):
+    while hasattr(field_type, "of_type"):
+        field_type = field_type.of_type
+    return field_type
+
+
+def _node_type(field_type):
+    """The Django object type of the field type or of its connection, if any"""
+
+    graphene_type = getattr(_unwrap(field_type), "graphene_type", None)
+    if isinstance(graphene_type, type) and issubclass(graphene_type, relay.Connection):
+        graphene_type = graphene_type._meta.node
+    if isinstance(graphene_type, type) and issubclass(graphene_type, DjangoObjectType):
+        return graphene_type
+    return None
@@ -0,0 +1,200 @@
+"""Tracing of the resolvers of GraphQL operations.
+
+With GRAPHQL_TRACING, operations are traced if a staff user sends the X-GraphQL-Trace
+header, which returns the trace in the extensions of the response, or if they are
+sampled at GRAPHQL_TRACING_SAMPLE_RATE, which logs a summary of the trace.
+
+The trace records for each field the time its resolver took, until its promise resolved
+for loaders, and the number of SQL queries, their time and the rows they fetched. The
+queries are accounted to the field whose resolver started last in the thread, which is
+also the field whose list or connection is fetched after its resolver returned. The
+resolvers are listed in the format of Apollo tracing."""
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections
+from promise import Promise
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "HTTP_X_GRAPHQL_TRACE"
+
+# Fields listed in the logged summary
+SLOWEST_FIELDS = 5
+
+
+class SQLStats:
+    """The SQL queries of a field or an operation"""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0
+        self.rows = 0
+
+    def add(self, duration: int, rows: int):
+        self.queries += 1
+        self.duration += duration
+        self.rows += rows
+
+    def to_dict(self) -> Dict:
+        return {"queries": self.queries, "duration": self.duration, "rows": self.rows}
+
+
+class FieldTrace:
+    """The resolver of a field, with times in nanoseconds since the operation started"""
+
+    def __init__(self, info, start_offset: int):
+        self.path = list(info.path)
+        self.parent_type = str(info.parent_type)
+        self.field_name = info.field_name
+        self.return_type = str(info.return_type)
+        self.start_offset = start_offset
+        self.duration = 0
+        self.sql = SQLStats()
+
+    def to_dict(self) -> Dict:
+        return {
+            "path": self.path,
+            "parentType": self.parent_type,
+            "fieldName": self.field_name,
+            "returnType": self.return_type,
+            "startOffset": self.start_offset,
+            "duration": self.duration,
+            "sql": self.sql.to_dict(),
+        }
+
+
+class Trace:
+    """The trace of an operation, shared by the threads executing its root fields"""
+
+    def __init__(self, respond: bool, log: bool):
+        # Whether to return the trace in the response and whether to log it
+        self.respond = respond
+        self.log = log
+        self.start_time = datetime.now(tz=timezone.utc)
+        self.end_time = None
+        self.start = time.perf_counter_ns()
+        self.duration = 0
+        self.fields: List[FieldTrace] = []
+        self.sql = SQLStats()
+        self._lock = threading.Lock()
+        self._current = threading.local()
+
+    def start_field(self, info) -> FieldTrace:
+        field = FieldTrace(info, time.perf_counter_ns() - self.start)
+        with self._lock:
+            self.fields.append(field)
+        self._current.field = field
+        return field
+
+    def end_field(self, field: FieldTrace):
+        field.duration = time.perf_counter_ns() - self.start - field.start_offset
+
+    def record_sql(self, execute, sql, params, many, context):
+        """Execute wrapper of the database connections recording the queries"""
+
+        start = time.perf_counter_ns()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter_ns() - start
+            # The number of rows a query returned or changed, -1 if unknown
+            rows = max(context["cursor"].rowcount, 0)
+            field = getattr(self._current, "field", None)
+            with self._lock:
+                self.sql.add(duration, rows)
+                if field is not None:
+                    field.sql.add(duration, rows)
+
+    def finish(self, operation_name: Optional[str]):
+        self.duration = time.perf_counter_ns() - self.start
+        self.end_time = datetime.now(tz=timezone.utc)
+        if self.log:
+            slowest = sorted(self.fields, key=lambda field: field.duration)
+            logger.info(
+                "GraphQL operation %s took %.1f ms with %d SQL queries in %.1f ms "
+                "fetching %d rows, slowest fields: %s",
+                operation_name or "<anonymous>",
+                self.duration / 1e6,
+                self.sql.queries,
+                self.sql.duration / 1e6,
+                self.sql.rows,
+                ", ".join(
+                    f"{'.'.join(map(str, field.path))} {field.duration / 1e6:.1f} ms "
+                    f"({field.sql.queries} queries)"
+                    for field in reversed(slowest[-SLOWEST_FIELDS:])
+                ),
+            )
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": 1,
+            "startTime": self.start_time.isoformat(),
+            "endTime": self.end_time.isoformat() if self.end_time else None,
+            "duration": self.duration,
+            "sql": self.sql.to_dict(),
+            "execution": {"resolvers": [field.to_dict() for field in self.fields]},
+        }
+
+
+def start_trace(request) -> Optional[Trace]:
+    """The trace of the operation of the request, None if it is not traced"""
+
+    if not settings.GRAPHQL_TRACING:
+        return None
+    respond = TRACE_HEADER in request.META and request.user.is_staff
+    log = random.random() < settings.GRAPHQL_TRACING_SAMPLE_RATE
+    if not (respond or log):
+        return None
+    return Trace(respond=respond, log=log)
+
+
+def get_trace(context) -> Optional[Trace]:
+    return getattr(context, "graphql_trace", None)
+
+
+def recording_sql(context) -> ExitStack:
+    """Record the SQL queries of all databases into the trace of the context, if any,
+    within the current thread"""
+
+    stack = ExitStack()
+    trace = get_trace(context)
+    if trace is not None:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(trace.record_sql))
+    return stack
+
+
+class TracingMiddleware:
+    """Graphene middleware recording the resolvers into the trace of the context"""
+
+    def resolve(self, next, root, info, **args):  # pylint: disable=redefined-builtin
+        trace = get_trace(info.context)
+        if trace is None:
+            return next(root, info, **args)
+
+        field = trace.start_field(info)
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            trace.end_field(field)
+            raise
+        if isinstance(result, Promise) and result.is_pending:
+
+            def fulfilled(value):
+                trace.end_field(field)
+                return value
+
+            def rejected(error):
+                trace.end_field(field)
+                raise error
+
+            return result.then(fulfilled, rejected)
+        trace.end_field(field)
+        return result
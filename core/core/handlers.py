@@ -0,0 +1,71 @@
+"""The ASGI handler of the HTTP requests.
+
+Django 3.1 iterates the content of streaming responses in the event loop, where the
+database cannot be used and every blocking read holds up all connections of the process,
+like the WebSockets of the controllers. The handler reads the content in a thread of its
+own instead, which keeps the connections the content opened, e.g., the server-side
+cursor of an export, and sends each part as soon as it is produced."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connections
+
+
+class StreamingASGIHandler(ASGIHandler):
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append(
+                (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": response_headers,
+            }
+        )
+
+        loop = asyncio.get_event_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response")
+        try:
+            # Access __iter__ and not streaming_content in case a subclass overrides it
+            content = await loop.run_in_executor(executor, iter, response)
+            done = object()
+            while (
+                part := await loop.run_in_executor(executor, next, content, done)
+            ) is not done:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            await send({"type": "http.response.body"})
+        finally:
+            await loop.run_in_executor(executor, _close, response)
+            executor.shutdown(wait=False)
+
+
+def _close(response):
+    """Close the response and the connections of the thread that read it"""
+
+    try:
+        response.close()
+    finally:
+        connections.close_all()
+
+
+def get_asgi_application() -> StreamingASGIHandler:
+    django.setup(set_prefix=False)
+    return StreamingASGIHandler()
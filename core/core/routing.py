@@ -1,9 +1,16 @@
-from channels.routing import ProtocolTypeRouter, URLRouter
-from django.core.asgi import get_asgi_application
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from django.urls import path
 
-from farms.consumers import ControllerConsumer
-from farms.utils import TokenAuthMiddleware
+from core.handlers import get_asgi_application
+from farms import expiry, scheduler
+from farms.consumers import (
+    CommandSchedulerConsumer,
+    ControllerConsumer,
+    DashboardConsumer,
+    TaskExpiryConsumer,
+)
+from farms.utils import TokenAuthMiddleware, UserTokenAuthMiddleware
 
 application = ProtocolTypeRouter(
     {
@@ -15,9 +22,22 @@ application = ProtocolTypeRouter(
                         "ws-api/v1/farms/controllers/",
                         ControllerConsumer.as_asgi(),
                         name="ws-controller",
-                    )
+                    ),
+                    path(
+                        "ws-api/v1/farms/dashboards/",
+                        AuthMiddlewareStack(
+                            UserTokenAuthMiddleware(DashboardConsumer.as_asgi())
+                        ),
+                        name="ws-dashboard",
+                    ),
                 ]
             )
-        )
+        ),
+        "channel": ChannelNameRouter(
+            {
+                scheduler.CHANNEL: CommandSchedulerConsumer.as_asgi(),
+                expiry.CHANNEL: TaskExpiryConsumer.as_asgi(),
+            }
+        ),
     }
 )
@@ -48,6 +48,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'core.graphql.tracing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 LOG_REQUEST_ID_HEADER = "X-Request-ID"
@@ -149,14 +154,33 @@ GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "AIzaSyD--your-google-maps-key
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# Threads executing the root fields of GraphQL queries concurrently, shared by the
+# requests of the process, see core.graphql.concurrent
+GRAPHQL_CONCURRENCY_THREADS = int(os.environ.get("GRAPHQL_CONCURRENCY_THREADS", 10))
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        # PostgreSQL with a connection pool per process
+        "ENGINE": "core.db.backends.postgresql_pool",
         "NAME": os.environ.get("DATABASE_NAME"),
         "USER": os.environ.get("DATABASE_USER"),
         "PASSWORD": os.environ.get("DATABASE_PASSWORD"),
         "HOST": os.environ.get("DATABASE_HOST"),
         "PORT": os.environ.get("DATABASE_PORT"),
+        "POOL": {
+            # A thread holds at most one connection, so size it to the ASGI threads
+            # and the threads executing GraphQL root fields
+            "MAX_SIZE": int(
+                os.environ.get(
+                    "DATABASE_POOL_SIZE",
+                    int(os.environ.get("ASGI_THREADS", 10))
+                    + GRAPHQL_CONCURRENCY_THREADS,
+                )
+            ),
+            "MAX_LIFETIME": int(os.environ.get("DATABASE_POOL_MAX_LIFETIME", 3600)),
+            "HEALTH_CHECK_AFTER": 30,
+            "TIMEOUT": 10,
+        },
     }
 }
 
@@ -167,6 +191,25 @@ if TESTING:
     # Override password hasher
     PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
 
+# Read replicas of the primary database, given as comma separated hosts. They share the
+# other connection settings with the primary. Read-only work, e.g., GraphQL queries and
+# exports, reads from them (see core/db/routers.py).
+DATABASE_REPLICAS = []
+for index, host in enumerate(os.environ.get("DATABASE_REPLICA_HOSTS", "").split(",")):
+    if host:
+        alias = f"replica_{index}"
+        DATABASES[alias] = {
+            **DATABASES["default"],
+            "HOST": host.strip(),
+            "TEST": {"MIRROR": "default"},
+        }
+        DATABASE_REPLICAS.append(alias)
+
+# Replicas lagging behind the primary more than this many seconds are not used
+DATABASE_REPLICA_MAX_LAG = float(os.environ.get("DATABASE_REPLICA_MAX_LAG", 10))
+
+DATABASE_ROUTERS = ["core.db.routers.ReplicaRouter"]
+
 # Celery and RabbitMQ
 if DEBUG:
     CELERY_BROKER_URL = "amqp://localhost"
@@ -232,6 +275,19 @@ OAUTH2_PROVIDER = {
 }
 
 CONTROLLER_TOKEN_BYTES = 20  # Length in bytes
+# Days controller messages are kept, the retention policy of the hypertable drops older
+# ones (see farms/migrations/0032_controllermessage_hypertable.py) and so does the
+# purge_controller_messages command
+CONTROLLER_MESSAGE_RETENTION_DAYS = int(
+    os.environ.get("CONTROLLER_MESSAGE_RETENTION_DAYS", 30)
+)
+
+# Directory of the Parquet archive of old data points, an empty value disables it
+DATA_POINT_ARCHIVE_DIR = os.environ.get(
+    "DATA_POINT_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive")
+)
+# Data points older than this many days are moved to the archive
+DATA_POINT_ARCHIVE_AFTER_DAYS = int(os.environ.get("DATA_POINT_ARCHIVE_AFTER_DAYS", 365))
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
@@ -265,6 +321,46 @@ else:
 
 GRAPHENE = {"SCHEMA": "core.schema.schema"}
 
+# Limits of GraphQL operations, checked before execution, see core.graphql.cost. The
+# cost estimates the rows an operation loads. Each user may spend the budget per window.
+GRAPHQL_MAX_DEPTH = int(os.environ.get("GRAPHQL_MAX_DEPTH", 15))
+GRAPHQL_MAX_COST = int(os.environ.get("GRAPHQL_MAX_COST", 50000))
+GRAPHQL_COST_BUDGET = int(os.environ.get("GRAPHQL_COST_BUDGET", 500000))
+GRAPHQL_COST_BUDGET_WINDOW = int(os.environ.get("GRAPHQL_COST_BUDGET_WINDOW", 60))
+
+# Documents the root fields of a GraphQL query are split into to execute them
+# concurrently, see core.graphql.concurrent. 1 executes them one after the other.
+GRAPHQL_CONCURRENCY = int(os.environ.get("GRAPHQL_CONCURRENCY", 4))
+
+# Tracing of GraphQL resolvers and their SQL queries, see core.graphql.tracing. Staff
+# users receive the trace with the X-GraphQL-Trace header and the sampled operations are
+# logged.
+GRAPHQL_TRACING = os.environ.get("GRAPHQL_TRACING", "") == "True"
+GRAPHQL_TRACING_SAMPLE_RATE = float(os.environ.get("GRAPHQL_TRACING_SAMPLE_RATE", 0.01))
+
+# Parsed and validated GraphQL documents kept in memory, see core.graphql.persisted
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get("GRAPHQL_DOCUMENT_CACHE_SIZE", 256))
+
+# Root fields of the GraphQL query that only return reference data, whose responses are
+# cached until a reference model changes, see core.graphql.reference and farms.signals
+GRAPHQL_REFERENCE_FIELDS = [
+    "controllerTaskEnums",
+    "peripheralComponentEnums",
+    "allDataPointTypes",
+    "dataPointType",
+    "allControllerComponentTypes",
+    "controllerComponentType",
+]
+
+# JSON file mapping the SHA-256 hashes of persisted queries to the queries
+GRAPHQL_PERSISTED_QUERIES_MANIFEST = os.environ.get(
+    "GRAPHQL_PERSISTED_QUERIES_MANIFEST"
+)
+# Seconds a query registered on first use is kept after its last use
+GRAPHQL_PERSISTED_QUERY_TIMEOUT = int(
+    os.environ.get("GRAPHQL_PERSISTED_QUERY_TIMEOUT", 7 * 24 * 3600)
+)
+
 # REDIS & Channels
 
 ASGI_APPLICATION = "core.routing.application"
@@ -277,6 +373,22 @@ if REDIS_PASSWORD:
 else:
     REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
 
+# Updates per second and series sent to a dashboard at most, see DashboardConsumer
+DASHBOARD_MAX_UPDATES_PER_SECOND = float(
+    os.environ.get("DASHBOARD_MAX_UPDATES_PER_SECOND", 2)
+)
+
+# Commands sent to controllers are retried after CONTROLLER_COMMAND_TIMEOUT seconds
+# without a result, multiplied by CONTROLLER_COMMAND_BACKOFF for each further attempt,
+# and failed after CONTROLLER_COMMAND_ATTEMPTS attempts, see farms.scheduler
+CONTROLLER_COMMAND_TIMEOUT = float(os.environ.get("CONTROLLER_COMMAND_TIMEOUT", 10))
+CONTROLLER_COMMAND_BACKOFF = float(os.environ.get("CONTROLLER_COMMAND_BACKOFF", 2))
+CONTROLLER_COMMAND_ATTEMPTS = int(os.environ.get("CONTROLLER_COMMAND_ATTEMPTS", 3))
+# Seconds in which the commands sent to a controller are coalesced into one message
+CONTROLLER_COMMAND_COALESCE_WINDOW = float(
+    os.environ.get("CONTROLLER_COMMAND_COALESCE_WINDOW", 0.02)
+)
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -284,6 +396,40 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+# The default cache holds the persisted GraphQL queries, the query cost budgets and the
+# version of the reference data (see core/graphql), which all processes have to share,
+# so it is stored in Redis. The tests use a local memory cache instead.
+# The data point cache holds results of closed time ranges (see farms/cache.py). Ingest
+# invalidates it, so with multiple processes it has to be shared, and it is stored in
+# another Redis database. Cached blocks expire after DATA_POINT_CACHE_TIMEOUT seconds.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "DEFAULT_CACHE_BACKEND", "django_redis.cache.RedisCache"
+        ),
+        "LOCATION": os.environ.get("DEFAULT_CACHE_LOCATION", f"{REDIS_URL}/1"),
+    },
+    "data_points": {
+        "BACKEND": os.environ.get(
+            "DATA_POINT_CACHE_BACKEND", "django_redis.cache.RedisCache"
+        ),
+        "LOCATION": os.environ.get("DATA_POINT_CACHE_LOCATION", f"{REDIS_URL}/2"),
+        "TIMEOUT": int(os.environ.get("DATA_POINT_CACHE_TIMEOUT", 7 * 24 * 3600)),
+    },
+}
+
+if TESTING:
+    CACHES["default"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    CACHES["data_points"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "data_points",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    }
+
 # CORS (Cross-Origin Resource Sharing)
 
 CORS_ALLOWED_ORIGINS = [
@@ -0,0 +1,91 @@
+import threading
+
+import psycopg2
+from django.db import connection
+from django.test import SimpleTestCase
+
+from core.db.backends.postgresql_pool.pool import ConnectionPool
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    databases = {"default"}
+
+    def setUp(self):
+        self.conn_params = connection.get_connection_params()
+
+    def test_reuse(self):
+        """Test that returned connections are reused"""
+
+        pool = ConnectionPool(self.conn_params, max_size=2)
+        first = pool.get()
+        pool.put(first)
+        self.assertIs(pool.get(), first)
+        second = pool.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(pool.stats()["connections_opened"], 2)
+        pool.put(first)
+        pool.put(second)
+        pool.close()
+        self.assertTrue(first.closed)
+        self.assertTrue(second.closed)
+
+    def test_rollback_on_put(self):
+        pool = ConnectionPool(self.conn_params, max_size=1)
+        conn = pool.get()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        pool.put(conn)
+        self.assertEqual(
+            conn.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        )
+        pool.close()
+
+    def test_wait_and_timeout(self):
+        """Test waiting for a connection when all are in use"""
+
+        pool = ConnectionPool(self.conn_params, max_size=1, timeout=0.1)
+        conn = pool.get()
+        with self.assertLogs("core.db.backends.postgresql_pool.pool", "ERROR"):
+            with self.assertRaises(psycopg2.OperationalError):
+                pool.get()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+        pool.timeout = 5
+        threading.Timer(0.1, pool.put, args=[conn]).start()
+        with self.assertLogs("core.db.backends.postgresql_pool.pool", "INFO"):
+            self.assertIs(pool.get(), conn)
+        stats = pool.stats()
+        self.assertEqual(stats["waits"], 1)
+        self.assertGreater(stats["wait_time_max"], 0.05)
+        pool.put(conn)
+        pool.close()
+
+    def test_recycling(self):
+        """Test that old and broken connections are replaced"""
+
+        pool = ConnectionPool(self.conn_params, max_lifetime=0)
+        conn = pool.get()
+        pool.put(conn)
+        self.assertTrue(conn.closed)
+
+        pool = ConnectionPool(self.conn_params, health_check_after=0)
+        broken, other = pool.get(), pool.get()
+        # Terminate a connection from another session while it is idle in the pool
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [broken.get_backend_pid()])
+        pool.put(other)
+        pool.put(broken)
+        self.assertIs(pool.get(), other)
+        self.assertEqual(pool.stats()["health_check_failures"], 1)
+        pool.put(other)
+        pool.close()
+
+    def test_foreign_connection(self):
+        """Test that connections of other pools are left alone"""
+
+        pool = ConnectionPool(self.conn_params)
+        conn = psycopg2.connect(**self.conn_params)
+        pool.put(conn)
+        self.assertFalse(conn.closed)
+        self.assertEqual(pool.stats()["idle"], 0)
+        conn.close()
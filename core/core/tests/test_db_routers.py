@@ -0,0 +1,77 @@
+import uuid
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from graphql_relay import to_global_id
+
+from core.db import routers
+from core.db.routers import ReplicaRouter, replica_reads
+from farms.models import Site
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0"], DATABASE_REPLICA_MAX_LAG=10)
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        routers._replica_health.clear()
+
+    def tearDown(self):
+        routers._replica_health.clear()
+
+    @mock.patch("core.db.routers.replica_lag", return_value=0)
+    def test_read_your_writes(self, replica_lag):
+        """Test that reads use the replica until the first write"""
+
+        self.assertIsNone(self.router.db_for_read(Site))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Site), "replica_0")
+            self.assertEqual(self.router.db_for_write(Site), "default")
+            self.assertIsNone(self.router.db_for_read(Site))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Site), "replica_0")
+        # The lag is checked once per interval
+        self.assertEqual(replica_lag.call_count, 1)
+
+    def test_replica_fallback(self):
+        """Test that lagging and unavailable replicas are not used"""
+
+        with replica_reads(), self.assertLogs("core.db.routers", "WARNING") as logs:
+            with mock.patch("core.db.routers.replica_lag", return_value=30):
+                self.assertIsNone(self.router.db_for_read(Site))
+            routers._replica_health.clear()
+            with mock.patch(
+                "core.db.routers.replica_lag", side_effect=DatabaseError("down")
+            ):
+                self.assertIsNone(self.router.db_for_read(Site))
+        self.assertIn("lags 30.0 seconds", logs.output[0])
+        self.assertIn("unavailable", logs.output[1])
+
+    @mock.patch("core.db.routers.choose_replica", return_value=None)
+    def test_graphql_operations(self, choose_replica):
+        """Test that only query operations read from replicas"""
+
+        self.client.force_login(
+            get_user_model().objects.create_user(email="owner@bar.com", password="foo")
+        )
+        response = self.client.post(
+            reverse("graphql"),
+            "{ allSites { edges { node { id } } } }",
+            content_type="application/graphql",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(choose_replica.called)
+
+        choose_replica.reset_mock()
+        task_id = to_global_id("ControllerTaskNode", uuid.uuid4())
+        response = self.client.post(
+            reverse("graphql"),
+            f"""mutation {{
+                stopControllerTask(input: {{taskId: "{task_id}"}}) {{ clientMutationId }}
+            }}""",
+            content_type="application/graphql",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(choose_replica.called)
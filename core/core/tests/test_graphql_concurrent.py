@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import AsyncClient, SimpleTestCase, TransactionTestCase
+from django.urls import resolve, reverse
+from graphql import parse
+
+from core.graphql import concurrent
+from farms.models import DataPointType, Site
+
+QUERY = """
+    query Overview($name: String) {
+        allDataPointTypes(name: $name) { edges { node { ...DataPointType } } }
+        sites: allSites { edges { node { name } } }
+        controllerTaskEnums { states { value } }
+    }
+
+    fragment DataPointType on DataPointTypeNode {
+        name
+    }
+"""
+
+
+class SplitOperationTest(SimpleTestCase):
+    def test_split(self):
+        """Test that query operations are split into documents of consecutive root
+        fields with the fragments"""
+
+        documents = concurrent.split_operation(parse(QUERY), None, 2)
+        self.assertEqual(
+            [
+                [
+                    field.name.value
+                    for field in document.definitions[0].selection_set.selections
+                ]
+                for document in documents
+            ],
+            [["allDataPointTypes", "allSites"], ["controllerTaskEnums"]],
+        )
+        for document in documents:
+            self.assertEqual(len(document.definitions[0].variable_definitions), 1)
+            self.assertEqual(len(document.definitions), 2)
+
+    def test_not_split(self):
+        for query in [
+            "mutation { a: __typename b: __typename }",
+            "{ allSites { edges { node { name } } } }",
+            "{ __typename __typename }",
+            "{ __typename ... on Query { allSites { edges { node { name } } } } }",
+        ]:
+            self.assertIsNone(concurrent.split_operation(parse(query), None, 4))
+        self.assertIsNone(concurrent.split_operation(parse(QUERY), None, 1))
+
+
+class ConcurrentExecutionTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(owner)
+        Site.objects.create(name="SiteA", owner=owner)
+        DataPointType.objects.create(name="Air Temperature", unit="°C")
+
+    def test_root_fields(self):
+        """Test that the root fields are executed in other threads and merged in
+        order"""
+
+        threads = set()
+        execute = concurrent.execute
+
+        def record_thread(*args, **kwargs):
+            threads.add(threading.get_ident())
+            return execute(*args, **kwargs)
+
+        with mock.patch("core.graphql.concurrent.execute", side_effect=record_thread):
+            response = self.client.post(
+                reverse("graphql"),
+                {"query": QUERY, "variables": {"name": "Air Temperature"}},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertNotIn("errors", content)
+        self.assertEqual(
+            list(content["data"]), ["allDataPointTypes", "sites", "controllerTaskEnums"]
+        )
+        self.assertEqual(
+            content["data"]["allDataPointTypes"]["edges"][0]["node"]["name"],
+            "Air Temperature",
+        )
+        self.assertEqual(content["data"]["sites"]["edges"][0]["node"]["name"], "SiteA")
+        self.assertNotIn(threading.get_ident(), threads)
+
+    async def test_asgi(self):
+        """Test that the view is served asynchronously under ASGI"""
+
+        view = resolve(reverse("graphql")).func
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        self.assertTrue(view.csrf_exempt)
+
+        client = AsyncClient()
+        client.cookies = self.client.cookies
+        response = await client.post(
+            reverse("graphql"), {"query": QUERY}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]["sites"]["edges"]), 1)
@@ -0,0 +1,131 @@
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from graphene_django.utils.testing import GraphQLTestCase
+from graphql import parse
+
+from core.graphql import cost
+from core.schema import schema
+from farms.models import Site
+
+PERIPHERALS_QUERY = """
+    query Peripherals($first: Int) {
+        allPeripheralComponents(first: $first) {
+            pageInfo {
+                hasNextPage
+            }
+            edges {
+                node {
+                    ...Peripheral
+                }
+            }
+        }
+    }
+
+    fragment Peripheral on PeripheralComponentNode {
+        siteEntity {
+            name
+        }
+        dataPointTypeEdges {
+            parameterPrefix
+        }
+        dataPointSet(first: 20) {
+            edges {
+                node {
+                    value
+                }
+            }
+        }
+    }
+"""
+
+
+class QueryCostTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch("core.graphql.cost.estimated_rows", return_value=None)
+    def test_analyze(self, estimated_rows):
+        """Test that connections are weighted by their page size and nested fields by
+        the number of times they are resolved"""
+
+        query_cost = cost.analyze(schema, parse(PERIPHERALS_QUERY))
+        # 100 peripherals, each with its site entity, 100 edges and 20 data points
+        self.assertEqual(query_cost.cost, 100 + 100 * (1 + 100 + 20))
+        self.assertEqual(query_cost.depth, 7)
+
+        query_cost = cost.analyze(
+            schema, parse(PERIPHERALS_QUERY), "Peripherals", {"first": 5}
+        )
+        self.assertEqual(query_cost.cost, 5 + 5 * (1 + 100 + 20))
+
+        query_cost = cost.analyze(
+            schema, parse(PERIPHERALS_QUERY), "Peripherals", {"first": 0}
+        )
+        self.assertEqual(query_cost.cost, 0)
+
+    @mock.patch("core.graphql.cost.estimated_rows", return_value=3)
+    def test_analyze_estimated_rows(self, estimated_rows):
+        """Test that pages and lists are limited by the estimated rows of the model"""
+
+        query_cost = cost.analyze(
+            schema, parse(PERIPHERALS_QUERY), variables={"first": 50}
+        )
+        self.assertEqual(query_cost.cost, 3 + 3 * (1 + 3 + 3))
+
+    def test_estimated_rows(self):
+        """Test that the rows are estimated from the table statistics"""
+
+        owner = get_user_model().objects.create_user(email="owner@bar.com")
+        Site.objects.bulk_create(Site(name=f"Site {i}", owner=owner) for i in range(3))
+        self.assertIsNone(cost.estimated_rows(Site))
+        cache.clear()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE farms_site")
+        self.assertEqual(cost.estimated_rows(Site), 3)
+
+
+class QueryCostViewTest(GraphQLTestCase):
+    def setUp(self):
+        cache.clear()
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self._client.force_login(owner)
+
+    @override_settings(GRAPHQL_MAX_DEPTH=6)
+    def test_max_depth(self):
+        response = self.query(PERIPHERALS_QUERY)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("The query depth 7 exceeds", response.content.decode())
+
+    @override_settings(GRAPHQL_MAX_COST=1000)
+    @mock.patch("core.graphql.cost.estimated_rows", return_value=None)
+    def test_max_cost(self, estimated_rows):
+        response = self.query(PERIPHERALS_QUERY, variables={"first": 5})
+        self.assertResponseNoErrors(response)
+        response = self.query(PERIPHERALS_QUERY)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("The query cost 12200 exceeds", response.content.decode())
+
+    @override_settings(GRAPHQL_COST_BUDGET=700, GRAPHQL_COST_BUDGET_WINDOW=3600)
+    @mock.patch("core.graphql.cost.estimated_rows", return_value=None)
+    def test_cost_budget(self, estimated_rows):
+        """Test that a user can spend the budget of a window and not more"""
+
+        for _ in range(2):
+            self.assertResponseNoErrors(
+                self.query(PERIPHERALS_QUERY, variables={"first": 2})
+            )
+        response = self.query(PERIPHERALS_QUERY, variables={"first": 2})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertIn("budget", json.loads(response.content)["errors"][0]["message"])
+        # The rejected operation did not spend the budget
+        self.assertResponseNoErrors(
+            self.query(PERIPHERALS_QUERY, variables={"first": 1})
+        )
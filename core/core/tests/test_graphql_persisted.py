@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.graphql import persisted
+from core.graphql.persisted import CachedBackend, query_hash
+from core.schema import schema
+
+QUERY = "{ peripheralComponentEnums { states { value } } }"
+
+
+class PersistedQueryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        persisted._manifest_queries = None
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(owner)
+
+    def tearDown(self):
+        persisted._manifest_queries = None
+
+    def post(self, sha256_hash, query=None):
+        persisted_query = {"version": 1, "sha256Hash": sha256_hash}
+        data = {"extensions": {"persistedQuery": persisted_query}}
+        if query is not None:
+            data["query"] = query
+        return self.client.post(
+            reverse("graphql"), json.dumps(data), content_type="application/json"
+        )
+
+    def test_register_on_first_use(self):
+        """Test that an unknown hash is reported and registered with its query"""
+
+        response = self.post(query_hash(QUERY))
+        self.assertEqual(response.status_code, 200)
+        error = response.json()["errors"][0]
+        self.assertEqual(error["message"], "PersistedQueryNotFound")
+        self.assertEqual(error["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND")
+
+        response = self.post(query_hash(QUERY), QUERY)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("errors", response.json())
+
+        response = self.post(query_hash(QUERY))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("peripheralComponentEnums", response.json()["data"])
+
+    @override_settings(GRAPHQL_PERSISTED_QUERY_TIMEOUT=100)
+    def test_expiry(self):
+        """Test that registered queries expire unless they are used"""
+
+        now = time.time()
+        with mock.patch.object(time, "time", return_value=now):
+            persisted.register_query(query_hash(QUERY), QUERY)
+        with mock.patch.object(time, "time", return_value=now + 90):
+            self.assertEqual(persisted.get_query(query_hash(QUERY)), QUERY)
+        with mock.patch.object(time, "time", return_value=now + 180):
+            self.assertEqual(persisted.get_query(query_hash(QUERY)), QUERY)
+        with mock.patch.object(time, "time", return_value=now + 281):
+            self.assertIsNone(persisted.get_query(query_hash(QUERY)))
+
+    def test_hash_mismatch(self):
+        response = self.post(query_hash("{ __typename }"), QUERY)
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(persisted.get_query(query_hash("{ __typename }")))
+
+    def test_manifest(self):
+        """Test that the queries of the manifest are known from the start"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "manifest.json")
+            with open(path, "w") as manifest_file:
+                json.dump({"enums": QUERY}, manifest_file)
+            with override_settings(GRAPHQL_PERSISTED_QUERIES_MANIFEST=path):
+                response = self.post("enums")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("peripheralComponentEnums", response.json()["data"])
+
+
+class CachedBackendTest(TestCase):
+    def test_document_cache(self):
+        """Test that documents are parsed and validated once and the least recently
+        used ones are evicted"""
+
+        backend = CachedBackend(max_size=2)
+        document = backend.document_from_string(schema, QUERY)
+        self.assertIs(backend.document_from_string(schema, QUERY), document)
+        self.assertIsNone(document.execute().errors)
+
+        invalid = backend.document_from_string(schema, "{ unknownField }")
+        self.assertTrue(invalid.execute().invalid)
+        # The first document is the least recently used one
+        backend.document_from_string(schema, "{ __typename }")
+        self.assertIsNot(backend.document_from_string(schema, QUERY), document)
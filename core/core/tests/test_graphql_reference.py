@@ -0,0 +1,138 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from graphql_relay import to_global_id
+
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    DataPointType,
+    PeripheralComponent,
+    PeripheralDataPointType,
+    Site,
+    SiteEntity,
+)
+
+DATA_POINT_TYPES_QUERY = """
+    {
+        allDataPointTypes {
+            edges {
+                node {
+                    name
+                    unit
+                }
+            }
+        }
+        controllerTaskEnums {
+            states {
+                value
+            }
+        }
+    }
+"""
+
+
+class ReferenceCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(owner)
+        self.owner = owner
+        self.air_temperature = DataPointType.objects.create(
+            name="Air Temperature", unit="°C"
+        )
+
+    def get(self, query, **headers):
+        return self.client.get(reverse("graphql"), {"query": query}, **headers)
+
+    def test_etag(self):
+        """Test that reference data is revalidated by its ETag until it changes"""
+
+        response = self.get(DATA_POINT_TYPES_QUERY)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        response = self.get(DATA_POINT_TYPES_QUERY, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        DataPointType.objects.create(name="Humidity", unit="%")
+        response = self.get(DATA_POINT_TYPES_QUERY, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("Humidity", response.content.decode())
+
+    def test_response_cache(self):
+        """Test that cached responses are served without executing the query"""
+
+        content = self.get(DATA_POINT_TYPES_QUERY).content
+        # The session and the user
+        with self.assertNumQueries(2):
+            response = self.get(DATA_POINT_TYPES_QUERY)
+        self.assertEqual(response.content, content)
+
+        response = self.client.post(
+            reverse("graphql"),
+            {"query": DATA_POINT_TYPES_QUERY},
+            content_type="application/json",
+        )
+        self.assertEqual(response["ETag"], self.get(DATA_POINT_TYPES_QUERY)["ETag"])
+
+    def test_other_data(self):
+        """Test that queries that select other than reference data are not cached"""
+
+        for query in [
+            "{ allPeripheralComponents { edges { node { state } } } }",
+            "{ allDataPointTypes { edges { node { peripheralComponentEdges { "
+            "parameterPrefix } } } } }",
+            "mutation { __typename }",
+        ]:
+            response = self.get(query)
+            self.assertNotIn("ETag", response)
+
+    def test_related_filters(self):
+        """Test that filters on relations to other than reference data are not cached"""
+
+        site = Site.objects.create(name="Site A", owner=self.owner)
+        entity = SiteEntity.objects.create(name="BME280 A", site=site)
+        bme280 = PeripheralComponent.objects.create(
+            site_entity=entity,
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+            ),
+        )
+        for argument, global_id in [
+            (
+                "peripheralComponentSet",
+                to_global_id("PeripheralComponentNode", bme280.pk),
+            ),
+            (
+                "peripheralComponentSet_SiteEntity",
+                to_global_id("SiteEntityNode", entity.pk),
+            ),
+        ]:
+            query = (
+                f'{{ allDataPointTypes({argument}: "{global_id}") '
+                "{ edges { node { name } } } }"
+            )
+            response = self.get(query)
+            self.assertNotIn("ETag", response)
+            self.assertNotIn("Air Temperature", response.content.decode())
+
+            edge = PeripheralDataPointType.objects.create(
+                peripheral=bme280, data_point_type=self.air_temperature
+            )
+            self.assertIn("Air Temperature", self.get(query).content.decode())
+            edge.delete()
+
+        # Filters on the fields of the reference data are cached
+        response = self.get(
+            '{ allDataPointTypes(name: "Humidity") { edges { node { name } } } }'
+        )
+        self.assertIn("ETag", response)
@@ -0,0 +1,78 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from farms.models import Site
+
+QUERY = """
+    query Sites {
+        allSites {
+            edges {
+                node {
+                    name
+                }
+            }
+        }
+    }
+"""
+
+
+@override_settings(GRAPHQL_TRACING=True, GRAPHQL_TRACING_SAMPLE_RATE=0)
+class TracingTest(TestCase):
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(self.owner)
+        Site.objects.create(name="SiteA", owner=self.owner)
+
+    def post(self, **headers):
+        return self.client.post(
+            reverse("graphql"),
+            {"query": QUERY, "operationName": "Sites"},
+            content_type="application/json",
+            **headers,
+        )
+
+    def test_extensions(self):
+        """Test that staff users receive the trace with the header"""
+
+        self.assertNotIn("extensions", self.post(HTTP_X_GRAPHQL_TRACE="1").json())
+        self.owner.is_staff = True
+        self.owner.save()
+        self.assertNotIn("extensions", self.post().json())
+
+        content = self.post(HTTP_X_GRAPHQL_TRACE="1").json()
+        self.assertEqual(
+            content["data"]["allSites"]["edges"][0]["node"]["name"], "SiteA"
+        )
+        trace = content["extensions"]["tracing"]
+        resolvers = {
+            tuple(resolver["path"]): resolver
+            for resolver in trace["execution"]["resolvers"]
+        }
+        all_sites = resolvers[("allSites",)]
+        self.assertEqual(all_sites["parentType"], "Query")
+        self.assertGreaterEqual(all_sites["sql"]["queries"], 1)
+        self.assertGreaterEqual(all_sites["sql"]["rows"], 1)
+        self.assertIn(("allSites", "edges", 0, "node", "name"), resolvers)
+        self.assertGreaterEqual(trace["sql"]["queries"], all_sites["sql"]["queries"])
+        self.assertGreaterEqual(trace["duration"], all_sites["duration"])
+
+    @override_settings(GRAPHQL_TRACING_SAMPLE_RATE=1)
+    def test_sampled_log(self):
+        with self.assertLogs("core.graphql.tracing", "INFO") as logs:
+            content = self.post().json()
+        self.assertNotIn("extensions", content)
+        self.assertIn("GraphQL operation Sites took", logs.output[0])
+        self.assertIn("allSites", logs.output[0])
+
+    @override_settings(GRAPHQL_TRACING=False, GRAPHQL_TRACING_SAMPLE_RATE=1)
+    def test_disabled(self):
+        self.owner.is_staff = True
+        self.owner.save()
+        with mock.patch("core.graphql.tracing.logger") as logger:
+            self.assertNotIn("extensions", self.post(HTTP_X_GRAPHQL_TRACE="1").json())
+        logger.info.assert_not_called()
@@ -29,6 +29,7 @@ urlpatterns = [
     path("admin/", admin.site.urls, name="admin"),
     path("accounts/", include("accounts.urls", namespace="accounts")),
     path("api/", include("accounts.urls_api")),
+    path("api/", include("farms.urls_api")),
     path("accounts/", include("django_registration.backends.activation.urls")),
     path("accounts/", include("django.contrib.auth.urls")),
     # API Endpoints
@@ -1,12 +1,33 @@
+import functools
+import json
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, AccessMixin
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotModified,
+    JsonResponse,
+)
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+from graphene_django.views import GraphQLView, HttpError
+from graphql import GraphQLError
+from graphql.execution import ExecutionResult
 from oauth2_provider.views.generic import ScopedProtectedResourceView
 from rest_framework.authentication import TokenAuthentication
 
+from core.db.routers import replica_reads
+from core.graphql import concurrent, cost, persisted, reference, tracing
+
 
 def index(request):
     return render(request, "homepage.html")
@@ -44,10 +65,322 @@ class TokenLoginRequiredMixin(AccessMixin):
         return super().dispatch(request, *args, **kwargs)
 
 
+class AsyncViewMixin:
+    """Serves the view asynchronously. Under ASGI, Django runs synchronous views in the
+    one thread shared by all synchronous code of the process, like the controller
+    consumer, so a slow view would hold them all up. The view runs in a thread of the
+    pool instead. Under WSGI, the view keeps the thread of its request."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            if isinstance(request, ASGIRequest):
+                run_view = database_sync_to_async(view, thread_sensitive=False)
+            else:
+                run_view = sync_to_async(view)
+            return await run_view(request, *args, **kwargs)
+
+        # Keep attributes like csrf_exempt
+        functools.update_wrapper(async_view, view)
+        return async_view
+
+
+class ConcurrentGraphQLMixin:
+    """Executes the root fields of query operations concurrently, see
+    core.graphql.concurrent. Requests within a transaction, like in tests, are executed
+    as a whole, since the connections of other threads do not see its writes."""
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        arguments = (request, data, query, variables, operation_name, show_graphiql)
+        if not query or show_graphiql or connection.in_atomic_block:
+            return super().execute_graphql_request(*arguments)
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query
+            )
+        except Exception:  # pylint: disable=broad-except
+            return super().execute_graphql_request(*arguments)
+        if getattr(document, "validation_errors", True):
+            return super().execute_graphql_request(*arguments)
+
+        documents = concurrent.split_operation(
+            document.document_ast, operation_name, settings.GRAPHQL_CONCURRENCY
+        )
+        if documents is None:
+            return super().execute_graphql_request(*arguments)
+        return concurrent.execute_concurrently(
+            self.schema,
+            documents,
+            context_value=self.get_context(request),
+            root_value=self.get_root_value(request),
+            variable_values=variables,
+            operation_name=operation_name,
+            middleware=self.get_middleware(request),
+        )
+
+
+class ReplicaGraphQLMixin:
+    """Executes query operations with reads from a replica. Mutations use the primary
+    for reads as well, so they read their own writes."""
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        arguments = (request, data, query, variables, operation_name, show_graphiql)
+        if query and self.get_operation_type(request, query, operation_name) == "query":
+            with replica_reads():
+                return super().execute_graphql_request(*arguments)
+        return super().execute_graphql_request(*arguments)
+
+    def get_operation_type(self, request, query, operation_name):
+        """The type of the operation, None if the document is invalid. Errors are
+        reported when the request is executed."""
+
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query
+            )
+            return document.get_operation_type(operation_name)
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+
+class PersistedQueryMixin:
+    """Executes persisted queries given by their hash and caches the parsed and
+    validated documents"""
+
+    def get_backend(self, request):
+        return persisted.backend
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        sha256_hash = self.get_persisted_query_hash(request, data)
+        if sha256_hash is not None:
+            query = self.get_persisted_query(sha256_hash, query)
+            if query is None:
+                return ExecutionResult(
+                    errors=[
+                        GraphQLError(
+                            "PersistedQueryNotFound",
+                            extensions={"code": "PERSISTED_QUERY_NOT_FOUND"},
+                        )
+                    ]
+                )
+        return super().execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+
+    @staticmethod
+    def get_persisted_query_hash(request, data) -> Optional[str]:
+        """The hash of the persisted query extension, None without one"""
+
+        extensions = request.GET.get("extensions") or data.get("extensions") or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError as err:
+                raise HttpError(
+                    HttpResponseBadRequest("Extensions are invalid JSON.")
+                ) from err
+        persisted_query = extensions.get("persistedQuery")
+        if isinstance(persisted_query, dict) and "sha256Hash" in persisted_query:
+            return str(persisted_query["sha256Hash"])
+        return None
+
+    @staticmethod
+    def get_persisted_query(sha256_hash: str, query: Optional[str]) -> Optional[str]:
+        """Register the query with the hash if given, else look it up. None if the hash
+        is unknown."""
+
+        if not query:
+            return persisted.get_query(sha256_hash)
+        try:
+            persisted.register_query(sha256_hash, query)
+        except ValueError as err:
+            raise HttpError(HttpResponseBadRequest(str(err))) from err
+        return query
+
+
+class ReferenceCacheMixin:
+    """Serves query operations that only select reference data, see
+    core.graphql.reference, from a cache. The responses have strong ETags made of the
+    version of the reference data, so clients revalidate them with conditional GET
+    requests. Requires the PersistedQueryMixin."""
+
+    def dispatch(self, request, *args, **kwargs):
+        cache_key = self.get_reference_cache_key(request)
+        if cache_key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = f'"{cache_key}"'
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponseNotModified()
+        else:
+            content = reference.get_response(cache_key)
+            if content is not None:
+                response = HttpResponse(content, content_type="application/json")
+            else:
+                response = super().dispatch(request, *args, **kwargs)
+                # Responses with errors or traces are not cached
+                if response.status_code != 200 or list(
+                    json.loads(response.content)
+                ) != ["data"]:
+                    return response
+                reference.set_response(cache_key, response.content)
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_reference_cache_key(self, request) -> Optional[str]:
+        """The cache key of the response, None if the request does not only select
+        reference data"""
+
+        if request.method not in ("GET", "POST"):
+            return None
+        try:
+            data = self.parse_body(request) if request.method == "POST" else {}
+            if not isinstance(data, dict) or (
+                self.graphiql and self.can_display_graphiql(request, data)
+            ):
+                return None
+            query, variables, operation_name, _ = self.get_graphql_params(
+                request, data
+            )
+            sha256_hash = self.get_persisted_query_hash(request, data)
+            if sha256_hash is not None:
+                query = self.get_persisted_query(sha256_hash, query)
+            document = self.get_backend(request).document_from_string(
+                self.schema, query
+            )
+        except Exception:  # pylint: disable=broad-except
+            # Invalid requests are reported by the execution
+            return None
+        if not reference.is_reference_operation(
+            self.schema, document.document_ast, operation_name
+        ):
+            return None
+        return reference.cache_key(query, variables, operation_name)
+
+
+class QueryCostMixin:
+    """Rejects operations that are too deep or too expensive, or exceed the cost budget
+    of the user, before they are executed"""
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        arguments = (request, data, query, variables, operation_name, show_graphiql)
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query
+            )
+        except Exception:  # pylint: disable=broad-except
+            # Missing and invalid documents are reported by the execution
+            return super().execute_graphql_request(*arguments)
+
+        query_cost = cost.analyze(
+            self.schema, document.document_ast, operation_name, variables
+        )
+        if query_cost.depth > settings.GRAPHQL_MAX_DEPTH:
+            return ExecutionResult(
+                errors=[
+                    GraphQLError(
+                        f"The query depth {query_cost.depth} exceeds the maximum of "
+                        f"{settings.GRAPHQL_MAX_DEPTH}"
+                    )
+                ],
+                invalid=True,
+            )
+        if query_cost.cost > settings.GRAPHQL_MAX_COST:
+            return ExecutionResult(
+                errors=[
+                    GraphQLError(
+                        f"The query cost {query_cost.cost} exceeds the maximum of "
+                        f"{settings.GRAPHQL_MAX_COST}"
+                    )
+                ],
+                invalid=True,
+            )
+        retry_after = cost.spend_budget(
+            self.get_budget_key(request),
+            query_cost.cost,
+            settings.GRAPHQL_COST_BUDGET,
+            settings.GRAPHQL_COST_BUDGET_WINDOW,
+        )
+        if retry_after is not None:
+            response = HttpResponse(status=429)
+            response["Retry-After"] = str(retry_after)
+            raise HttpError(
+                response,
+                f"The query cost budget is spent, retry in {retry_after} seconds",
+            )
+        return super().execute_graphql_request(*arguments)
+
+    @staticmethod
+    def get_budget_key(request) -> str:
+        if request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"address:{request.META.get('REMOTE_ADDR')}"
+
+
+class TracingGraphQLMixin:
+    """Traces the resolvers of the operation with GRAPHQL_TRACING, see
+    core.graphql.tracing"""
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        arguments = (request, data, query, variables, operation_name, show_graphiql)
+        request.graphql_trace = trace = tracing.start_trace(request)
+        if trace is None:
+            return super().execute_graphql_request(*arguments)
+        with tracing.recording_sql(request):
+            result = super().execute_graphql_request(*arguments)
+        trace.finish(operation_name)
+        return result
+
+    def get_middleware(self, request):
+        middleware = super().get_middleware(request) or []
+        if tracing.get_trace(request) is None:
+            return middleware
+        return [*middleware, tracing.TracingMiddleware()]
+
+    def json_encode(self, request, d, pretty=False):
+        trace = tracing.get_trace(request)
+        if trace is not None and trace.respond:
+            d = {**d, "extensions": {"tracing": trace.to_dict()}}
+        return super().json_encode(request, d, pretty)
+
+
 @method_decorator(csrf_exempt, name="dispatch")
-class TokenGraphQLView(TokenLoginRequiredMixin, GraphQLView):
+class TokenGraphQLView(
+    AsyncViewMixin,
+    TokenLoginRequiredMixin,
+    ReferenceCacheMixin,
+    PersistedQueryMixin,
+    QueryCostMixin,
+    TracingGraphQLMixin,
+    ReplicaGraphQLMixin,
+    ConcurrentGraphQLMixin,
+    GraphQLView,
+):
     authentication_classes = [TokenAuthentication]
 
 
-class SessionGraphQLView(LoginRequiredMixin, GraphQLView):
+class SessionGraphQLView(
+    AsyncViewMixin,
+    LoginRequiredMixin,
+    ReferenceCacheMixin,
+    PersistedQueryMixin,
+    QueryCostMixin,
+    TracingGraphQLMixin,
+    ReplicaGraphQLMixin,
+    ConcurrentGraphQLMixin,
+    GraphQLView,
+):
     pass
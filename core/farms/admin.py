@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 
 from .models import (
     ControllerAuthToken,
@@ -70,6 +72,23 @@ class ControllerAuthTokenAdmin(admin.ModelAdmin):
         return form
 
 
+class CappedCountPaginator(Paginator):
+    """Counts at most MAX_COUNT objects, as counting a large table is slow. The objects
+    beyond are reached by filtering."""
+
+    MAX_COUNT = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[: self.MAX_COUNT].count()
+
+
 @admin.register(ControllerMessage)
 class ControllerMessageAdmin(admin.ModelAdmin):
-    pass
+    list_display = ("created_at", "controller", "request_id")
+    list_select_related = ("controller__site_entity",)
+    list_filter = ("controller",)
+    search_fields = ("=request_id",)
+    ordering = ("-created_at",)
+    paginator = CappedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,174 @@
+"""Cold storage of old data points in Parquet files.
+
+Data points older than the archive horizon are moved from the database into zstd
+compressed Parquet files, partitioned into one directory per month and peripheral
+component:
+
+    <DATA_POINT_ARCHIVE_DIR>/2021-01/<peripheral component ID>/<part ID>.parquet
+
+Within a file, the data points are sorted by data point type and time and split into
+row groups, so reads skip the directories outside the selected months and peripheral
+components and the row groups outside the time range and data point types by their
+statistics. The watermark is the time before which data points may be archived; reads of
+older data points merge the archive with the database."""
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+# Rows per row group, the unit in which row groups are skipped on reads
+ROW_GROUP_SIZE = 10000
+
+WATERMARK_FILE = "WATERMARK"
+
+if pyarrow is not None:
+    SCHEMA = pyarrow.schema(
+        [
+            ("time", pyarrow.timestamp("us", tz="UTC")),
+            ("peripheral_component", pyarrow.string()),
+            ("data_point_type", pyarrow.string()),
+            ("value", pyarrow.float64()),
+        ]
+    )
+
+
+def is_available() -> bool:
+    """Whether the archive can be used"""
+
+    return pyarrow is not None and bool(settings.DATA_POINT_ARCHIVE_DIR)
+
+
+def get_watermark() -> Optional[datetime]:
+    """The time before which data points may be archived, None without an archive"""
+
+    if not is_available():
+        return None
+    try:
+        with open(_path(WATERMARK_FILE)) as watermark_file:
+            return datetime.fromisoformat(watermark_file.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def set_watermark(watermark: datetime):
+    os.makedirs(settings.DATA_POINT_ARCHIVE_DIR, exist_ok=True)
+    temporary_path = _path(f".{WATERMARK_FILE}.{uuid.uuid4().hex}")
+    with open(temporary_path, "w") as watermark_file:
+        watermark_file.write(watermark.isoformat())
+    os.replace(temporary_path, _path(WATERMARK_FILE))
+
+
+def month_start(time: datetime) -> datetime:
+    """The start of the month of the time in UTC"""
+
+    time = time.astimezone(timezone.utc)
+    return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(time: datetime) -> datetime:
+    start = month_start(time)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def write_rows(
+    month: datetime, peripheral_id: str, rows: List[Tuple[datetime, str, float]]
+) -> str:
+    """Write the (time, data point type ID, value) rows of a peripheral component in the
+    month as a new file. Returns the path of the file."""
+
+    rows = sorted(rows, key=lambda row: (str(row[1]), row[0]))
+    times, types, values = zip(*rows) if rows else ((), (), ())
+    table = pyarrow.Table.from_arrays(
+        [
+            pyarrow.array(times, SCHEMA.field("time").type),
+            pyarrow.array([str(peripheral_id)] * len(rows), pyarrow.string()),
+            pyarrow.array([str(type_id) for type_id in types], pyarrow.string()),
+            pyarrow.array(values, pyarrow.float64()),
+        ],
+        schema=SCHEMA,
+    )
+    directory = _path(f"{month_start(month):%Y-%m}", str(peripheral_id))
+    os.makedirs(directory, exist_ok=True)
+    name = uuid.uuid4().hex
+    temporary_path = os.path.join(directory, f".{name}.tmp")
+    path = os.path.join(directory, f"{name}.parquet")
+    pyarrow.parquet.write_table(
+        table, temporary_path, row_group_size=ROW_GROUP_SIZE, compression="zstd"
+    )
+    os.replace(temporary_path, path)
+    return path
+
+
+def read_tables(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    peripheral_ids: Optional[Iterable[str]] = None,
+    data_point_type_ids: Optional[Iterable[str]] = None,
+) -> Iterator["pyarrow.Table"]:
+    """Read the archived data points in the range month by month, each table sorted by
+    time. Only the files of the selected months and peripheral components are opened,
+    and the time and type filters are pushed down to their row groups."""
+
+    watermark = get_watermark()
+    if watermark is None:
+        return
+    end = min(end, watermark) if end is not None else watermark
+    if start is not None and start >= end:
+        return
+    months = sorted(
+        name
+        for name in os.listdir(settings.DATA_POINT_ARCHIVE_DIR)
+        if not name.startswith(".") and name != WATERMARK_FILE
+    )
+    if peripheral_ids is not None:
+        peripheral_ids = {str(peripheral_id) for peripheral_id in peripheral_ids}
+
+    time_type = SCHEMA.field("time").type
+    expression = pyarrow.dataset.field("time") < pyarrow.scalar(end, time_type)
+    if start is not None:
+        expression &= pyarrow.dataset.field("time") >= pyarrow.scalar(start, time_type)
+    if data_point_type_ids is not None:
+        expression &= pyarrow.dataset.field("data_point_type").isin(
+            [str(type_id) for type_id in data_point_type_ids]
+        )
+
+    for month in months:
+        month_time = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+        if month_time >= end or (start is not None and next_month(month_time) <= start):
+            continue
+        files = [
+            os.path.join(directory, name)
+            for directory in _peripheral_directories(month, peripheral_ids)
+            for name in os.listdir(directory)
+            if name.endswith(".parquet")
+        ]
+        if not files:
+            continue
+        dataset = pyarrow.dataset.dataset(files, schema=SCHEMA, format="parquet")
+        table = dataset.to_table(filter=expression)
+        if table.num_rows:
+            yield table.sort_by("time")
+
+
+def _peripheral_directories(month: str, peripheral_ids: Optional[set]) -> List[str]:
+    month_directory = _path(month)
+    if peripheral_ids is None:
+        names = os.listdir(month_directory)
+    else:
+        names = [name for name in peripheral_ids if os.path.isdir(_path(month, name))]
+    return [os.path.join(month_directory, name) for name in names]
+
+
+def _path(*parts: str) -> str:
+    return os.path.join(settings.DATA_POINT_ARCHIVE_DIR, *parts)
@@ -0,0 +1,189 @@
+"""Cache of data point query results over closed time ranges.
+
+Dashboards query the same historical windows over and over, e.g., the last seven days
+only move at their right edge. The time axis is therefore split into fixed blocks that
+are aligned to the time buckets. The results of a block are cached once the block is
+closed, i.e., it ended before the settle time, when no new data points are expected for
+it anymore. Only the open right edge, the partial buckets at the borders of the range
+and blocks that are not cached yet are read from the database, in a single query.
+
+Each series, a peripheral component and data point type pair, has a generation token
+that is part of the cache keys. Writing a data point into the closed past, e.g., when a
+controller delivers buffered telemetry late, replaces the token and thereby invalidates
+all cached blocks of the series."""
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import caches
+
+# Name of the cache in the CACHES setting
+CACHE_ALIAS = "data_points"
+
+# Data points may still arrive this long after their time, so younger blocks are open
+SETTLE_TIME = timedelta(minutes=5)
+
+# Ranges spanning more blocks than this are read from the database without caching
+MAX_BLOCKS = 1000
+
+# The origin of the time buckets, equal to the default origin of TimescaleDB's
+# time_bucket function
+ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+# A series given as (peripheral component ID, data point type ID)
+Series = Tuple[str, str]
+
+# A time range of a series to read from the database
+Range = Tuple[Series, datetime, datetime]
+
+
+def invalidate(series: Iterable[Series]):
+    """Invalidate the cached blocks of the series by replacing their generation"""
+
+    caches[CACHE_ALIAS].set_many(
+        {_generation_key(key): uuid.uuid4().hex for key in series}, timeout=None
+    )
+
+
+def is_settled(time: datetime, now: Optional[datetime] = None) -> bool:
+    """Whether a data point at the time falls into the closed blocks"""
+
+    return time < (now or datetime.now(timezone.utc)) - SETTLE_TIME
+
+
+class BlockCache:
+    """Caches rows of a query per series and block of time.
+
+    The rows are tuples with the time, or the start of the time bucket, as their first
+    element. The namespace identifies the query and its parameters. If a step, the time
+    bucket width, is given, the blocks have to be a multiple of it and only buckets that
+    lie entirely inside the requested range are taken from the cache."""
+
+    def __init__(
+        self, namespace: str, block_width: timedelta, step: Optional[timedelta] = None
+    ):
+        if step is not None and block_width % step:
+            raise ValueError("The block width has to be a multiple of the step")
+        self.namespace = namespace
+        self.block_width = block_width
+        self.step = step
+
+    def get(
+        self,
+        series: List[Series],
+        start: datetime,
+        end: datetime,
+        fetch: Callable[[List[Range]], List[List[Tuple]]],
+        now: Optional[datetime] = None,
+    ) -> Dict[Series, List[Tuple]]:
+        """Get the rows of the series in the range ordered by time. The rows that are not
+        cached are read with fetch, which gets a list of ranges and returns the rows of
+        each range. Ranges of the same series may overlap, so fetch has to compute each
+        range independently."""
+
+        now = now or datetime.now(timezone.utc)
+        lower = ceil_time(start, self.step) if self.step else start
+        upper = floor_time(end, self.step) if self.step else end
+        blocks = []
+        block = floor_time(lower, self.block_width)
+        while block < upper and block + self.block_width <= now - SETTLE_TIME:
+            blocks.append(block)
+            block += self.block_width
+        if not blocks or len(blocks) > MAX_BLOCKS:
+            rows = fetch([(key, start, end) for key in series])
+            return dict(zip(series, rows))
+
+        # The part of the range that is covered by blocks
+        covered_lower = max(lower, blocks[0])
+        covered_upper = min(upper, blocks[-1] + self.block_width)
+
+        cache = caches[CACHE_ALIAS]
+        generations = self._generations(series)
+        keys = {
+            (key, block): self._block_key(key, generations[key], block)
+            for key in series
+            for block in blocks
+        }
+        cached = cache.get_many(keys.values())
+
+        # The ranges to read and the blocks each one fills. Consecutive missing blocks
+        # are read as one range.
+        ranges: List[Range] = []
+        targets: List[Dict[datetime, str]] = []
+        for key in series:
+            if start < covered_lower:
+                ranges.append((key, start, covered_lower))
+                targets.append({})
+            if covered_upper < end:
+                ranges.append((key, covered_upper, end))
+                targets.append({})
+            previous = None
+            for block in blocks:
+                if keys[(key, block)] in cached:
+                    continue
+                if previous is not None and previous + self.block_width == block:
+                    ranges[-1] = (key, ranges[-1][1], block + self.block_width)
+                else:
+                    ranges.append((key, block, block + self.block_width))
+                    targets.append({})
+                targets[-1][block] = keys[(key, block)]
+                previous = block
+        fetched = fetch(ranges) if ranges else []
+
+        results: Dict[Series, List[Tuple]] = {key: [] for key in series}
+        new_blocks: Dict[str, List[Tuple]] = {}
+        for (key, _, _), target, rows in zip(ranges, targets, fetched):
+            if not target:
+                results[key].extend(rows)
+                continue
+            new_blocks.update({block_key: [] for block_key in target.values()})
+            for row in rows:
+                new_blocks[target[floor_time(row[0], self.block_width)]].append(row)
+        if new_blocks:
+            # Blocks of replaced generations are never read again and expire
+            cache.set_many(new_blocks)
+        blocks_rows = {**cached, **new_blocks}
+        for (key, block), block_key in keys.items():
+            results[key].extend(
+                row
+                for row in blocks_rows[block_key]
+                if covered_lower <= row[0] < covered_upper
+            )
+        for rows in results.values():
+            rows.sort(key=lambda row: row[0])
+        return results
+
+    def _generations(self, series: List[Series]) -> Dict[Series, str]:
+        """Get the generation tokens of the series, creating missing ones"""
+
+        cache = caches[CACHE_ALIAS]
+        keys = {key: _generation_key(key) for key in series}
+        generations = cache.get_many(keys.values())
+        for key, generation_key in keys.items():
+            if generation_key not in generations:
+                cache.add(generation_key, uuid.uuid4().hex, timeout=None)
+                generations[generation_key] = cache.get(generation_key)
+        return {key: generations[generation_key] for key, generation_key in keys.items()}
+
+    def _block_key(self, series: Series, generation: str, block: datetime) -> str:
+        return (
+            f"{self.namespace}:{series[0]}:{series[1]}:{generation}:"
+            f"{int(block.timestamp())}"
+        )
+
+
+def floor_time(time: datetime, width: timedelta) -> datetime:
+    """The start of the time bucket of the width containing the time"""
+
+    return time - (time - ORIGIN) % width
+
+
+def ceil_time(time: datetime, width: timedelta) -> datetime:
+    """The first time bucket border of the width at or after the time"""
+
+    floor = floor_time(time, width)
+    return floor if floor == time else floor + width
+
+
+def _generation_key(series: Series) -> str:
+    return f"generation:{series[0]}:{series[1]}"
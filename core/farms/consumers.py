@@ -1,44 +1,125 @@
+import asyncio
 import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
 
-from channels.generic.websocket import WebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.consumer import AsyncConsumer
+from channels.generic.websocket import (
+    AsyncJsonWebsocketConsumer,
+    AsyncWebsocketConsumer,
+)
+from django.conf import settings
+from graphql_relay import from_global_id, to_global_id
 
+from farms import expiry, scheduler
+from farms.graphql.nodes import DataPointTypeNode, PeripheralComponentNode
 from farms.serializers import ControllerMessageSerializer
 from farms.models import (
+    ControllerComponent,
     ControllerMessage,
     ControllerTask,
     DataPoint,
     PeripheralComponent,
 )
 
+logger = logging.getLogger(__name__)
+
+
+class CommandBatch:
+    """Peripheral and task commands coalesced into one command message.
+
+    Controllers apply the peripheral commands of a message before its task commands,
+    and the commands of each list in order. Commands are therefore only added if they
+    keep their order: peripheral commands while no task commands are pending, and
+    commands of a kind only with the same lists as the pending ones, e.g. task starts
+    with task starts, and not for tasks or peripherals with pending commands."""
+
+    def __init__(self, request_id: str):
+        # The request ID of the first commands, the results are acknowledged by the IDs
+        # of the tasks and peripherals
+        self.request_id = request_id
+        self.commands: Dict[str, Dict[str, List[Dict]]] = {
+            scheduler.PERIPHERAL: {},
+            scheduler.TASK: {},
+        }
+        self.ids: Set[Tuple[str, str]] = set()
+
+    def add(self, kind: str, commands: Dict[str, List[Dict]]) -> bool:
+        """Add the commands of a kind, False if they have to be sent in a later
+        message"""
+
+        pending = self.commands[kind]
+        ids = {(kind, pk) for pk in scheduler.command_ids(kind, commands)}
+        if (
+            (kind == scheduler.PERIPHERAL and self.commands[scheduler.TASK])
+            or (pending and set(pending) != set(commands))
+            or ids & self.ids
+        ):
+            return False
+        for name, name_commands in commands.items():
+            pending.setdefault(name, []).extend(name_commands)
+        self.ids |= ids
+        return True
+
+    def to_message(self) -> Dict:
+        return ControllerMessage.to_command_message(
+            peripheral_commands=self.commands[scheduler.PERIPHERAL],
+            task_commands=self.commands[scheduler.TASK],
+            request_id=self.request_id,
+        )
+
 
-class ControllerConsumer(WebsocketConsumer):
-    """Handle JSON messages being sent to and from controllers"""
+class ControllerConsumer(AsyncWebsocketConsumer):
+    """Handle JSON messages being sent to and from controllers. The commands sent to a
+    controller within CONTROLLER_COMMAND_COALESCE_WINDOW seconds are coalesced into one
+    command message, see CommandBatch."""
 
     class InvalidData(Exception):
         pass
 
+    def handle_invalid_results(
+        self, message: ControllerMessage, errors: Dict[str, str]
+    ):
+        """Log the results that did not match the states of their tasks or peripherals,
+        e.g., repeated or outdated results"""
+
+        if errors:
+            logger.warning(
+                "Invalid results of controller %s in request %s: %s",
+                message.controller_id,
+                message.request_id,
+                ", ".join(f"{pk}: {error}" for pk, error in errors.items()),
+            )
+
     def handle_errors(self, data):
         """Handle errors sent by the controller. Currently only prints them."""
         # print(data)
 
-    def handle_register(self, message: ControllerMessage):
-        """Handle register messages"""
+    def handle_register(self, message: ControllerMessage) -> Dict:
+        """Handle register messages. Returns the command message to reply with."""
 
         peripheral_commands = PeripheralComponent.objects.commands_from_register(
             message.to_peripheral_register(), message.controller_id
         )
-        self.send_peripheral_commands(
-            {"commands": peripheral_commands, "request_id": message.request_id}
-        )
+        scheduler.track(scheduler.PERIPHERAL, peripheral_commands, message.request_id)
         task_commands = ControllerTask.objects.commands_from_register(
             message.to_task_register(), message.controller_id
         )
-        self.send_controller_task_commands(
-            {"commands": task_commands, "request_id": message.request_id}
+        scheduler.track(scheduler.TASK, task_commands, message.request_id)
+        expiry.wake_up()
+        return ControllerMessage.to_command_message(
+            peripheral_commands=peripheral_commands,
+            task_commands=task_commands,
+            request_id=message.request_id,
         )
 
-    def handle_message(self, json_message, controller):
-        """Handle messages sent from the controller"""
+    def handle_message(self, json_message, controller) -> Optional[Dict]:
+        """Handle messages sent from the controller. Returns the message to reply with,
+        if any."""
 
         serializer = ControllerMessageSerializer(
             data={
@@ -58,12 +139,16 @@ class ControllerConsumer(WebsocketConsumer):
             elif data := message.to_errors():
                 self.handle_errors(data)
             elif message.is_register_type():
-                self.handle_register(message)
+                return self.handle_register(message)
             elif message.is_result_type():
                 if data := message.to_peripheral_results():
-                    PeripheralComponent.objects.from_results(data)
+                    _, errors = PeripheralComponent.objects.from_results(data)
+                    self.handle_invalid_results(message, errors)
+                    scheduler.acknowledge(scheduler.PERIPHERAL, data)
                 if data := message.to_task_results():
-                    ControllerTask.objects.from_results(data)
+                    _, errors = ControllerTask.objects.from_results(data)
+                    self.handle_invalid_results(message, errors)
+                    scheduler.acknowledge(scheduler.TASK, data)
             elif message.is_system_type():
                 pass
             elif message.is_command_type():
@@ -72,45 +157,401 @@ class ControllerConsumer(WebsocketConsumer):
                 raise self.InvalidData(f"Unkown message type: {message.get_type()}")
         except ValueError as err:
             raise self.InvalidData(err) from err
+        return None
 
-    def connect(self):
+    async def connect(self):
+        self.batch: Optional[CommandBatch] = None
+        self.flush_task: Optional[asyncio.Task] = None
         controller = self.scope["controller"]
         if controller:
             controller.channel_name = self.channel_name
-            controller.save()
-            self.accept()
+            await database_sync_to_async(controller.save)()
+            await self.accept()
         else:
-            self.close()
+            await self.close()
+
+    async def disconnect(self, code):
+        # The commands are sent again when the controller registers
+        if getattr(self, "flush_task", None) is not None:
+            self.flush_task.cancel()
+        # Mark the controller as disconnected, unless it connected again meanwhile
+        if controller := self.scope.get("controller"):
+            await database_sync_to_async(
+                ControllerComponent.objects.filter(
+                    pk=controller.pk, channel_name=self.channel_name
+                ).update
+            )(channel_name="")
 
-    def disconnect_controller(self, event) -> None:
+    async def disconnect_controller(self, event) -> None:
         """Closes the WebSocket connection"""
 
         if errors := event.get("errors", ""):
             # print(f"Disconnect errors: {errors}")
-            self.send(json.dumps({"errors": errors}))
-        self.close()
+            await self.send(json.dumps({"errors": errors}))
+        await self.close()
 
-    def receive(self, text_data=None, bytes_data=None):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
             data = json.loads(text_data)
-            self.handle_message(data, self.scope["controller"].pk)
+            reply = await database_sync_to_async(self.handle_message)(
+                data, self.scope["controller"].pk
+            )
         except json.decoder.JSONDecodeError:
-            self.disconnect_controller({"errors": "Invalid JSON data"})
+            await self.disconnect_controller({"errors": "Invalid JSON data"})
+            return
         except self.InvalidData as err:
-            self.disconnect_controller({"errors": str(err.args)})
+            await self.disconnect_controller({"errors": str(err.args)})
+            return
+        if reply is not None:
+            await self.flush_commands()
+            await self.send(json.dumps(reply))
 
-    def send_peripheral_commands(self, message):
+    async def send_peripheral_commands(self, message):
         """Send peripheral commands to the controller"""
 
-        request = ControllerMessage.to_command_message(
-            peripheral_commands=message["commands"], request_id=message["request_id"]
+        await self.queue_commands(
+            scheduler.PERIPHERAL, message["commands"], message["request_id"]
         )
-        self.send(json.dumps(request))
 
-    def send_controller_task_commands(self, message):
+    async def send_controller_task_commands(self, message):
         """Send task commands to the controller"""
 
-        request = ControllerMessage.to_command_message(
-            task_commands=message["commands"], request_id=message["request_id"]
+        await self.queue_commands(
+            scheduler.TASK, message["commands"], message["request_id"]
+        )
+
+    async def queue_commands(self, kind: str, commands: Dict, request_id: str):
+        """Add commands to the pending command message, which is sent at the end of the
+        coalescing window or before commands that cannot be added to it"""
+
+        if not commands:
+            return
+        if self.batch is not None and not self.batch.add(kind, commands):
+            await self.flush_commands()
+        if self.batch is None:
+            self.batch = CommandBatch(request_id)
+            self.batch.add(kind, commands)
+            self.flush_task = asyncio.ensure_future(self.flush_commands_later())
+
+    async def flush_commands_later(self):
+        await asyncio.sleep(settings.CONTROLLER_COMMAND_COALESCE_WINDOW)
+        self.flush_task = None
+        await self.flush_commands()
+
+    async def flush_commands(self):
+        """Send the pending command message, if any"""
+
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.batch is not None:
+            message = self.batch.to_message()
+            self.batch = None
+            await self.send(json.dumps(message))
+
+
+class CommandSchedulerConsumer(AsyncConsumer):
+    """Worker retrying the commands sent to controllers until they are acknowledged,
+    see farms.scheduler"""
+
+    managers = {
+        scheduler.TASK: ControllerTask.objects,
+        scheduler.PERIPHERAL: PeripheralComponent.objects,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler.CommandScheduler(
+            timeout=settings.CONTROLLER_COMMAND_TIMEOUT,
+            backoff=settings.CONTROLLER_COMMAND_BACKOFF,
+            attempts=settings.CONTROLLER_COMMAND_ATTEMPTS,
+        )
+        self.wakeup = asyncio.Event()
+        self.timer: Optional[asyncio.Future] = None
+
+    async def commands_sent(self, event):
+        await self.start_timer()
+        self.scheduler.add(
+            event["kind"], event["ids"], event["request_id"], time.monotonic()
+        )
+        self.wakeup.set()
+
+    async def commands_acknowledged(self, event):
+        await self.start_timer()
+        self.scheduler.acknowledge(event["kind"], event["ids"])
+
+    async def worker_started(self, event):
+        await self.start_timer()
+
+    async def start_timer(self):
+        """On the first event, track the commands left outstanding before the worker
+        started and start the timer"""
+
+        if self.timer is not None:
+            return
+        for kind, pending_ids in (await self.get_pending_ids()).items():
+            if pending_ids:
+                self.scheduler.add(kind, pending_ids, "", time.monotonic())
+        self.timer = asyncio.ensure_future(self.run_timer())
+
+    async def run_timer(self):
+        """Retry or fail the commands whose deadline passed"""
+
+        while True:
+            deadline = self.scheduler.next_deadline()
+            timeout = None if deadline is None else deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            for command in self.scheduler.pop_expired(time.monotonic()):
+                try:
+                    await self.retry(command)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Retrying the commands %s failed", command.ids)
+
+    async def retry(self, command: scheduler.Command):
+        """Send the commands again with the next attempt or fail them after the last"""
+
+        fail = self.scheduler.is_last_attempt(command)
+        pending_ids = await database_sync_to_async(
+            self.managers[command.kind].retry_commands
+        )(list(command.ids), command.request_id, fail)
+        if pending_ids:
+            self.scheduler.add(
+                command.kind,
+                pending_ids,
+                command.request_id,
+                time.monotonic(),
+                command.attempt + 1,
+            )
+
+    @database_sync_to_async
+    def get_pending_ids(self) -> Dict[str, List[str]]:
+        return {
+            kind: [
+                str(pk)
+                for pk in manager.filter(
+                    state__in=manager.model.PENDING_STATES
+                ).values_list("pk", flat=True)
+            ]
+            for kind, manager in self.managers.items()
+        }
+
+
+class TaskExpiryConsumer(AsyncConsumer):
+    """Worker stopping the running tasks whose run until time passed, see
+    farms.expiry"""
+
+    # Seconds to wait before trying again after an error
+    RETRY_DELAY = 10
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wakeup = asyncio.Event()
+        self.timer: Optional[asyncio.Future] = None
+
+    async def tasks_changed(self, event):
+        if self.timer is None:
+            self.timer = asyncio.ensure_future(self.run_timer())
+        self.wakeup.set()
+
+    async def run_timer(self):
+        """Stop the expired tasks and sleep until the next run until time"""
+
+        while True:
+            self.wakeup.clear()
+            timeout = None
+            try:
+                await database_sync_to_async(ControllerTask.objects.stop_expired)()
+                if run_until := await database_sync_to_async(
+                    ControllerTask.objects.next_run_until
+                )():
+                    timeout = max(
+                        (run_until - datetime.now(tz=timezone.utc)).total_seconds(), 0
+                    )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Stopping the expired tasks failed")
+                timeout = self.RETRY_DELAY
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class DashboardConsumer(AsyncJsonWebsocketConsumer):
+    """Stream new data points of the subscribed series to dashboards.
+
+    Clients subscribe to series, given as peripheral component and data point type
+    pairs, or to all series of sites with their GraphQL IDs:
+
+        {"type": "subscribe", "series": [{"peripheral_component": "...",
+         "data_point_type": "..."}], "sites": ["..."]}
+
+    and unsubscribe with the same message of type "unsubscribe". The new data points of
+    a series are sent at most DASHBOARD_MAX_UPDATES_PER_SECOND times per second, the
+    data points arriving in between are coalesced into the next update. Once
+    MAX_PENDING_POINTS data points of a series are pending, they are sent right away, so
+    bursts of data points are not dropped."""
+
+    # Pending data points per series that are sent without waiting for the interval
+    MAX_PENDING_POINTS = 1000
+
+    async def connect(self):
+        if not self.scope["user"].is_authenticated:
+            await self.close()
+            return
+        # The subscribed data point types of each peripheral component, None for all
+        self.subscriptions: Dict[str, Optional[Set[str]]] = {}
+        self.pending: Dict[Tuple[str, str], List[Tuple[str, float]]] = {}
+        self.sent_at: Dict[Tuple[str, str], float] = {}
+        self.flush_tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.interval = 1 / settings.DASHBOARD_MAX_UPDATES_PER_SECOND
+        # Browsers require one of the requested subprotocols to be accepted
+        subprotocols = self.scope.get("subprotocols") or [None]
+        await self.accept(subprotocol=subprotocols[0])
+
+    async def disconnect(self, code):
+        for task in getattr(self, "flush_tasks", {}).values():
+            task.cancel()
+        for peripheral_id in getattr(self, "subscriptions", {}):
+            await self.channel_layer.group_discard(
+                DataPoint.group_name(peripheral_id), self.channel_name
+            )
+
+    async def receive_json(self, content, **kwargs):
+        try:
+            message_type = content.get("type")
+            if message_type not in ("subscribe", "unsubscribe"):
+                raise ValueError(f"Unknown message type: {message_type}")
+            series = await self.series_from_message(content)
+        except (AttributeError, KeyError, TypeError, ValueError) as err:
+            await self.send_json({"type": "error", "errors": str(err)})
+            return
+        if message_type == "subscribe":
+            await self.subscribe(series)
+        else:
+            await self.unsubscribe(series)
+        await self.send_json({"type": f"{message_type}d"})
+
+    async def subscribe(self, series: List[Tuple[str, Optional[str]]]):
+        for peripheral_id, type_id in series:
+            if peripheral_id not in self.subscriptions:
+                self.subscriptions[peripheral_id] = set()
+                await self.channel_layer.group_add(
+                    DataPoint.group_name(peripheral_id), self.channel_name
+                )
+            if type_id is None:
+                self.subscriptions[peripheral_id] = None
+            elif self.subscriptions[peripheral_id] is not None:
+                self.subscriptions[peripheral_id].add(type_id)
+
+    async def unsubscribe(self, series: List[Tuple[str, Optional[str]]]):
+        for peripheral_id, type_id in series:
+            if peripheral_id not in self.subscriptions:
+                continue
+            if type_id is not None and self.subscriptions[peripheral_id] is not None:
+                self.subscriptions[peripheral_id].discard(type_id)
+                if self.subscriptions[peripheral_id]:
+                    continue
+            del self.subscriptions[peripheral_id]
+            await self.channel_layer.group_discard(
+                DataPoint.group_name(peripheral_id), self.channel_name
+            )
+
+    @database_sync_to_async
+    def series_from_message(self, content: Dict) -> List[Tuple[str, Optional[str]]]:
+        """Get the (peripheral component ID, data point type ID) pairs of a message. The
+        type is None for the peripheral components of the sites. Raises ValueError on
+        invalid IDs."""
+
+        series = [
+            (
+                _uuid_from_global_id(selector["peripheral_component"]),
+                _uuid_from_global_id(selector["data_point_type"]),
+            )
+            for selector in content.get("series", [])
+        ]
+        if sites := content.get("sites", []):
+            site_ids = [_uuid_from_global_id(site) for site in sites]
+            series.extend(
+                (str(peripheral_id), None)
+                for peripheral_id in PeripheralComponent.objects.filter(
+                    site_entity__site_id__in=site_ids
+                ).values_list("pk", flat=True)
+            )
+        return series
+
+    async def data_points_new(self, event):
+        """Queue new data points of a subscribed peripheral component"""
+
+        peripheral_id = event["peripheral_component"]
+        if peripheral_id not in self.subscriptions:
+            return
+        types = self.subscriptions[peripheral_id]
+        updated = set()
+        for data_point in event["data_points"]:
+            if types is not None and data_point["data_point_type"] not in types:
+                continue
+            key = (peripheral_id, data_point["data_point_type"])
+            points = self.pending.setdefault(key, [])
+            points.append((data_point["time"], data_point["value"]))
+            if len(points) < self.MAX_PENDING_POINTS:
+                updated.add(key)
+                continue
+            if task := self.flush_tasks.pop(key, None):
+                task.cancel()
+            updated.discard(key)
+            await self.send_update(key)
+        for key in updated:
+            await self.schedule_update(key)
+
+    async def schedule_update(self, key: Tuple[str, str]):
+        """Send the pending data points of the series now or once the interval since
+        its last update has passed"""
+
+        if key in self.flush_tasks:
+            return
+        loop = asyncio.get_event_loop()
+        delay = self.sent_at.get(key, float("-inf")) + self.interval - loop.time()
+        if delay <= 0:
+            await self.send_update(key)
+        else:
+            self.flush_tasks[key] = asyncio.ensure_future(
+                self.send_update_later(key, delay)
+            )
+
+    async def send_update_later(self, key: Tuple[str, str], delay: float):
+        await asyncio.sleep(delay)
+        del self.flush_tasks[key]
+        await self.send_update(key)
+
+    async def send_update(self, key: Tuple[str, str]):
+        """Send the pending data points of a series as parallel 'time' and 'value'
+        lists"""
+
+        points = self.pending.pop(key, [])
+        if not points:
+            return
+        self.sent_at[key] = asyncio.get_event_loop().time()
+        await self.send_json(
+            {
+                "type": "data_points",
+                "peripheral_component": to_global_id(
+                    PeripheralComponentNode._meta.name, key[0]
+                ),
+                "data_point_type": to_global_id(DataPointTypeNode._meta.name, key[1]),
+                "time": [time for time, _ in points],
+                "value": [value for _, value in points],
+            }
         )
-        self.send(json.dumps(request))
+
+
+def _uuid_from_global_id(global_id: str) -> str:
+    """Decode a GraphQL ID to the UUID of the object. Raises ValueError if invalid."""
+
+    try:
+        return str(uuid.UUID(from_global_id(global_id)[1]))
+    except (TypeError, ValueError, UnicodeDecodeError) as err:
+        raise ValueError(f"Invalid ID: {global_id}") from err
@@ -0,0 +1,32 @@
+"""Stopping of the controller tasks whose run until time passed.
+
+Controllers stop their tasks after the duration of the start command, but they lose the
+timer when they reboot. The task expiry worker, started with `./manage.py
+run_task_expiry`, stops the running tasks once their run until time passed, independent
+of the controllers. It stops the tasks that expired while it was not running when it
+starts, then sleeps until the earliest run until time of the running tasks, found with a
+partial index, and is woken up whenever tasks start running or controllers register,
+which may change it."""
+import logging
+from typing import Dict
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "controller-task-expiry"
+
+
+def wake_up():
+    """Make the worker look up the earliest run until time of the running tasks"""
+
+    _send({"type": "tasks.changed"})
+
+
+def _send(message: Dict):
+    try:
+        async_to_sync(get_channel_layer().send)(CHANNEL, message)
+    except ChannelFull:
+        logger.warning("The task expiry worker does not keep up, is it running?")
@@ -0,0 +1,213 @@
+"""Streaming exports of data points as CSV, NDJSON or Parquet.
+
+The data points are read with a server-side cursor in chunks and each chunk is encoded
+and yielded before the next one is fetched, so memory stays flat independent of the size
+of the export."""
+import csv
+import heapq
+import io
+import json
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from farms import archive
+from farms.models import DataPoint, DataPointType, PeripheralComponent
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+# Number of rows fetched from the server-side cursor and encoded at a time
+CHUNK_SIZE = 10000
+
+# The exported columns and the data point fields they are read from
+COLUMNS = [
+    ("time", "time"),
+    ("site", "peripheral_component__site_entity__site_id"),
+    ("peripheral_component", "peripheral_component_id"),
+    ("peripheral_component_name", "peripheral_component__site_entity__name"),
+    ("data_point_type", "data_point_type_id"),
+    ("data_point_type_name", "data_point_type__name"),
+    ("unit", "data_point_type__unit"),
+    ("value", "value"),
+]
+
+# Content type and file extension of each export format
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def data_point_rows(
+    site_ids: Optional[List[uuid.UUID]] = None,
+    peripheral_ids: Optional[List[uuid.UUID]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple]:
+    """Iterate over the rows of the selected data points from oldest to newest, read
+    with a server-side cursor and merged with the archive. Raises ValueError on invalid
+    arguments."""
+
+    queryset = DataPoint.objects.all()
+    peripherals = PeripheralComponent.objects.all()
+    if site_ids:
+        site_ids = _to_uuids(site_ids)
+        queryset = queryset.filter(
+            peripheral_component__site_entity__site_id__in=site_ids
+        )
+        peripherals = peripherals.filter(site_entity__site_id__in=site_ids)
+    if peripheral_ids:
+        peripheral_ids = _to_uuids(peripheral_ids)
+        queryset = queryset.filter(peripheral_component_id__in=peripheral_ids)
+        peripherals = peripherals.filter(pk__in=peripheral_ids)
+    if start is not None:
+        start = DataPoint.to_timezone_datetime(start)
+        queryset = queryset.filter(time__gte=start)
+    if end is not None:
+        end = DataPoint.to_timezone_datetime(end)
+        queryset = queryset.filter(time__lt=end)
+    rows = (
+        queryset.order_by("time")
+        .values_list(*[field for _, field in COLUMNS])
+        .iterator(chunk_size=chunk_size)
+    )
+    watermark = archive.get_watermark()
+    if watermark is None or (start is not None and start >= watermark):
+        return rows
+    archived_rows = _archived_rows(peripherals, start, end)
+    return heapq.merge(archived_rows, rows, key=lambda row: row[0])
+
+
+def export_data_points(
+    rows: Iterable[Tuple], file_format: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Encode the rows in the file format chunk by chunk. Raises ValueError for unknown
+    or unavailable formats."""
+
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {file_format}")
+    if file_format == "parquet" and pyarrow is None:
+        raise ValueError("The Parquet export requires the pyarrow package")
+    encoder = {"csv": _to_csv, "ndjson": _to_ndjson, "parquet": _to_parquet}
+    return encoder[file_format](_chunks(rows, chunk_size))
+
+
+def _archived_rows(
+    peripherals, start: Optional[datetime], end: Optional[datetime]
+) -> Iterator[Tuple]:
+    """Iterate over the archived rows of the peripheral components from oldest to
+    newest, with the same columns as the database rows"""
+
+    peripherals = {
+        str(peripheral_id): (site_id, peripheral_id, name)
+        for peripheral_id, site_id, name in peripherals.values_list(
+            "pk", "site_entity__site_id", "site_entity__name"
+        )
+    }
+    types = {
+        str(type_id): (type_id, name, unit)
+        for type_id, name, unit in DataPointType.objects.values_list(
+            "pk", "name", "unit"
+        )
+    }
+    for table in archive.read_tables(start, end, peripherals.keys()):
+        for time, peripheral_id, type_id, value in zip(
+            *[table.column(name).to_pylist() for name in archive.SCHEMA.names]
+        ):
+            yield (time, *peripherals[peripheral_id], *types[type_id], value)
+
+
+def _to_uuids(ids: Iterable) -> List[uuid.UUID]:
+    try:
+        return [uuid.UUID(str(id_)) for id_ in ids]
+    except ValueError as err:
+        raise ValueError(f"Invalid ID: {err}") from err
+
+
+def _chunks(rows: Iterable[Tuple], chunk_size: int) -> Iterator[List[Tuple]]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def _to_csv(chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column for column, _ in COLUMNS])
+    for chunk in chunks:
+        writer.writerows((time.isoformat(), *values) for time, *values in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _to_ndjson(chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    columns = [column for column, _ in COLUMNS]
+    for chunk in chunks:
+        lines = []
+        for row in chunk:
+            data: Dict = dict(zip(columns, row))
+            data["time"] = data["time"].isoformat()
+            lines.append(json.dumps(data, default=str))
+        yield ("\n".join(lines) + "\n").encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file collecting the written bytes until they are taken out"""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        """Return and clear the bytes written since the last call"""
+
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _to_parquet(chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    schema = pyarrow.schema(
+        [
+            ("time", pyarrow.timestamp("us", tz="UTC")),
+            ("site", pyarrow.string()),
+            ("peripheral_component", pyarrow.string()),
+            ("peripheral_component_name", pyarrow.string()),
+            ("data_point_type", pyarrow.string()),
+            ("data_point_type_name", pyarrow.string()),
+            ("unit", pyarrow.string()),
+            ("value", pyarrow.float64()),
+        ]
+    )
+    sink = _ChunkSink()
+    # Each chunk is written as a row group and flushed to the response
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            for index in (1, 2, 4):
+                columns[index] = [str(value) for value in columns[index]]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            yield sink.take()
+    yield sink.take()
@@ -0,0 +1,178 @@
+"""The Grafana JSON datasource API.
+
+Grafana reads data points with the JSON datasource plugin instead of connecting to the
+database. A target is a series given as "<peripheral component ID>:<data point type
+ID>"; the search lists the series of all peripheral components. Queries return at most
+maxDataPoints buckets of at least intervalMs per target, read from the rollups where
+possible (see DataPointManager.downsample). Annotations mark the errors reported by
+controllers."""
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+from farms.models import (
+    ControllerMessage,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    PeripheralDataPointType,
+)
+
+# Default number of data points per target if Grafana does not set maxDataPoints
+MAX_DATA_POINTS = 1000
+
+# Number of annotations returned at most
+MAX_ANNOTATIONS = 1000
+
+
+def search(target: str = "") -> List[Dict]:
+    """List the series whose site, peripheral component or data point type name
+    contains the target"""
+
+    edges = PeripheralDataPointType.objects.select_related(
+        "peripheral__site_entity__site", "data_point_type"
+    ).order_by(
+        "peripheral__site_entity__site__name",
+        "peripheral__site_entity__name",
+        "data_point_type__name",
+    )
+    results = []
+    for edge in edges:
+        text = _series_name(
+            edge.peripheral.site_entity.site.name,
+            edge.peripheral.site_entity.name,
+            edge.data_point_type.name,
+            edge.data_point_type.unit,
+        )
+        if target.lower() in text.lower():
+            value = f"{edge.peripheral_id}:{edge.data_point_type_id}"
+            results.append({"text": text, "value": value})
+    return results
+
+
+def query(body: Dict) -> List[Dict]:
+    """Answer a query with one time series of [value, milliseconds] pairs per target.
+    The aggregate of a target is set in its data as {"aggregate": "max"}, it defaults
+    to the average. Raises ValueError on invalid queries."""
+
+    try:
+        start = DataPoint.to_timezone_datetime(body["range"]["from"])
+        end = DataPoint.to_timezone_datetime(body["range"]["to"])
+        interval = timedelta(milliseconds=body.get("intervalMs") or 0)
+        max_points = int(body.get("maxDataPoints") or MAX_DATA_POINTS)
+        targets = [
+            (
+                _parse_target(target["target"]),
+                (target.get("data") or {}).get("aggregate", "avg"),
+            )
+            for target in body.get("targets", [])
+            if target.get("target") and not target.get("hide")
+        ]
+    except (KeyError, TypeError, AttributeError) as err:
+        raise ValueError(f"Invalid query: {err}") from err
+    if not targets:
+        return []
+
+    # The series of each aggregate are read together
+    series_by_aggregate: Dict[str, List[Tuple[str, str]]] = {}
+    for series, aggregate in targets:
+        series_by_aggregate.setdefault(aggregate, []).append(series)
+    results = {}
+    for aggregate, series in series_by_aggregate.items():
+        for result in DataPoint.objects.downsample(
+            series, start, end, interval, max_points, aggregate
+        ):
+            key = (result["peripheral_component_id"], result["data_point_type_id"])
+            results[(key, aggregate)] = result
+
+    names = _series_names([series for series, _ in targets])
+    responses = []
+    for series, aggregate in targets:
+        result = results[(series, aggregate)]
+        responses.append(
+            {
+                "target": names.get(series, ":".join(series)),
+                "datapoints": [
+                    [value, int(time.timestamp() * 1000)]
+                    for time, value in zip(
+                        result["time"], result["values"][aggregate]
+                    )
+                ],
+            }
+        )
+    return responses
+
+
+def annotations(body: Dict) -> List[Dict]:
+    """List the errors reported by controllers in the range, only the ones of the site
+    if the annotation query is a site ID. Raises ValueError on invalid queries."""
+
+    try:
+        start = DataPoint.to_timezone_datetime(body["range"]["from"])
+        end = DataPoint.to_timezone_datetime(body["range"]["to"])
+        annotation = body.get("annotation") or {}
+        site_id = annotation.get("query") or None
+        if site_id is not None:
+            site_id = uuid.UUID(site_id)
+    except (KeyError, TypeError, AttributeError, ValueError) as err:
+        raise ValueError(f"Invalid annotation query: {err}") from err
+
+    messages = ControllerMessage.objects.filter(
+        created_at__gte=start,
+        created_at__lt=end,
+        message__type=ControllerMessage.ERROR_TYPE,
+    )
+    if site_id is not None:
+        messages = messages.filter(controller__site_entity__site_id=site_id)
+    messages = messages.select_related("controller__site_entity").order_by(
+        "created_at"
+    )[:MAX_ANNOTATIONS]
+    return [
+        {
+            "annotation": annotation,
+            "time": int(message.created_at.timestamp() * 1000),
+            "title": f"Error of {message.controller.site_entity.name}",
+            "text": str(message.message.get("errors", "")),
+            "tags": [message.controller.site_entity.name],
+        }
+        for message in messages
+    ]
+
+
+def _parse_target(target: str) -> Tuple[str, str]:
+    """Parse a target into a (peripheral component ID, data point type ID) pair. Raises
+    ValueError if it is invalid."""
+
+    try:
+        peripheral_id, type_id = target.split(":")
+        return str(uuid.UUID(peripheral_id)), str(uuid.UUID(type_id))
+    except ValueError as err:
+        raise ValueError(f"Invalid target: {target}") from err
+
+
+def _series_names(series: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    peripherals = {
+        str(peripheral_id): (site_name, name)
+        for peripheral_id, site_name, name in PeripheralComponent.objects.filter(
+            pk__in={peripheral_id for peripheral_id, _ in series}
+        ).values_list("pk", "site_entity__site__name", "site_entity__name")
+    }
+    types = {
+        str(type_id): (name, unit)
+        for type_id, name, unit in DataPointType.objects.filter(
+            pk__in={type_id for _, type_id in series}
+        ).values_list("pk", "name", "unit")
+    }
+    return {
+        (peripheral_id, type_id): _series_name(
+            *peripherals[peripheral_id], *types[type_id]
+        )
+        for peripheral_id, type_id in series
+        if peripheral_id in peripherals and type_id in types
+    }
+
+
+def _series_name(
+    site_name: str, peripheral_name: str, type_name: str, unit: str
+) -> str:
+    return f"{site_name} / {peripheral_name} / {type_name} ({unit})"
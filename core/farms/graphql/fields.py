@@ -0,0 +1,125 @@
+import binascii
+import json
+from functools import reduce
+from operator import or_
+from typing import Any, List, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Model, Q, QuerySet
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql import GraphQLError
+from graphql_relay.utils import base64, unbase64
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """A filter connection field paginated by a keyset instead of an offset.
+
+    The edges are ordered by the keyset fields in descending order and the cursor
+    encodes the keyset values of an edge. The page after a cursor is selected by a range
+    condition on the keyset instead of an OFFSET, so the database seeks directly through
+    the index and a deep page costs the same as the first one. The keyset has to be
+    unique. Subclasses define the keyset, e.g., ("time", "peripheral_component")."""
+
+    keyset: Tuple[str, ...] = ()
+    CURSOR_PREFIX = "keyset:"
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        queryset: QuerySet = maybe_queryset(iterable)
+        if not isinstance(queryset, QuerySet):
+            raise TypeError("Keyset pagination requires a queryset")
+        if args.get("first") is not None and args.get("last") is not None:
+            raise GraphQLError("Either 'first' or 'last' may be used, not both")
+
+        # Paginate backwards by reversing the order and the edges afterwards
+        backwards = args.get("last") is not None or (
+            args.get("before") and args.get("first") is None
+        )
+        limit = args.get("last" if backwards else "first") or max_limit
+        model = queryset.model
+        fields = [model._meta.get_field(name) for name in cls.keyset]
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:
+            # The cursors are made of the keyset
+            queryset = queryset.only(*loaded, *cls.keyset)
+        if backwards:
+            order = [field.attname for field in fields]
+        else:
+            order = [f"-{field.attname}" for field in fields]
+        queryset = queryset.order_by(*order)
+        if after := args.get("after"):
+            queryset = queryset.filter(cls._seek(fields, cls.from_cursor(after), "lt"))
+        if before := args.get("before"):
+            queryset = queryset.filter(cls._seek(fields, cls.from_cursor(before), "gt"))
+
+        nodes = list(queryset[: limit + 1] if limit is not None else queryset)
+        has_more = limit is not None and len(nodes) > limit
+        nodes = nodes[:limit]
+        if backwards:
+            nodes.reverse()
+        edges = [
+            connection.Edge(node=node, cursor=cls.to_cursor(node)) for node in nodes
+        ]
+        connection = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backwards else bool(after),
+                has_next_page=bool(before) if backwards else has_more,
+            ),
+        )
+        connection.iterable = iterable
+        return connection
+
+    @classmethod
+    def to_cursor(cls, node: Model) -> str:
+        """Encode the keyset values of a node as cursor"""
+
+        values = [
+            model_field.value_to_string(node)
+            for model_field in (node._meta.get_field(name) for name in cls.keyset)
+        ]
+        return base64(cls.CURSOR_PREFIX + json.dumps(values))
+
+    @classmethod
+    def from_cursor(cls, cursor: str) -> List[str]:
+        """Decode the keyset values of a cursor. Raises a GraphQLError if invalid."""
+
+        try:
+            cursor = unbase64(cursor)
+            if not cursor.startswith(cls.CURSOR_PREFIX):
+                raise ValueError("Missing cursor prefix")
+            values = json.loads(cursor[len(cls.CURSOR_PREFIX) :])
+        except (binascii.Error, ValueError) as err:
+            raise GraphQLError("Invalid cursor") from err
+        if not isinstance(values, list) or len(values) != len(cls.keyset):
+            raise GraphQLError("Invalid cursor")
+        return values
+
+    @staticmethod
+    def _seek(fields: List[Any], values: List[str], lookup: str) -> Q:
+        """Create the keyset condition (a, b) < (x, y) with lookup 'lt', or > with 'gt'.
+        The leading field is also bounded on its own so that an index range scan is
+        used: a <= x AND (a < x OR (a = x AND b < y))."""
+
+        try:
+            values = [field.to_python(value) for field, value in zip(fields, values)]
+        except (ValidationError, TypeError) as err:
+            raise GraphQLError("Invalid cursor") from err
+        conditions = []
+        for index, field in enumerate(fields):
+            equal = {prior.attname: values[i] for i, prior in enumerate(fields[:index])}
+            conditions.append(
+                Q(**equal, **{f"{field.attname}__{lookup}": values[index]})
+            )
+        bound = Q(**{f"{fields[0].attname}__{lookup}e": values[0]})
+        return bound & reduce(or_, conditions)
+
+
+class DataPointConnectionField(KeysetConnectionField):
+    """Data points paginated by the (time, peripheral component) keyset"""
+
+    keyset = ("time", "peripheral_component")
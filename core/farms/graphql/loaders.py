@@ -0,0 +1,85 @@
+"""Request-scoped DataLoaders for the relations of the nodes.
+
+Resolving a relation of every node of a page would run one query per node. The loaders
+collect the keys of all nodes of a page and load the related objects with one query per
+relation. They live as long as the request, so an object is loaded at most once per
+request."""
+from collections import defaultdict
+from typing import Dict, Tuple, Type
+
+from django.db import models
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+class RelationLoader(DataLoader):
+    """Loads the objects of a model whose field equals the key. Each key resolves to the
+    first object, None if there is none, or to the list of all objects if many."""
+
+    def __init__(self, model: Type[models.Model], field_name: str, many: bool):
+        super().__init__()
+        self.model = model
+        self.field_name = field_name
+        self.many = many
+
+    def batch_load_fn(self, keys):
+        objects = defaultdict(list)
+        for instance in self.model._default_manager.filter(
+            **{f"{self.field_name}__in": keys}
+        ):
+            objects[getattr(instance, self.field_name)].append(instance)
+        if self.many:
+            return Promise.resolve([objects.get(key, []) for key in keys])
+        return Promise.resolve([next(iter(objects.get(key, [])), None) for key in keys])
+
+
+def get_loader(
+    info, model: Type[models.Model], field_name: str = "pk", many: bool = False
+) -> RelationLoader:
+    """Get the loader of the request for the model and field"""
+
+    loaders: Dict[Tuple, RelationLoader] = info.context.__dict__.setdefault(
+        "relation_loaders", {}
+    )
+    key = (model, field_name, many)
+    if key not in loaders:
+        loaders[key] = RelationLoader(model, field_name, many)
+    return loaders[key]
+
+
+def load_related(info, instance: models.Model, name: str) -> Promise:
+    """Load a relation of the instance: the related object of a foreign key or one to
+    one field, either direction, or the list of objects of a reverse foreign key.
+    Relations that were loaded with the instance are taken as they are."""
+
+    field = instance._meta.get_field(name)
+    if field.many_to_one or field.one_to_one:
+        if field.is_cached(instance):
+            return Promise.resolve(field.get_cached_value(instance))
+        if field.concrete:
+            key = getattr(instance, field.attname)
+            if key is None:
+                return Promise.resolve(None)
+            return get_loader(
+                info, field.related_model, field.target_field.attname
+            ).load(key)
+        return get_loader(info, field.related_model, field.field.attname).load(
+            instance.pk
+        )
+    if field.one_to_many:
+        prefetched = getattr(instance, "_prefetched_objects_cache", {})
+        if field.get_cache_name() in prefetched:
+            return Promise.resolve(list(prefetched[field.get_cache_name()]))
+        return get_loader(
+            info, field.related_model, field.field.attname, many=True
+        ).load(instance.pk)
+    raise ValueError(f"Relations of type {type(field).__name__} cannot be loaded")
+
+
+def related_resolver(name: str):
+    """A resolver loading the relation of the node with the name"""
+
+    def resolve(parent, info, **kwargs):
+        return load_related(info, parent, name)
+
+    return resolve
@@ -61,6 +61,79 @@ class StopControllerTask(relay.ClientIDMutation):
         return StopControllerTask(controller_task=controller_task)
 
 
+class ControllerTaskInput(graphene.InputObjectType):
+    controller_component = graphene.ID(required=True)
+    task_type = graphene.String(required=True)
+    parameters = graphene.JSONString(required=True)
+    run_until = graphene.DateTime()
+
+
+class StartControllerTasks(relay.ClientIDMutation):
+    """Start the tasks in one transaction, sending one command message per
+    controller"""
+
+    class Input:
+        tasks = graphene.List(graphene.NonNull(ControllerTaskInput), required=True)
+
+    controller_tasks = graphene.List(ControllerTaskNode)
+
+    @classmethod
+    def mutate_and_get_payload(cls, root, info, **kwargs):
+        tasks = [
+            {
+                "controller_component_id": uuid.UUID(
+                    from_global_id(task.controller_component)[1]
+                ),
+                "task_type": task.task_type,
+                "parameters": task.parameters,
+                "run_until": task.run_until,
+            }
+            for task in kwargs["tasks"]
+        ]
+        try:
+            controller_tasks = ControllerTask.objects.start_many(tasks)
+        except ValueError as err:
+            raise GraphQLError(str(err)) from err
+        return StartControllerTasks(controller_tasks=controller_tasks)
+
+
+class RestartControllerTasks(relay.ClientIDMutation):
+    """Restart stopped or failed tasks in one transaction, sending one command message
+    per controller"""
+
+    class Input:
+        task_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    controller_tasks = graphene.List(ControllerTaskNode)
+
+    @classmethod
+    def mutate_and_get_payload(cls, root, info, **kwargs):
+        task_ids = [uuid.UUID(from_global_id(pk)[1]) for pk in kwargs["task_ids"]]
+        try:
+            controller_tasks = ControllerTask.objects.restart_many(task_ids)
+        except ValueError as err:
+            raise GraphQLError(str(err)) from err
+        return RestartControllerTasks(controller_tasks=controller_tasks)
+
+
+class StopControllerTasks(relay.ClientIDMutation):
+    """Stop the tasks in one transaction, sending one command message per controller"""
+
+    class Input:
+        task_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    controller_tasks = graphene.List(ControllerTaskNode)
+
+    @classmethod
+    def mutate_and_get_payload(cls, root, info, **kwargs):
+        task_ids = [uuid.UUID(from_global_id(pk)[1]) for pk in kwargs["task_ids"]]
+        try:
+            controller_tasks = ControllerTask.objects.stop_many(task_ids)
+        except ValueError as err:
+            raise GraphQLError(str(err)) from err
+        return StopControllerTasks(controller_tasks=controller_tasks)
+
+
 class DataPointTypeEdge(graphene.InputObjectType):
     data_point_type = graphene.ID(required=True)
     parameter_prefix = graphene.String(default_value="")
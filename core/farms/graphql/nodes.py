@@ -1,8 +1,12 @@
 import graphene
-from graphene import relay, ObjectType, List, String
-from graphene_django import DjangoObjectType
+from graphene import relay, ObjectType, List, String, Float
 from django_filters import FilterSet, BooleanFilter
+from graphql import GraphQLError
+from graphql_relay import from_global_id
 
+from farms.graphql.fields import DataPointConnectionField
+from farms.graphql.loaders import load_related, related_resolver
+from farms.graphql.optimizer import OptimizedDjangoObjectType
 from farms.models import (
     Site,
     SiteEntity,
@@ -23,7 +27,7 @@ class TextChoice(ObjectType):
     label = String()
 
 
-class SiteNode(DjangoObjectType):
+class SiteNode(OptimizedDjangoObjectType):
     class Meta:
         model = Site
         filter_fields = {
@@ -61,7 +65,7 @@ class SiteEntityFilter(FilterSet):
         }
 
 
-class SiteEntityNode(DjangoObjectType):
+class SiteEntityNode(OptimizedDjangoObjectType):
     class Meta:
         model = SiteEntity
         filterset_class = SiteEntityFilter
@@ -76,8 +80,12 @@ class SiteEntityNode(DjangoObjectType):
         )
         interfaces = (relay.Node,)
 
+    resolve_site = related_resolver("site")
+    resolve_controller_component = related_resolver("controller_component")
+    resolve_peripheral_component = related_resolver("peripheral_component")
 
-class ControllerComponentNode(DjangoObjectType):
+
+class ControllerComponentNode(OptimizedDjangoObjectType):
     class Meta:
         model = ControllerComponent
         filter_fields = {
@@ -96,8 +104,11 @@ class ControllerComponentNode(DjangoObjectType):
         )
         interfaces = (relay.Node,)
 
+    resolve_site_entity = related_resolver("site_entity")
+    resolve_component_type = related_resolver("component_type")
+
 
-class ControllerComponentTypeNode(DjangoObjectType):
+class ControllerComponentTypeNode(OptimizedDjangoObjectType):
     class Meta:
         model = ControllerComponentType
         filter_fields = {
@@ -115,7 +126,7 @@ class ControllerComponentTypeNode(DjangoObjectType):
         interfaces = (relay.Node,)
 
 
-class ControllerTaskNode(DjangoObjectType):
+class ControllerTaskNode(OptimizedDjangoObjectType):
     class Meta:
         model = ControllerTask
         filter_fields = {
@@ -140,6 +151,8 @@ class ControllerTaskNode(DjangoObjectType):
         convert_choices_to_enum = False
         interfaces = (relay.Node,)
 
+    resolve_controller_component = related_resolver("controller_component")
+
 
 class ControllerTaskEnumNode(ObjectType):
     states = List(TextChoice)
@@ -160,7 +173,7 @@ class ControllerTaskEnumNode(ObjectType):
         ]
 
 
-class PeripheralComponentNode(DjangoObjectType):
+class PeripheralComponentNode(OptimizedDjangoObjectType):
     class Meta:
         model = PeripheralComponent
         filter_fields = {
@@ -191,12 +204,43 @@ class PeripheralComponentNode(DjangoObjectType):
     parameters = graphene.JSONString(
         description="Combines other parameters and data point types to create controller commands."
     )
+    data_point_set = DataPointConnectionField(lambda: DataPointNode)
+    series = graphene.Field(
+        lambda: DataPointSeriesNode,
+        data_point_type=graphene.ID(required=True),
+        start=graphene.DateTime(required=True),
+        end=graphene.DateTime(required=True),
+        description="The data points of a type in the time range as parallel lists.",
+    )
+
+    optimizer_hints = {
+        "parameters": ("other_parameters", "data_point_type_edges"),
+        "series": (),
+    }
+
+    resolve_site_entity = related_resolver("site_entity")
+    resolve_controller_component = related_resolver("controller_component")
+    resolve_data_point_type_edges = related_resolver("data_point_type_edges")
 
     @staticmethod
-    def resolve_parameters(peripheral_component, _):
+    def resolve_parameters(peripheral_component, info):
         """The parameter fields combines all parameters"""
 
-        return peripheral_component.parameters
+        return load_related(info, peripheral_component, "data_point_type_edges").then(
+            peripheral_component.combine_parameters
+        )
+
+    @staticmethod
+    def resolve_series(peripheral_component, info, data_point_type, start, end):
+        try:
+            return DataPoint.objects.series(
+                peripheral_component_id=peripheral_component.pk,
+                data_point_type_id=from_global_id(data_point_type)[1],
+                start=start,
+                end=end,
+            )
+        except ValueError as err:
+            raise GraphQLError(str(err)) from err
 
 
 class PeripheralComponentEnumNode(ObjectType):
@@ -218,14 +262,17 @@ class PeripheralComponentEnumNode(ObjectType):
         ]
 
 
-class PeripheralDataPointTypeNode(DjangoObjectType):
+class PeripheralDataPointTypeNode(OptimizedDjangoObjectType):
     class Meta:
         model = PeripheralDataPointType
         filter_fields = ["data_point_type", "peripheral", "parameter_prefix"]
         fields = fields = ("data_point_type", "peripheral", "parameter_prefix")
 
+    resolve_data_point_type = related_resolver("data_point_type")
+    resolve_peripheral = related_resolver("peripheral")
 
-class DataPointTypeNode(DjangoObjectType):
+
+class DataPointTypeNode(OptimizedDjangoObjectType):
     class Meta:
         model = DataPointType
         filter_fields = {
@@ -243,8 +290,10 @@ class DataPointTypeNode(DjangoObjectType):
         )
         interfaces = (relay.Node,)
 
+    data_point_set = DataPointConnectionField(lambda: DataPointNode)
+
 
-class DataPointNode(DjangoObjectType):
+class DataPointNode(OptimizedDjangoObjectType):
     class Meta:
         model = DataPoint
         filter_fields = {
@@ -254,3 +303,95 @@ class DataPointNode(DjangoObjectType):
             "data_point_type": ["exact"],
         }
         interfaces = (relay.Node,)
+
+
+class DataPointSeriesNode(ObjectType):
+    """The data points of a series in a columnar format, oldest first."""
+
+    time = List(graphene.DateTime)
+    value = List(Float)
+
+
+class DataPointSeriesInput(graphene.InputObjectType):
+    """Selects the data points of one peripheral component and data point type."""
+
+    peripheral_component = graphene.ID(required=True)
+    data_point_type = graphene.ID(required=True)
+
+
+class AggregateColumn(ObjectType):
+    """The values of one aggregate function, one value per time bucket."""
+
+    aggregate = String()
+    values = List(Float)
+
+
+class AggregatedSeriesNode(ObjectType):
+    """Time bucketed aggregates of a series in a columnar format."""
+
+    peripheral_component = graphene.ID()
+    data_point_type = graphene.ID()
+    time = List(graphene.DateTime, description="The start of each time bucket.")
+    columns = List(AggregateColumn)
+
+    @staticmethod
+    def resolve_peripheral_component(parent, info):
+        return relay.Node.to_global_id(
+            PeripheralComponentNode._meta.name, parent["peripheral_component_id"]
+        )
+
+    @staticmethod
+    def resolve_data_point_type(parent, info):
+        return relay.Node.to_global_id(
+            DataPointTypeNode._meta.name, parent["data_point_type_id"]
+        )
+
+    @staticmethod
+    def resolve_time(parent, info):
+        return parent["time"]
+
+    @staticmethod
+    def resolve_columns(parent, info):
+        return [
+            AggregateColumn(aggregate=aggregate, values=values)
+            for aggregate, values in parent["values"].items()
+        ]
+
+
+class AlignedSeriesNode(ObjectType):
+    """The values of a series in an aligned matrix, one value per time bucket."""
+
+    peripheral_component = graphene.ID()
+    data_point_type = graphene.ID()
+    values = List(Float)
+
+    @staticmethod
+    def resolve_peripheral_component(parent, info):
+        return relay.Node.to_global_id(
+            PeripheralComponentNode._meta.name, parent["peripheral_component_id"]
+        )
+
+    @staticmethod
+    def resolve_data_point_type(parent, info):
+        return relay.Node.to_global_id(
+            DataPointTypeNode._meta.name, parent["data_point_type_id"]
+        )
+
+    @staticmethod
+    def resolve_values(parent, info):
+        return parent["values"]
+
+
+class DataPointMatrixNode(ObjectType):
+    """Several series aggregated into time buckets on a shared time axis."""
+
+    time = List(graphene.DateTime, description="The start of each time bucket.")
+    series = List(AlignedSeriesNode)
+
+    @staticmethod
+    def resolve_time(parent, info):
+        return parent["time"]
+
+    @staticmethod
+    def resolve_series(parent, info):
+        return parent["series"]
@@ -0,0 +1,203 @@
+"""Optimization of the querysets of the nodes for the fields a query selects.
+
+The queryset of a connection, list or node field only loads the columns of the selected
+fields. Foreign keys and one to one relations whose fields are selected are joined with
+select_related, and reverse relations resolved as lists are loaded with
+prefetch_related, both optimized in turn for their selected fields. Nested connections
+are resolved per parent and optimized by their own field.
+
+Fields with custom resolvers declare the model fields and relations they read in the
+optimizer_hints of their node. If a selected field is neither a model field nor hinted,
+all columns of its model are loaded."""
+from typing import Dict, Iterator, List, Set, Tuple, Type
+
+from django.db import models
+from django.db.models import Prefetch
+from graphene import Dynamic, relay
+from graphene.utils.str_converters import to_snake_case
+from graphene_django import DjangoObjectType
+from graphql.language import ast
+from graphql.type import GraphQLObjectType
+
+
+class OptimizedDjangoObjectType(DjangoObjectType):
+    """A Django object type whose querysets are optimized for the selected fields"""
+
+    class Meta:
+        abstract = True
+
+    # The model fields and relations read by the resolvers of the other fields
+    optimizer_hints: Dict[str, Tuple[str, ...]] = {}
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize(queryset, info, cls)
+
+
+def optimize(queryset, info, node_type) -> models.QuerySet:
+    """Optimize the queryset of the node type for the fields selected by the field of
+    the info, which returns a connection, a list or a single node"""
+
+    if isinstance(queryset, models.Manager):
+        queryset = queryset.all()
+    # Prefetched querysets are already loaded
+    if queryset._result_cache is not None:
+        return queryset
+
+    fields = []
+    for field_ast in info.field_asts:
+        fields.extend(_fields(field_ast.selection_set, info, node_type))
+    if _is_connection(getattr(_unwrap(info.return_type), "graphene_type", None)):
+        fields = [
+            node_field
+            for edges in fields
+            if edges.name.value == "edges"
+            for edge_field in _fields(edges.selection_set, info, None)
+            if edge_field.name.value == "node"
+            for node_field in _fields(edge_field.selection_set, info, node_type)
+        ]
+    plan = _Plan()
+    plan.add(queryset.model, node_type, fields, info)
+    return plan.apply(queryset)
+
+
+class _Plan:
+    """The columns, joins and prefetches a queryset needs for the selected fields"""
+
+    def __init__(self):
+        self.only: Set[str] = set()
+        self.select: Set[str] = set()
+        # The model and plan of each prefetched relation
+        self.prefetch: Dict[str, Tuple[Type[models.Model], "_Plan"]] = {}
+
+    def add(self, model, node_type, fields: List[ast.Field], info, prefix: str = ""):
+        """Add the fields selected on the node type of the model"""
+
+        self.only.add(prefix + model._meta.pk.name)
+        model_fields = _model_fields(model)
+        for field_ast in fields:
+            name = to_snake_case(field_ast.name.value)
+            if name.startswith("__") or name == "id":
+                continue
+            hints = getattr(node_type, "optimizer_hints", {}).get(name)
+            graphene_field = node_type._meta.fields.get(name)
+            if isinstance(graphene_field, Dynamic):
+                # The fields of relations are created on schema creation
+                graphene_field = graphene_field.get_type()
+            graphene_type = _unwrap(graphene_field.type) if graphene_field else None
+            if hints is not None:
+                for hint in hints:
+                    self._add_field(model_fields[hint], None, None, info, prefix)
+            elif name in model_fields:
+                if not _is_connection(graphene_type):
+                    self._add_field(
+                        model_fields[name],
+                        graphene_type if _is_node_type(graphene_type) else None,
+                        field_ast.selection_set,
+                        info,
+                        prefix,
+                    )
+            elif graphene_field is not None:
+                # A custom resolver may read any field
+                self.add_all(model, prefix)
+
+    def add_all(self, model, prefix: str = ""):
+        """Add all columns of the model"""
+
+        self.only.update(prefix + field.name for field in model._meta.concrete_fields)
+
+    def apply(self, queryset) -> models.QuerySet:
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        for lookup, (model, plan) in sorted(self.prefetch.items()):
+            queryset = queryset.prefetch_related(
+                Prefetch(lookup, queryset=plan.apply(model._default_manager.all()))
+            )
+        return queryset.only(*sorted(self.only))
+
+    def _add_field(self, field, node_type, selection_set, info, prefix: str):
+        """Add a model field resolved as the node type with the selection set. Without a
+        node type, all columns of a related model are loaded."""
+
+        path = prefix + _attribute_name(field)
+        if not field.is_relation:
+            self.only.add(path)
+            return
+        if field.many_to_one or field.one_to_one:
+            if field.concrete:
+                self.only.add(path)
+            self.select.add(path)
+            plan, prefix = self, path + "__"
+        else:
+            model_plan = self.prefetch.setdefault(path, (field.related_model, _Plan()))
+            plan, prefix = model_plan[1], ""
+            if field.one_to_many:
+                # The key to the parent
+                plan.only.add(field.field.name)
+        if node_type is None:
+            plan.add_all(field.related_model, prefix)
+        else:
+            fields = list(_fields(selection_set, info, node_type))
+            plan.add(field.related_model, node_type, fields, info, prefix)
+
+
+def _attribute_name(field) -> str:
+    """The name of the attribute of a model field, the accessor for reverse relations"""
+
+    if field.auto_created and not field.concrete:
+        return field.get_accessor_name()
+    return field.name
+
+
+def _model_fields(model) -> Dict[str, models.Field]:
+    """The fields of the model by the names of their attributes"""
+
+    return {_attribute_name(field): field for field in model._meta.get_fields()}
+
+
+def _fields(selection_set, info, node_type) -> Iterator[ast.Field]:
+    """Iterate over the fields of the selection set, following the fragments on the
+    node type, or all fragments without one"""
+
+    for selection in selection_set.selections if selection_set else []:
+        if isinstance(selection, ast.Field):
+            yield selection
+            continue
+        if isinstance(selection, ast.FragmentSpread):
+            fragment = info.fragments.get(selection.name.value)
+        else:
+            fragment = selection
+        if fragment is None or not _on_type(fragment.type_condition, info, node_type):
+            continue
+        yield from _fields(fragment.selection_set, info, node_type)
+
+
+def _on_type(type_condition, info, node_type) -> bool:
+    """Whether a fragment with the type condition applies to the node type"""
+
+    if type_condition is None or node_type is None:
+        return True
+    name = type_condition.name.value
+    return name == node_type._meta.name or not isinstance(
+        info.schema.get_type(name), GraphQLObjectType
+    )
+
+
+def _unwrap(field_type):
+    """The named type without lists and non nulls"""
+
+    while hasattr(field_type, "of_type"):
+        field_type = field_type.of_type
+    return field_type
+
+
+def _is_connection(graphene_type) -> bool:
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, relay.Connection
+    )
+
+
+def _is_node_type(graphene_type) -> bool:
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, DjangoObjectType
+    )
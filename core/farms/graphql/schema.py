@@ -1,6 +1,11 @@
+from datetime import timedelta
+
 import graphene
 from graphene_django.filter import DjangoFilterConnectionField
+from graphql import GraphQLError
+from graphql_relay import from_global_id
 
+from farms.graphql.fields import DataPointConnectionField
 from farms.graphql.nodes import (
     SiteNode,
     SiteEntityNode,
@@ -12,12 +17,19 @@ from farms.graphql.nodes import (
     PeripheralComponentEnumNode,
     DataPointTypeNode,
     DataPointNode,
+    DataPointSeriesInput,
+    AggregatedSeriesNode,
+    DataPointMatrixNode,
+    DataPoint,
 )
 
 from farms.graphql.mutations import (
     StartControllerTask,
     RestartControllerTask,
     StopControllerTask,
+    StartControllerTasks,
+    RestartControllerTasks,
+    StopControllerTasks,
     CreatePeripheralComponent,
 )
 
@@ -51,7 +63,41 @@ class Query(object):
     all_data_point_types = DjangoFilterConnectionField(DataPointTypeNode)
 
     data_point = graphene.relay.Node.Field(DataPointTypeNode)
-    all_data_points = DjangoFilterConnectionField(DataPointNode)
+    all_data_points = DataPointConnectionField(DataPointNode)
+    aggregated_data_points = graphene.List(
+        AggregatedSeriesNode,
+        series=graphene.List(graphene.NonNull(DataPointSeriesInput), required=True),
+        start=graphene.DateTime(required=True),
+        end=graphene.DateTime(required=True),
+        bucket_width=graphene.Int(
+            required=True, description="The width of a time bucket in seconds."
+        ),
+        aggregates=graphene.List(
+            graphene.NonNull(graphene.String),
+            required=True,
+            description="Any of avg, min, max, sum, count, first, last and percentile.",
+        ),
+        percentile=graphene.Float(
+            default_value=0.5, description="The fraction used by the percentile."
+        ),
+    )
+    data_point_matrix = graphene.Field(
+        DataPointMatrixNode,
+        series=graphene.List(graphene.NonNull(DataPointSeriesInput), required=True),
+        start=graphene.DateTime(required=True),
+        end=graphene.DateTime(required=True),
+        step=graphene.Int(
+            required=True, description="The width of a time bucket in seconds."
+        ),
+        fill=graphene.String(
+            default_value=DataPoint.Fill.NULL.value,
+            description="How empty time buckets are filled: null, locf or linear.",
+        ),
+        aggregate=graphene.String(
+            default_value=DataPoint.Aggregate.AVG.value,
+            description="The aggregate of each time bucket.",
+        ),
+    )
 
     @staticmethod
     def resolve_controller_task_enums(parent, args):
@@ -61,6 +107,46 @@ class Query(object):
     def resolve_peripheral_component_enums(parent, args):
         return PeripheralComponentEnumNode()
 
+    @staticmethod
+    def resolve_aggregated_data_points(parent, info, series, **kwargs):
+        try:
+            return DataPoint.objects.aggregate_buckets(
+                series=[
+                    (
+                        from_global_id(selector.peripheral_component)[1],
+                        from_global_id(selector.data_point_type)[1],
+                    )
+                    for selector in series
+                ],
+                start=kwargs["start"],
+                end=kwargs["end"],
+                bucket_width=timedelta(seconds=kwargs["bucket_width"]),
+                aggregates=kwargs["aggregates"],
+                percentile=kwargs["percentile"],
+            )
+        except ValueError as err:
+            raise GraphQLError(str(err)) from err
+
+    @staticmethod
+    def resolve_data_point_matrix(parent, info, series, **kwargs):
+        try:
+            return DataPoint.objects.aligned_matrix(
+                series=[
+                    (
+                        from_global_id(selector.peripheral_component)[1],
+                        from_global_id(selector.data_point_type)[1],
+                    )
+                    for selector in series
+                ],
+                start=kwargs["start"],
+                end=kwargs["end"],
+                step=timedelta(seconds=kwargs["step"]),
+                fill=kwargs["fill"],
+                aggregate=kwargs["aggregate"],
+            )
+        except ValueError as err:
+            raise GraphQLError(str(err)) from err
+
 
 class Mutation(object):
     """Mutation commands for the farms GraphQL schema"""
@@ -68,5 +154,8 @@ class Mutation(object):
     start_controller_task = StartControllerTask.Field()
     restart_controller_task = RestartControllerTask.Field()
     stop_controller_task = StopControllerTask.Field()
+    start_controller_tasks = StartControllerTasks.Field()
+    restart_controller_tasks = RestartControllerTasks.Field()
+    stop_controller_tasks = StopControllerTasks.Field()
 
     create_peripheral_component = CreatePeripheralComponent.Field()
\ No newline at end of file
@@ -0,0 +1,395 @@
+"""Writes of data points in the InfluxDB line protocol.
+
+Sensors and flows that write to InfluxDB can write to the server instead. Each line
+holds the values of one peripheral component at one time:
+
+    bme280,peripheral=<peripheral> air_temperature=21.5,humidity=40i 1609459200000000000
+
+The peripheral component is given by the peripheral tag, or the measurement if there is
+no such tag, as its ID or the name of its site entity. Each field is a data point type
+given by its ID or its name, ignoring case, spaces and underscores. The timestamp is
+optional and in the precision of the request.
+
+The body is read and parsed in chunks and the data points are inserted in batches, so
+memory stays flat independent of the size of a write. Lookups of peripheral components
+and data point types are cached, so the IDs of each batch are checked before it is
+inserted: lines of peripheral components or data point types that were deleted while
+cached are reported like unknown ones."""
+import hashlib
+import re
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.core.cache import cache
+from django.db import IntegrityError
+
+from farms.models import DataPoint, DataPointType, PeripheralComponent
+
+# Number of data points inserted at a time
+BATCH_SIZE = 5000
+
+# Number of bytes read from the request at a time
+READ_SIZE = 64 * 1024
+
+# Seconds the lookups of peripheral components and data point types are cached
+LOOKUP_TIMEOUT = 300
+
+# Number of errors reported at most
+MAX_ERRORS = 10
+
+# Nanoseconds per unit of each timestamp precision
+PRECISIONS = {
+    "ns": 1,
+    "n": 1,
+    "u": 1000,
+    "us": 1000,
+    "ms": 10 ** 6,
+    "s": 10 ** 9,
+    "m": 60 * 10 ** 9,
+    "h": 3600 * 10 ** 9,
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_ESCAPED = re.compile(rb"\\(.)")
+
+# A parsed line: measurement, tags, fields and the timestamp, if any
+Line = Tuple[str, Dict[str, str], Dict[str, float], Optional[int]]
+
+
+def write(chunks: Iterable[bytes], precision: str = "ns") -> Tuple[int, List[str]]:
+    """Insert the data points of the lines in the chunks. Lines with errors are skipped.
+    Returns the number of inserted data points and the errors. Raises ValueError for an
+    unknown precision."""
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    nanoseconds = PRECISIONS[precision]
+    lookups = _Lookups()
+    errors: List[str] = []
+    # The data points of each line by the line number
+    batch: List[Tuple[int, List[DataPoint]]] = []
+    batch_size = 0
+    written = 0
+    now = datetime.now(timezone.utc)
+    for number, line in iter_lines(chunks):
+        try:
+            measurement, tags, fields, timestamp = parse_line(line)
+            peripheral_id = lookups.peripheral(tags.get("peripheral", measurement))
+            time = (
+                EPOCH + timedelta(microseconds=timestamp * nanoseconds // 1000)
+                if timestamp is not None
+                else now
+            )
+            # All fields of the line are looked up before any of them is written
+            points = [
+                DataPoint(
+                    time=time,
+                    value=value,
+                    peripheral_component_id=peripheral_id,
+                    data_point_type_id=lookups.data_point_type(key),
+                )
+                for key, value in fields.items()
+            ]
+        except (ValueError, OverflowError) as err:
+            _add_error(errors, number, err)
+            continue
+        batch.append((number, points))
+        batch_size += len(points)
+        if batch_size >= BATCH_SIZE:
+            written += _insert(batch, lookups, errors)
+            batch = []
+            batch_size = 0
+    if batch:
+        written += _insert(batch, lookups, errors)
+    return written, errors
+
+
+def _insert(
+    batch: List[Tuple[int, List[DataPoint]]], lookups: "_Lookups", errors: List[str]
+) -> int:
+    """Insert the data points of the lines in the batch. Returns the number of inserted
+    data points."""
+
+    batch = _existing(batch, lookups, errors)
+    try:
+        return len(DataPoint.objects.insert([p for _, points in batch for p in points]))
+    except IntegrityError:
+        # A data point type may have been deleted in the meantime
+        existing = _existing(batch, lookups, errors)
+        if len(existing) == len(batch):
+            raise
+        return len(
+            DataPoint.objects.insert([p for _, points in existing for p in points])
+        )
+
+
+def _existing(
+    batch: List[Tuple[int, List[DataPoint]]], lookups: "_Lookups", errors: List[str]
+) -> List[Tuple[int, List[DataPoint]]]:
+    """The lines of the batch whose peripheral components and data point types exist.
+    They may have been deleted while cached, the other lines are reported as errors."""
+
+    peripheral_ids = {
+        str(point.peripheral_component_id) for _, points in batch for point in points
+    }
+    type_ids = {str(point.data_point_type_id) for _, points in batch for point in points}
+    missing_peripheral_ids = peripheral_ids - {
+        str(pk)
+        for pk in PeripheralComponent.objects.filter(
+            pk__in=peripheral_ids
+        ).values_list("pk", flat=True)
+    }
+    missing_type_ids = type_ids - {
+        str(pk)
+        for pk in DataPointType.objects.filter(pk__in=type_ids).values_list(
+            "pk", flat=True
+        )
+    }
+    if not missing_peripheral_ids and not missing_type_ids:
+        return batch
+    lookups.forget(missing_peripheral_ids, missing_type_ids)
+
+    existing = []
+    for number, points in batch:
+        peripheral_id = str(points[0].peripheral_component_id)
+        deleted_type_ids = missing_type_ids.intersection(
+            str(point.data_point_type_id) for point in points
+        )
+        if peripheral_id in missing_peripheral_ids:
+            _add_error(
+                errors,
+                number,
+                f"Unknown or ambiguous peripheral component: {peripheral_id}",
+            )
+        elif deleted_type_ids:
+            _add_error(
+                errors, number, f"Unknown data point type: {min(deleted_type_ids)}"
+            )
+        else:
+            existing.append((number, points))
+    return existing
+
+
+def _add_error(errors: List[str], number: int, error) -> None:
+    if len(errors) < MAX_ERRORS:
+        errors.append(f"line {number}: {error}")
+
+
+def gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress gzip compressed chunks"""
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """Iterate over the numbered lines in the chunks, skipping empty lines and
+    comments"""
+
+    number = 0
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            number += 1
+            line = line.strip()
+            if line and not line.startswith(b"#"):
+                yield number, line
+    rest = rest.strip()
+    if rest and not rest.startswith(b"#"):
+        yield number + 1, rest
+
+
+def parse_line(line: bytes) -> Line:
+    """Parse a line into its measurement, tags, fields and timestamp. Raises ValueError
+    if the line is invalid."""
+
+    # The series, i.e., measurement and tags, ends at the first unescaped space
+    series_end = _find_unescaped(line, ord(" "))
+    if series_end < 0:
+        raise ValueError("Missing fields")
+    series = _split(line[:series_end], b",", quoted=False)
+    sections = _split(line[series_end + 1 :], b" ", quoted=True)
+    if len(sections) > 2:
+        raise ValueError("Unexpected text after the timestamp")
+
+    measurement = _unescape(series[0])
+    if not measurement:
+        raise ValueError("Missing measurement")
+    tags = dict(_key_value(tag, quoted=False) for tag in series[1:])
+    fields = {
+        key: _field_value(value)
+        for key, value in (
+            _key_value(field, quoted=True)
+            for field in _split(sections[0], b",", quoted=True)
+        )
+    }
+    timestamp = None
+    if len(sections) == 2:
+        try:
+            timestamp = int(sections[1])
+        except ValueError as err:
+            raise ValueError(f"Invalid timestamp: {sections[1].decode()}") from err
+    return measurement, tags, fields, timestamp
+
+
+def _find_unescaped(data: bytes, character: int) -> int:
+    """The index of the first occurrence of the character that is not escaped"""
+
+    index = data.find(bytes([character]))
+    while index > 0 and data[index - 1] == ord("\\"):
+        index = data.find(bytes([character]), index + 1)
+    return index
+
+
+def _split(data: bytes, separator: bytes, quoted: bool) -> List[bytes]:
+    """Split at the separators that are not escaped or, if quoted, inside quotes"""
+
+    if b"\\" not in data and (not quoted or b'"' not in data):
+        return data.split(separator)
+    parts = []
+    start = 0
+    index = 0
+    in_quotes = False
+    while index < len(data):
+        character = data[index]
+        if character == ord("\\"):
+            index += 2
+            continue
+        if quoted and character == ord('"'):
+            in_quotes = not in_quotes
+        elif character == separator[0] and not in_quotes:
+            parts.append(data[start:index])
+            start = index + 1
+        index += 1
+    parts.append(data[start:])
+    return parts
+
+
+def _key_value(data: bytes, quoted: bool) -> Tuple[str, bytes]:
+    parts = _split(data, b"=", quoted)
+    if len(parts) != 2 or not parts[0]:
+        raise ValueError(f"Invalid key and value: {data.decode(errors='replace')}")
+    key = _unescape(parts[0])
+    return key, parts[1] if quoted else _unescape(parts[1])
+
+
+def _field_value(value: bytes) -> float:
+    """Convert a field value to a number. Integers end in i or u and booleans are
+    converted to 0 and 1. Raises ValueError for strings."""
+
+    if value.startswith(b'"'):
+        raise ValueError("String fields are not supported")
+    if value in (b"t", b"T", b"true", b"True", b"TRUE"):
+        return 1.0
+    if value in (b"f", b"F", b"false", b"False", b"FALSE"):
+        return 0.0
+    try:
+        if value.endswith((b"i", b"u")):
+            return float(int(value[:-1]))
+        return float(value)
+    except ValueError as err:
+        raise ValueError(f"Invalid field value: {value.decode()}") from err
+
+
+def _unescape(data: bytes) -> str:
+    if b"\\" in data:
+        data = _ESCAPED.sub(rb"\1", data)
+    return data.decode()
+
+
+def _normalize(name: str) -> str:
+    return name.lower().replace(" ", "").replace("_", "")
+
+
+class _Lookups:
+    """Looks up the IDs of peripheral components and data point types, remembering the
+    results of a request and caching them across requests. Unknown peripheral components
+    are not cached, so they can be written to as soon as they are created. For an
+    unknown data point type, the types are loaded again once per request, so new types
+    can be written to as well."""
+
+    def __init__(self):
+        self._peripherals: Dict[str, str] = {}
+        self._data_point_types: Optional[Dict[str, str]] = None
+        self._data_point_types_loaded = False
+
+    def peripheral(self, key: str) -> str:
+        """The ID of the peripheral component with the ID or site entity name. Raises
+        ValueError if there is none or the name is ambiguous."""
+
+        if key not in self._peripherals:
+            cache_key = self._peripheral_cache_key(key)
+            peripheral_id = cache.get(cache_key)
+            if peripheral_id is None:
+                peripheral_id = self._find_peripheral(key)
+                if peripheral_id:
+                    cache.set(cache_key, peripheral_id, LOOKUP_TIMEOUT)
+            self._peripherals[key] = peripheral_id
+        if not self._peripherals[key]:
+            raise ValueError(f"Unknown or ambiguous peripheral component: {key}")
+        return self._peripherals[key]
+
+    def data_point_type(self, key: str) -> str:
+        """The ID of the data point type with the ID or name. Raises ValueError if there
+        is none."""
+
+        if self._data_point_types is None:
+            self._data_point_types = cache.get("line_protocol:data_point_types")
+            if self._data_point_types is None:
+                self._load_data_point_types()
+        type_id = self._data_point_types.get(key) or self._data_point_types.get(
+            _normalize(key)
+        )
+        if type_id is None and not self._data_point_types_loaded:
+            # The type may have been created since the types were cached
+            self._load_data_point_types()
+            return self.data_point_type(key)
+        if type_id is None:
+            raise ValueError(f"Unknown data point type: {key}")
+        return type_id
+
+    def forget(self, peripheral_ids: Set[str], type_ids: Set[str]) -> None:
+        """Forget the peripheral components and data point types, e.g., because they
+        were deleted"""
+
+        for key, peripheral_id in self._peripherals.items():
+            if peripheral_id in peripheral_ids:
+                cache.delete(self._peripheral_cache_key(key))
+                self._peripherals[key] = ""
+        if type_ids:
+            cache.delete("line_protocol:data_point_types")
+            self._data_point_types = None
+            self._data_point_types_loaded = False
+
+    def _load_data_point_types(self) -> None:
+        self._data_point_types = {}
+        for type_id, name in DataPointType.objects.values_list("pk", "name"):
+            self._data_point_types[_normalize(name)] = str(type_id)
+            self._data_point_types[str(type_id)] = str(type_id)
+        self._data_point_types_loaded = True
+        cache.set(
+            "line_protocol:data_point_types", self._data_point_types, LOOKUP_TIMEOUT
+        )
+
+    @staticmethod
+    def _peripheral_cache_key(key: str) -> str:
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return f"line_protocol:peripheral:{digest}"
+
+    @staticmethod
+    def _find_peripheral(key: str) -> str:
+        """The ID of the peripheral component, an empty string if there is none"""
+
+        try:
+            peripherals = PeripheralComponent.objects.filter(pk=uuid.UUID(key))
+        except ValueError:
+            peripherals = PeripheralComponent.objects.filter(site_entity__name=key)
+        peripheral_ids = list(peripherals.values_list("pk", flat=True)[:2])
+        return str(peripheral_ids[0]) if len(peripheral_ids) == 1 else ""
@@ -0,0 +1,31 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from farms.models import DataPoint
+
+
+class Command(BaseCommand):
+    help = "Move the data points of old months to the Parquet archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.DATA_POINT_ARCHIVE_AFTER_DAYS,
+            help="Archive the months that ended more than this many days ago",
+        )
+
+    def handle(self, *args, **options):
+        horizon = datetime.now(timezone.utc) - timedelta(days=options["days"])
+        started = time.monotonic()
+        try:
+            archived = DataPoint.objects.archive(horizon)
+        except ValueError as err:
+            raise CommandError(err) from err
+        self.stdout.write(
+            f"Archived {archived} data points before {horizon.isoformat()} "
+            f"in {time.monotonic() - started:.1f}s"
+        )
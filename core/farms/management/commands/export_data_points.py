@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db.routers import replica_reads
+from farms.export import FORMATS, data_point_rows, export_data_points
+
+
+class Command(BaseCommand):
+    help = "Export data points as CSV, NDJSON or Parquet file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--site", action="append", help="Site ID (repeatable)")
+        parser.add_argument(
+            "--peripheral", action="append", help="Peripheral component ID (repeatable)"
+        )
+        parser.add_argument("--start", help="Start time (inclusive, ISO 8601)")
+        parser.add_argument("--end", help="End time (exclusive, ISO 8601)")
+        parser.add_argument("--format", default="csv", choices=list(FORMATS))
+        parser.add_argument("--output", help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            with replica_reads():
+                self.export(options)
+        except ValueError as err:
+            raise CommandError(err) from err
+
+    def export(self, options):
+        rows = data_point_rows(
+            site_ids=options["site"],
+            peripheral_ids=options["peripheral"],
+            start=options["start"],
+            end=options["end"],
+        )
+        content = export_data_points(rows, options["format"])
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                output.writelines(content)
+        else:
+            sys.stdout.buffer.writelines(content)
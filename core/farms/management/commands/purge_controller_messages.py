@@ -0,0 +1,31 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from farms.models import ControllerMessage
+
+
+class Command(BaseCommand):
+    help = "Delete old controller messages in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CONTROLLER_MESSAGE_RETENTION_DAYS,
+            help="Delete messages older than this many days",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=10000, help="Messages deleted per batch"
+        )
+
+    def handle(self, *args, **options):
+        before = datetime.now(timezone.utc) - timedelta(days=options["days"])
+        started = time.monotonic()
+        deleted = ControllerMessage.objects.purge(before, options["batch_size"])
+        self.stdout.write(
+            f"Deleted {deleted} messages created before {before.isoformat()} "
+            f"in {time.monotonic() - started:.1f}s"
+        )
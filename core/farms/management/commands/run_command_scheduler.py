@@ -0,0 +1,13 @@
+from farms import scheduler
+from farms.management.commands import run_task_expiry
+
+
+class Command(run_task_expiry.Command):
+    help = "Run the worker retrying the commands sent to controllers until acknowledged"
+
+    channel = scheduler.CHANNEL
+
+    def wake_up(self):
+        # The worker tracks the commands left outstanding before it started on its
+        # first message
+        scheduler.wake_up()
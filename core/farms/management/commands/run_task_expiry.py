@@ -0,0 +1,26 @@
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.management.commands import runworker
+
+from farms import expiry
+
+
+class Command(runworker.Command):
+    help = "Run the worker stopping the running tasks whose run until time passed"
+
+    channel = expiry.CHANNEL
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layer",
+            default=DEFAULT_CHANNEL_LAYER,
+            help="Channel layer alias to use, if not the default",
+        )
+
+    def handle(self, *args, **options):
+        # The worker only starts on its first message, which stops the tasks that
+        # expired while it was not running
+        self.wake_up()
+        super().handle(*args, channels=[self.channel], **options)
+
+    def wake_up(self):
+        expiry.wake_up()
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0030_auto_20210125_0010'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='datapoint',
+            index=models.Index(fields=['peripheral_component', '-time'], name='datapoint_peripheral_time_idx'),
+        ),
+    ]
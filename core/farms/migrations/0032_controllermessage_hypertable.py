@@ -0,0 +1,41 @@
+# Generated by Django 3.1.4 on 2026-10-18 21:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0031_datapoint_peripheral_time_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='controllermessage',
+            name='request_id',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='The ID of the request, to enable tracking requests', max_length=255),
+        ),
+        # Unique indexes of a hypertable have to include the partitioning column. The ID
+        # stays unique on its own, so Django keeps using it as primary key.
+        migrations.RunSQL(
+            "ALTER TABLE farms_controllermessage "
+            "DROP CONSTRAINT farms_controllermessage_pkey, "
+            "ADD PRIMARY KEY (id, created_at);"
+        ),
+        migrations.RunSQL(
+            "SELECT create_hypertable('farms_controllermessage', 'created_at', "
+            "chunk_time_interval => INTERVAL '1 day', migrate_data => true);"
+        ),
+        # The policy keeps the retention configured when migrating, a later change of
+        # the setting has to be applied with remove_retention_policy and this statement
+        migrations.RunSQL(
+            [
+                (
+                    "SELECT add_retention_policy('farms_controllermessage', "
+                    "%s * INTERVAL '1 day');",
+                    [settings.CONTROLLER_MESSAGE_RETENTION_DAYS],
+                )
+            ]
+        ),
+    ]
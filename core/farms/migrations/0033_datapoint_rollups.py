@@ -0,0 +1,58 @@
+# Generated by Django 3.1.4 on 2026-10-18 23:40
+
+from django.db import migrations
+
+# Width of the buckets and name of each continuous aggregate
+ROLLUPS = [
+    ("1 minute", "farms_datapoint_1m"),
+    ("1 hour", "farms_datapoint_1h"),
+    ("1 day", "farms_datapoint_1d"),
+]
+
+
+def create_rollup(width, name):
+    return f"""
+        CREATE MATERIALIZED VIEW {name}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT peripheral_component_id, data_point_type_id,
+            time_bucket(INTERVAL '{width}', time) AS bucket,
+            sum(value) AS value_sum, count(value) AS value_count,
+            min(value) AS value_min, max(value) AS value_max
+        FROM farms_datapoint
+        GROUP BY peripheral_component_id, data_point_type_id, bucket
+        WITH NO DATA;
+        SELECT add_continuous_aggregate_policy('{name}',
+            start_offset => NULL, end_offset => INTERVAL '{width}',
+            schedule_interval => INTERVAL '{width}');
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0032_controllermessage_hypertable'),
+    ]
+
+    # Continuous aggregates cannot be refreshed in a transaction
+    atomic = False
+
+    # Rollups of the data points in buckets of a minute, an hour and a day. The existing
+    # data points are materialized once. The policies refresh the whole history, which
+    # only recomputes the buckets invalidated by writes since the last refresh, so late
+    # data points are included. Buckets that are not materialized yet are aggregated
+    # from the data points on read.
+    operations = [
+        operation
+        for width, name in ROLLUPS
+        for operation in [
+            migrations.RunSQL(
+                create_rollup(width, name),
+                reverse_sql=f"DROP MATERIALIZED VIEW {name};",
+            ),
+            # A statement of its own, as multiple statements run in one transaction
+            migrations.RunSQL(
+                f"CALL refresh_continuous_aggregate('{name}', NULL, NULL);",
+                reverse_sql=migrations.RunSQL.noop,
+            ),
+        ]
+    ]
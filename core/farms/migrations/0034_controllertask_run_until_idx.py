@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0033_datapoint_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='controllertask',
+            index=models.Index(condition=models.Q(state='running'), fields=['run_until'], name='controllertask_run_until_idx'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 import binascii
 import os
 import uuid
+from datetime import datetime
 from typing import Dict, List, Optional
 
 from django.conf import settings
@@ -85,8 +86,33 @@ class ControllerAuthToken(models.Model):
         return self.key
 
 
+class ControllerMessageManager(models.Manager):
+    """Handles the retention of the ControllerMessage class"""
+
+    def purge(self, before: datetime, batch_size: int = 10000) -> int:
+        """Delete the messages created before the time in batches, each in its own short
+        transaction to avoid long locks. Returns the number of deleted messages."""
+
+        deleted = 0
+        while True:
+            batch = list(
+                self.filter(created_at__lt=before)
+                .order_by("created_at")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not batch:
+                return deleted
+            count, _ = self.filter(id__in=batch, created_at__lt=before).delete()
+            deleted += count
+
+
 class ControllerMessage(models.Model):
-    """A message to/from a controller"""
+    """A message to/from a controller.
+
+    The table is a hypertable partitioned by created_at. Its chunks are dropped by a
+    retention policy after 30 days."""
+
+    objects = ControllerMessageManager()
 
     class Meta:
         unique_together = ["created_at", "controller"]
@@ -121,6 +147,7 @@ class ControllerMessage(models.Model):
         max_length=255,
         default="",
         blank=True,
+        db_index=True,
         help_text="The ID of the request, to enable tracking requests",
     )
 
@@ -1,11 +1,13 @@
 from asgiref.sync import async_to_sync
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Type
+from typing import Dict, List, Optional, Tuple, Type
 import uuid
 
 from channels.layers import get_channel_layer
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, models, transaction
+from farms import expiry, scheduler
+from farms.models import transitions
 from farms.models.controller import ControllerComponent
 
 
@@ -70,7 +72,113 @@ class ControllerTaskManager(models.Manager):
                 controller_task.controller_component.channel_name, task_commands
             )
         return controller_task
-    
+
+    def start_many(self, tasks: List[Dict]) -> List["ControllerTask"]:
+        """Create and start tasks, given as keyword arguments of start, in one
+        transaction. Each controller is sent one command message with all its tasks."""
+
+        controller_tasks = [
+            self.model(state=self.model.State.STARTING.value, **task) for task in tasks
+        ]
+        for controller_task in controller_tasks:
+            try:
+                # The controllers are validated with their channel names
+                controller_task.clean_fields(exclude=["controller_component"])
+            except ValidationError as err:
+                raise ValueError(err) from err
+        channel_names = self._channel_names(controller_tasks)
+        with transaction.atomic():
+            self.bulk_create(controller_tasks)
+            self._send_commands_to_controllers(controller_tasks, channel_names)
+        return controller_tasks
+
+    def restart_many(self, task_ids: List[uuid.UUID]) -> List["ControllerTask"]:
+        """Restart stopped or failed tasks in one transaction"""
+
+        return self._transition_many(
+            task_ids,
+            [self.model.State.STOPPED.value, self.model.State.FAILED.value],
+            self.model.State.STARTING,
+        )
+
+    def stop_many(self, task_ids: List[uuid.UUID]) -> List["ControllerTask"]:
+        """Stop tasks in one transaction"""
+
+        return self._transition_many(
+            task_ids, self.model.STOPPABLE_STATES, self.model.State.STOPPING
+        )
+
+    def _transition_many(
+        self, task_ids: List[uuid.UUID], from_states: List[str], state: str
+    ) -> List["ControllerTask"]:
+        """Change the state of the tasks and send their commands. Raises ValueError if a
+        task does not exist or is not in one of the states to change from."""
+
+        # Repeated tasks change and are sent once
+        task_ids = list(dict.fromkeys(str(pk) for pk in task_ids))
+        with transaction.atomic():
+            tasks = {
+                str(task.pk): task
+                for task in self.select_for_update().filter(pk__in=task_ids)
+            }
+            if missing := [pk for pk in task_ids if pk not in tasks]:
+                raise ValueError(f"Tasks do not exist: {', '.join(missing)}")
+            if invalid := [
+                pk for pk, task in tasks.items() if task.state not in from_states
+            ]:
+                raise ValueError(
+                    f"Tasks cannot change to {state}: {', '.join(invalid)}"
+                )
+            controller_tasks = [tasks[pk] for pk in task_ids]
+            channel_names = self._channel_names(controller_tasks)
+            for controller_task in controller_tasks:
+                controller_task.state = state
+            self.bulk_update(controller_tasks, ["state"])
+            self._send_commands_to_controllers(controller_tasks, channel_names)
+        return controller_tasks
+
+    @staticmethod
+    def _channel_names(tasks: List["ControllerTask"]) -> Dict[uuid.UUID, str]:
+        """The channel names of the controllers of the tasks. Raises ValueError if a
+        controller does not exist or has not connected to the server."""
+
+        controller_ids = {task.controller_component_id for task in tasks}
+        channel_names = dict(
+            ControllerComponent.objects.filter(pk__in=controller_ids).values_list(
+                "pk", "channel_name"
+            )
+        )
+        if disconnected := [
+            str(pk) for pk in controller_ids if not channel_names.get(pk)
+        ]:
+            raise ValueError(
+                "Controllers have not connected to the server: "
+                + ", ".join(sorted(disconnected))
+            )
+        return channel_names
+
+    def _send_commands_to_controllers(
+        self,
+        tasks: List["ControllerTask"],
+        channel_names: Dict[uuid.UUID, str],
+        request_id: str = None,
+        track: bool = True,
+    ) -> None:
+        """Send the commands of the tasks grouped by controller, one message per
+        controller"""
+
+        tasks_by_controller: Dict[uuid.UUID, List["ControllerTask"]] = {}
+        for task in tasks:
+            controller_id = task.controller_component_id
+            tasks_by_controller.setdefault(controller_id, []).append(task)
+        for controller_id, controller_tasks in tasks_by_controller.items():
+            self._send_commands_to_controller(
+                channel_names[controller_id],
+                self.to_commands(controller_tasks),
+                request_id,
+                track,
+            )
+
     def to_commands(cls, tasks: List[Type["ControllerTask"]]) -> Dict:
         """Convert a list of tasks to commands. Ignores tasks that cannot be converted
         to commands"""
@@ -161,28 +269,22 @@ class ControllerTaskManager(models.Manager):
         self.bulk_update(tasks, ["state"])
         return tasks
 
-    def from_results(self, results: Dict) -> List[Type["ControllerTask"]]:
-        """Update states from results commands"""
-
-        # Get all task ids to update
-        try:
-            uuids = [result["uuid"] for result in results.get("start", [])]
-            uuids.extend([result["uuid"] for result in results.get("stop", [])])
-        except KeyError as err:
-            raise ValueError(f"Missing key {err}") from err
-        tasks = self.select_for_update().filter(id__in=uuids)
+    def from_results(
+        self, results: Dict
+    ) -> Tuple[List[Type["ControllerTask"]], Dict[str, str]]:
+        """Update states from results commands. Returns the changed tasks and the errors
+        of invalid transitions by ID, which do not abort the other results, see
+        farms.models.transitions."""
 
         with transaction.atomic():
-            for start_result in results.get("start", []):
-                next(
-                    task for task in tasks if str(task.id) == start_result["uuid"]
-                ).apply_start_result(start_result)
-            for stop_result in results.get("stop", []):
-                next(
-                    task for task in tasks if str(task.id) == stop_result["uuid"]
-                ).apply_stop_result(stop_result)
-            self.bulk_update(tasks, ["state"])
-        return tasks
+            tasks, errors = transitions.apply_results(
+                self.model, self.model.RESULT_TRANSITIONS, results
+            )
+        if any(
+            task.state == self.model.State.RUNNING and task.run_until for task in tasks
+        ):
+            expiry.wake_up()
+        return tasks, errors
 
     def commands_from_register(
         self, running_tasks: List[str], controller_id: uuid.UUID
@@ -210,14 +312,93 @@ class ControllerTaskManager(models.Manager):
             return {"start": commands}
         return {}
 
+    def retry_commands(
+        self, task_ids: List[str], request_id: str, fail: bool
+    ) -> List[str]:
+        """Send the commands of the tasks that are still starting or stopping to their
+        controllers again, or move the tasks to the failed state if fail. Returns the
+        IDs of the tasks whose commands are still outstanding."""
+
+        with transaction.atomic():
+            tasks = list(
+                self.select_for_update().filter(
+                    pk__in=task_ids, state__in=self.model.PENDING_STATES
+                )
+            )
+            if fail:
+                for task in tasks:
+                    task.state = self.model.State.FAILED
+                self.bulk_update(tasks, ["state"])
+                return []
+
+        channel_names = dict(
+            ControllerComponent.objects.filter(
+                pk__in={task.controller_component_id for task in tasks}
+            ).values_list("pk", "channel_name")
+        )
+        self._send_commands_to_controllers(
+            [task for task in tasks if channel_names.get(task.controller_component_id)],
+            channel_names,
+            request_id,
+            track=False,
+        )
+        return [str(task.pk) for task in tasks]
+
+    def stop_expired(self, now: datetime = None) -> List["ControllerTask"]:
+        """Stop the running tasks whose run until time passed, sending one stop command
+        message per controller. The tasks of disconnected controllers are stopped
+        without command, as they are not restarted when the controller registers."""
+
+        now = now or datetime.now(tz=timezone.utc)
+        with transaction.atomic():
+            tasks = list(
+                self.select_for_update(skip_locked=True).filter(
+                    state=self.model.State.RUNNING, run_until__lte=now
+                )
+            )
+            channel_names = dict(
+                ControllerComponent.objects.filter(
+                    pk__in={task.controller_component_id for task in tasks}
+                ).values_list("pk", "channel_name")
+            )
+            for task in tasks:
+                if channel_names.get(task.controller_component_id):
+                    task.state = self.model.State.STOPPING
+                else:
+                    task.state = self.model.State.STOPPED
+            for state in [self.model.State.STOPPING, self.model.State.STOPPED]:
+                self.filter(
+                    pk__in=[task.pk for task in tasks if task.state == state]
+                ).update(state=state)
+            self._send_commands_to_controllers(
+                [task for task in tasks if task.state == self.model.State.STOPPING],
+                channel_names,
+            )
+        return tasks
+
+    def next_run_until(self) -> Optional[datetime]:
+        """The earliest run until time of the running tasks"""
+
+        return (
+            self.filter(state=self.model.State.RUNNING, run_until__isnull=False)
+            .order_by("run_until")
+            .values_list("run_until", flat=True)
+            .first()
+        )
+
     @staticmethod
     def _send_commands_to_controller(
-        channel_name: str, task_commands: List[Dict], request_id: str = None
+        channel_name: str,
+        task_commands: List[Dict],
+        request_id: str = None,
+        track: bool = True,
     ) -> None:
-        """Send task commands to the controller"""
+        """Send task commands to the controller. Unless they are retried, they are
+        tracked until the controller acknowledges them."""
 
         if not channel_name:
             raise ValueError("Controller has not connected to the server")
+        request_id = request_id or uuid.uuid4().hex
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.send)(
             channel_name,
@@ -227,6 +408,8 @@ class ControllerTaskManager(models.Manager):
                 "request_id": request_id,
             },
         )
+        if track:
+            scheduler.track(scheduler.TASK, task_commands, request_id)
 
 
 class ControllerTask(models.Model):
@@ -234,6 +417,16 @@ class ControllerTask(models.Model):
 
     objects = ControllerTaskManager()
 
+    class Meta:
+        indexes = [
+            # The run until times of the running tasks, see farms.expiry
+            models.Index(
+                fields=["run_until"],
+                name="controllertask_run_until_idx",
+                condition=models.Q(state="running"),
+            ),
+        ]
+
     class InvalidTransition(Exception):
         """Thrown when an invalid state change is applied."""
 
@@ -250,6 +443,19 @@ class ControllerTask(models.Model):
     STOPPABLE_STATES = [State.STARTING.value, State.RUNNING.value, State.STOPPING.value]
     # States to start tasks again (registration after reboot)
     RE_START_STATES = [State.STARTING.value, State.RUNNING.value]
+    # States waiting for the result of a command, see farms.scheduler
+    PENDING_STATES = [State.STARTING.value, State.STOPPING.value]
+    # State changes by the results of the controllers, see farms.models.transitions
+    RESULT_TRANSITIONS = {
+        "start": {
+            "success": {State.STARTING.value: State.RUNNING.value},
+            "fail": {State.STARTING.value: State.FAILED.value},
+        },
+        "stop": {
+            "success": dict.fromkeys(STOPPABLE_STATES, State.STOPPED.value),
+            "fail": dict.fromkeys(STOPPABLE_STATES, State.STOPPED.value),
+        },
+    }
 
     class TaskType(models.TextChoices):
         """Possible task types."""
@@ -332,32 +538,25 @@ class ControllerTask(models.Model):
         """Modify the state according to the result. Raises ValueError or
         InvalidTransition on errors."""
 
-        try:
-            status = result["status"]
-        except KeyError as err:
-            raise ValueError(f"Missing key {err}") from err
-        if self.state == self.State.STARTING and status == "success":
-            self.state = self.State.RUNNING
-        elif self.state == self.State.STARTING and status == "fail":
-            self.state = self.State.FAILED
-        else:
-            raise self.InvalidTransition(f"Apply start result {status} to {self.state}")
+        self._apply_result("start", result)
 
     def apply_stop_result(self, result):
         """Modify the state according to the result. Raises ValueError or
         InvalidTransition on errors."""
 
+        self._apply_result("stop", result)
+
+    def _apply_result(self, name: str, result: Dict):
         if (status := result.get("status")) is None:
             raise ValueError("Missing 'status' property")
-        success_fail = ["success", "fail"]
-        if self.state == self.State.STARTING and status in success_fail:
-            self.state = self.State.STOPPED
-        elif self.state == self.State.RUNNING and status in success_fail:
-            self.state = self.State.STOPPED
-        elif self.state == self.State.STOPPING and status in success_fail:
-            self.state = self.State.STOPPED
-        else:
-            raise self.InvalidTransition(f"Apply stop result {status} to {self.state}")
+        state = transitions.next_state(
+            self.RESULT_TRANSITIONS, name, status, self.state
+        )
+        if state is None:
+            raise self.InvalidTransition(
+                f"Apply {name} result {status} to {self.state}"
+            )
+        self.state = state
 
     def __str__(self):
         return f"{self.task_type}: {self.state}"
@@ -1,10 +1,19 @@
+import math
+import os
 import uuid
 from datetime import timedelta, datetime, timezone
-from typing import List, Dict, Any
+from functools import reduce
+from operator import or_
+from typing import List, Dict, Any, Tuple
 
-from django.db import models, IntegrityError, transaction
+import numpy
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connections, models, router, IntegrityError, transaction
+from django.db.models import Q
 from django.utils.dateparse import parse_datetime
 
+from farms import archive, cache
 from farms.models.peripheral import PeripheralComponent
 
 
@@ -53,15 +62,601 @@ class DataPointManager(models.Manager):
                 time += timedelta(microseconds=1)
         except KeyError as err:
             raise ValueError(f"Missing property {err}") from err
-        self.bulk_create(data_points)
+        return self.insert(data_points)
+
+    def insert(self, data_points: List["DataPoint"]) -> List["DataPoint"]:
+        """Insert data points in bulk, invalidate the cached results they change and
+        publish them to the dashboards. Equal times are smeared by 1 µs. If a time is
+        taken already, the data points are saved one by one, smearing them further."""
+
+        previous = None
+        for data_point in sorted(data_points, key=lambda data_point: data_point.time):
+            if previous is not None and data_point.time <= previous:
+                data_point.time = previous + timedelta(microseconds=1)
+            previous = data_point.time
+        try:
+            with transaction.atomic():
+                self.bulk_create(data_points)
+        except IntegrityError as err:
+            if "already exists" not in str(err):
+                raise
+            for data_point in data_points:
+                data_point._save_and_smear_timestamp()
+
+        # Late data points change results that may already be cached. The cache is
+        # invalidated after the commit, otherwise concurrent readers could cache the
+        # results without the data points again before they are visible.
+        series = {
+            (
+                str(data_point.peripheral_component_id),
+                str(data_point.data_point_type_id),
+            )
+            for data_point in data_points
+            if cache.is_settled(data_point.time)
+        }
+        if series:
+            transaction.on_commit(
+                lambda: cache.invalidate(series), using=router.db_for_write(self.model)
+            )
+        by_peripheral: Dict[str, List["DataPoint"]] = {}
+        for data_point in data_points:
+            by_peripheral.setdefault(
+                str(data_point.peripheral_component_id), []
+            ).append(data_point)
+        for peripheral_id, peripheral_data_points in by_peripheral.items():
+            self.publish(peripheral_id, peripheral_data_points)
         return data_points
 
+    def publish(self, peripheral_id: str, data_points: List["DataPoint"]) -> None:
+        """Publish new data points of a peripheral component to the dashboards that
+        subscribed to it"""
+
+        if not data_points:
+            return
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            self.model.group_name(peripheral_id),
+            {
+                "type": "data_points.new",
+                "peripheral_component": str(peripheral_id),
+                "data_points": [
+                    {
+                        "time": data_point.time.isoformat(),
+                        "data_point_type": str(data_point.data_point_type_id),
+                        "value": data_point.value,
+                    }
+                    for data_point in data_points
+                ],
+            },
+        )
+
+    # Upper limit of data points per series to protect the DB from run-away queries
+    MAX_SERIES_POINTS = 100000
+
+    # Width of the blocks in which series are cached
+    SERIES_BLOCK_WIDTH = timedelta(hours=1)
+
+    def series(
+        self,
+        peripheral_component_id: uuid.UUID,
+        data_point_type_id: uuid.UUID,
+        start: datetime,
+        end: datetime,
+    ) -> Dict[str, List]:
+        """Read the data points of a peripheral component and data point type in the time
+        range as parallel 'time' and 'value' lists, oldest first. The rows are read as
+        tuples without instantiating models and closed time ranges are cached. Raises
+        ValueError on invalid arguments."""
+
+        try:
+            key = (
+                str(uuid.UUID(str(peripheral_component_id))),
+                str(uuid.UUID(str(data_point_type_id))),
+            )
+        except ValueError as err:
+            raise ValueError(f"Invalid series: {err}") from err
+        start = self.model.to_timezone_datetime(start)
+        end = self.model.to_timezone_datetime(end)
+        if start >= end:
+            raise ValueError("The start has to be before the end")
+
+        def fetch(ranges: List[cache.Range]) -> List[List[Tuple]]:
+            rows = list(
+                self.filter(
+                    reduce(
+                        or_,
+                        (
+                            Q(time__gte=range_start, time__lt=range_end)
+                            for _, range_start, range_end in ranges
+                        ),
+                    ),
+                    peripheral_component_id=key[0],
+                    data_point_type_id=key[1],
+                )
+                .order_by("time")
+                .values_list("time", "value")[: self.MAX_SERIES_POINTS + 1]
+            )
+            rows.extend(
+                self._archived_rows(
+                    key,
+                    min(range_start for _, range_start, _ in ranges),
+                    max(range_end for _, _, range_end in ranges),
+                )
+            )
+            if len(rows) > self.MAX_SERIES_POINTS:
+                raise ValueError(
+                    f"More than {self.MAX_SERIES_POINTS} data points requested"
+                )
+            rows.sort(key=lambda row: row[0])
+            return [
+                [row for row in rows if range_start <= row[0] < range_end]
+                for _, range_start, range_end in ranges
+            ]
+
+        rows = cache.BlockCache("series", self.SERIES_BLOCK_WIDTH).get(
+            [key], start, end, fetch
+        )[key]
+        if len(rows) > self.MAX_SERIES_POINTS:
+            raise ValueError(f"More than {self.MAX_SERIES_POINTS} data points requested")
+        times, values = zip(*rows) if rows else ((), ())
+        return {"time": list(times), "value": list(values)}
+
+    # Upper limit of buckets per series to protect the DB from run-away queries
+    MAX_BUCKETS = 10000
+
+    # Number of time buckets per cached block
+    CACHE_BLOCK_BUCKETS = 24
+
+    def aggregate_buckets(
+        self,
+        series: List[Tuple[uuid.UUID, uuid.UUID]],
+        start: datetime,
+        end: datetime,
+        bucket_width: timedelta,
+        aggregates: List[str],
+        percentile: float = 0.5,
+    ) -> List[Dict]:
+        """Aggregate the values of the series, given as (peripheral component ID, data
+        point type ID) pairs, into time buckets with a single time_bucket query. Returns
+        one columnar result per series in the requested order. Raises ValueError on
+        invalid arguments."""
+
+        series = self._series_keys(series)
+        if not aggregates:
+            raise ValueError("At least one aggregate is required")
+        start = self.model.to_timezone_datetime(start)
+        end = self.model.to_timezone_datetime(end)
+        if start >= end:
+            raise ValueError("The start has to be before the end")
+        if bucket_width <= timedelta(0):
+            raise ValueError("The bucket width has to be positive")
+        if (end - start) / bucket_width > self.MAX_BUCKETS:
+            raise ValueError(f"More than {self.MAX_BUCKETS} buckets requested")
+        aggregates = list(dict.fromkeys(aggregates))
+        for aggregate in aggregates:
+            if aggregate not in self.model.Aggregate.values:
+                raise ValueError(f"Unknown aggregate: {aggregate}")
+            if aggregate == self.model.Aggregate.PERCENTILE and not 0 <= percentile <= 1:
+                raise ValueError("The percentile has to be between 0 and 1")
+
+        block_cache = cache.BlockCache(
+            f"buckets:{bucket_width.total_seconds()}:{','.join(aggregates)}:{percentile}",
+            block_width=bucket_width * self.CACHE_BLOCK_BUCKETS,
+            step=bucket_width,
+        )
+        rows = block_cache.get(
+            series,
+            start,
+            end,
+            lambda ranges: self._aggregate_ranges(
+                ranges, bucket_width, aggregates, percentile
+            ),
+        )
+        results = []
+        for (peripheral_id, type_id), series_rows in rows.items():
+            result = {
+                "peripheral_component_id": peripheral_id,
+                "data_point_type_id": type_id,
+                "time": [],
+                "values": {aggregate: [] for aggregate in aggregates},
+            }
+            for bucket, *values in series_rows:
+                result["time"].append(bucket)
+                for aggregate, value in zip(aggregates, values):
+                    result["values"][aggregate].append(value)
+            results.append(result)
+        return results
+
+    # Continuous aggregates of the data points and the width of their buckets, coarsest
+    # first (see migration 0033)
+    ROLLUPS = [
+        (timedelta(days=1), "farms_datapoint_1d"),
+        (timedelta(hours=1), "farms_datapoint_1h"),
+        (timedelta(minutes=1), "farms_datapoint_1m"),
+    ]
+
+    # The aggregates that can be computed from the rollups
+    ROLLUP_AGGREGATES = ["avg", "min", "max", "sum", "count"]
+
+    def downsample(
+        self,
+        series: List[Tuple[uuid.UUID, uuid.UUID]],
+        start: datetime,
+        end: datetime,
+        interval: timedelta,
+        max_points: int,
+        aggregate: str = "avg",
+    ) -> List[Dict]:
+        """Aggregate the series into time buckets at least as wide as the interval and
+        at most max_points per series, in the format of aggregate_buckets. The buckets
+        are read from the coarsest rollup whose width fits into them, and from the data
+        points and the archive if none does, the range starts before the archive
+        watermark or the aggregate is not available in the rollups. Raises ValueError
+        on invalid arguments."""
+
+        start = self.model.to_timezone_datetime(start)
+        end = self.model.to_timezone_datetime(end)
+        if start >= end:
+            raise ValueError("The start has to be before the end")
+        if max_points < 1:
+            raise ValueError("At least one data point has to be requested")
+        bucket_width = max(interval, (end - start) / max_points)
+        bucket_width = timedelta(seconds=math.ceil(bucket_width.total_seconds()))
+        if aggregate in self.ROLLUP_AGGREGATES:
+            # The rollups do not contain the archived data points
+            watermark = archive.get_watermark()
+            for rollup_width, table in self.ROLLUPS:
+                if rollup_width <= bucket_width and (
+                    watermark is None or start >= watermark
+                ):
+                    # Buckets have to consist of whole rollup buckets
+                    bucket_width = rollup_width * math.ceil(bucket_width / rollup_width)
+                    return self._rollup_buckets(
+                        table, series, start, end, bucket_width, aggregate
+                    )
+        return self.aggregate_buckets(series, start, end, bucket_width, [aggregate])
+
+    def _rollup_buckets(
+        self,
+        table: str,
+        series: List[Tuple[uuid.UUID, uuid.UUID]],
+        start: datetime,
+        end: datetime,
+        bucket_width: timedelta,
+        aggregate: str,
+    ) -> List[Dict]:
+        """Combine the buckets of a rollup into wider time buckets with a single query"""
+
+        series = self._series_keys(series)
+        if (end - start) / bucket_width > self.MAX_BUCKETS:
+            raise ValueError(f"More than {self.MAX_BUCKETS} buckets requested")
+        series_values = ", ".join(["(%s, %s::uuid, %s::uuid)"] * len(series))
+        query = f"""
+            SELECT series.series_index, time_bucket(%s, rollup.bucket) AS wide_bucket,
+                sum(rollup.value_sum), sum(rollup.value_count)::bigint,
+                min(rollup.value_min), max(rollup.value_max)
+            FROM {table} AS rollup
+            JOIN (VALUES {series_values}) AS series (
+                series_index, peripheral_component_id, data_point_type_id
+            )
+            ON rollup.peripheral_component_id = series.peripheral_component_id
+                AND rollup.data_point_type_id = series.data_point_type_id
+            WHERE rollup.bucket >= %s AND rollup.bucket < %s
+            GROUP BY series.series_index, wide_bucket
+            ORDER BY series.series_index, wide_bucket
+        """
+        params = [bucket_width]
+        for index, (peripheral_id, type_id) in enumerate(series):
+            params.extend([index, peripheral_id, type_id])
+        params.extend([start, end])
+        with connections[router.db_for_read(self.model)].cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        results = [
+            {
+                "peripheral_component_id": peripheral_id,
+                "data_point_type_id": type_id,
+                "time": [],
+                "values": {aggregate: []},
+            }
+            for peripheral_id, type_id in series
+        ]
+        for index, bucket, value_sum, value_count, value_min, value_max in rows:
+            value = {
+                self.model.Aggregate.AVG.value: value_sum / value_count,
+                self.model.Aggregate.MIN.value: value_min,
+                self.model.Aggregate.MAX.value: value_max,
+                self.model.Aggregate.SUM.value: value_sum,
+                self.model.Aggregate.COUNT.value: value_count,
+            }[aggregate]
+            results[index]["time"].append(bucket)
+            results[index]["values"][aggregate].append(value)
+        return results
+
+    @staticmethod
+    def _series_keys(series: List[Tuple[uuid.UUID, uuid.UUID]]) -> List[cache.Series]:
+        """Validate the series and return them as unique pairs of strings. Raises
+        ValueError if there are none or one is invalid."""
+
+        if not series:
+            raise ValueError("At least one series is required")
+        try:
+            series = [
+                (str(uuid.UUID(str(peripheral_id))), str(uuid.UUID(str(type_id))))
+                for peripheral_id, type_id in series
+            ]
+        except ValueError as err:
+            raise ValueError(f"Invalid series: {err}") from err
+        return list(dict.fromkeys(series))
+
+    def aligned_matrix(
+        self,
+        series: List[Tuple[uuid.UUID, uuid.UUID]],
+        start: datetime,
+        end: datetime,
+        step: timedelta,
+        fill: str = "null",
+        aggregate: str = "avg",
+    ) -> Dict:
+        """Aggregate the series into time buckets of the step width on one shared time
+        axis. Returns the 'time' of each bucket and per series a row of 'values', one per
+        bucket. Empty buckets are null, carry the last value forward or are linearly
+        interpolated between their neighbours, depending on the fill. Raises ValueError
+        on invalid arguments."""
+
+        if fill not in self.model.Fill.values:
+            raise ValueError(f"Unknown fill: {fill}")
+        results = self.aggregate_buckets(series, start, end, step, [aggregate])
+        first = cache.floor_time(self.model.to_timezone_datetime(start), step)
+        end = self.model.to_timezone_datetime(end)
+        times = [first]
+        while times[-1] + step < end:
+            times.append(times[-1] + step)
+
+        # One row per series and one column per bucket, empty buckets are NaN
+        matrix = numpy.full((len(results), len(times)), numpy.nan)
+        for row, result in enumerate(results):
+            offsets = numpy.array(
+                [(time - first).total_seconds() for time in result["time"]]
+            )
+            columns = numpy.rint(offsets / step.total_seconds()).astype(int)
+            matrix[row, columns] = numpy.array(
+                result["values"][aggregate], dtype=float
+            )
+        if fill == self.model.Fill.LOCF:
+            matrix = _fill_locf(matrix)
+        elif fill == self.model.Fill.LINEAR:
+            matrix = _fill_linear(matrix)
+
+        values = numpy.where(numpy.isnan(matrix), None, matrix.astype(object))
+        return {
+            "time": times,
+            "series": [
+                {
+                    "peripheral_component_id": result["peripheral_component_id"],
+                    "data_point_type_id": result["data_point_type_id"],
+                    "values": row_values,
+                }
+                for result, row_values in zip(results, values.tolist())
+            ],
+        }
+
+    def _aggregate_ranges(
+        self,
+        ranges: List[cache.Range],
+        bucket_width: timedelta,
+        aggregates: List[str],
+        percentile: float,
+    ) -> List[List[Tuple]]:
+        """Aggregate the time buckets of each range independently with a single query.
+        Returns the (bucket, *aggregates) rows of each range."""
+
+        results: List[List[Tuple]] = [[] for _ in ranges]
+
+        # The buckets up to the archive watermark are aggregated here from the rows of
+        # the archive and the database, the later ones by the database
+        watermark = archive.get_watermark()
+        database_ranges = []
+        for index, (key, lower, upper) in enumerate(ranges):
+            if watermark is not None and lower < watermark:
+                archive_end = min(upper, cache.ceil_time(watermark, bucket_width))
+                rows = self._archived_rows(key, lower, archive_end)
+                rows.extend(
+                    self.filter(
+                        peripheral_component_id=key[0],
+                        data_point_type_id=key[1],
+                        time__gte=lower,
+                        time__lt=archive_end,
+                    ).values_list("time", "value")
+                )
+                results[index] = self._aggregate_rows(
+                    rows, bucket_width, aggregates, percentile
+                )
+                lower = archive_end
+            if lower < upper:
+                database_ranges.append((index, key, lower, upper))
+        if not database_ranges:
+            return results
+
+        aggregate_columns = []
+        aggregate_params = []
+        for aggregate in aggregates:
+            if aggregate == self.model.Aggregate.PERCENTILE:
+                aggregate_params.append(percentile)
+            aggregate_columns.append(self.model.AGGREGATE_SQL[aggregate])
+
+        # The overall time bounds allow TimescaleDB to exclude chunks
+        range_values = ", ".join(
+            ["(%s, %s::uuid, %s::uuid, %s::timestamptz, %s::timestamptz)"]
+            * len(database_ranges)
+        )
+        query = f"""
+            SELECT ranges.range_index, time_bucket(%s, time) AS bucket,
+                {", ".join(aggregate_columns)}
+            FROM {self.model._meta.db_table} AS data_point
+            JOIN (VALUES {range_values}) AS ranges (
+                range_index, peripheral_component_id, data_point_type_id,
+                range_start, range_end
+            )
+            ON data_point.peripheral_component_id = ranges.peripheral_component_id
+                AND data_point.data_point_type_id = ranges.data_point_type_id
+                AND data_point.time >= ranges.range_start
+                AND data_point.time < ranges.range_end
+            WHERE data_point.time >= %s AND data_point.time < %s
+            GROUP BY ranges.range_index, bucket
+            ORDER BY ranges.range_index, bucket
+        """
+        params = [bucket_width, *aggregate_params]
+        for index, (peripheral_id, type_id), lower, upper in database_ranges:
+            params.extend([index, peripheral_id, type_id, lower, upper])
+        params.append(min(lower for _, _, lower, _ in database_ranges))
+        params.append(max(upper for _, _, _, upper in database_ranges))
+        with connections[router.db_for_read(self.model)].cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        for index, *row in rows:
+            results[index].append(tuple(row))
+        return results
+
+    def _aggregate_rows(
+        self,
+        rows: List[Tuple[datetime, float]],
+        bucket_width: timedelta,
+        aggregates: List[str],
+        percentile: float,
+    ) -> List[Tuple]:
+        """Aggregate (time, value) rows into time buckets like the SQL aggregates"""
+
+        buckets: Dict[datetime, List[Tuple[datetime, float]]] = {}
+        for row in sorted(rows):
+            buckets.setdefault(cache.floor_time(row[0], bucket_width), []).append(row)
+        results = []
+        for bucket, bucket_rows in buckets.items():
+            values = [value for _, value in bucket_rows]
+            functions = {
+                self.model.Aggregate.AVG.value: lambda: sum(values) / len(values),
+                self.model.Aggregate.MIN.value: lambda: min(values),
+                self.model.Aggregate.MAX.value: lambda: max(values),
+                self.model.Aggregate.SUM.value: lambda: sum(values),
+                self.model.Aggregate.COUNT.value: lambda: len(values),
+                self.model.Aggregate.FIRST.value: lambda: values[0],
+                self.model.Aggregate.LAST.value: lambda: values[-1],
+                self.model.Aggregate.PERCENTILE.value: lambda: _percentile_cont(
+                    sorted(values), percentile
+                ),
+            }
+            results.append(
+                (bucket, *[functions[aggregate]() for aggregate in aggregates])
+            )
+        return results
+
+    def _archived_rows(
+        self, key: cache.Series, start: datetime, end: datetime
+    ) -> List[Tuple[datetime, float]]:
+        """Read the archived (time, value) rows of a series in the range"""
+
+        rows = []
+        for table in archive.read_tables(start, end, [key[0]], [key[1]]):
+            rows.extend(
+                zip(table.column("time").to_pylist(), table.column("value").to_pylist())
+            )
+        return rows
+
+    def archive(self, horizon: datetime) -> int:
+        """Move the data points of the months before the horizon to the archive. Each
+        month of a peripheral component is deleted and written to a file in one
+        transaction. Returns the number of archived data points. Raises ValueError if
+        the archive is not available."""
+
+        if not archive.is_available():
+            raise ValueError("The archive requires pyarrow and DATA_POINT_ARCHIVE_DIR")
+        end = archive.month_start(self.model.to_timezone_datetime(horizon))
+        # Reads merge the archive up to the watermark, so it is moved before the data
+        watermark = archive.get_watermark()
+        if watermark is None or watermark < end:
+            archive.set_watermark(end)
+
+        table = self.model._meta.db_table
+        database = connections[router.db_for_write(self.model)]
+        with database.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT DISTINCT peripheral_component_id,
+                    date_trunc('month', time AT TIME ZONE 'UTC')
+                FROM {table} WHERE time < %s
+                """,
+                [end],
+            )
+            parts = cursor.fetchall()
+
+        archived = 0
+        for peripheral_id, month in parts:
+            month = month.replace(tzinfo=timezone.utc)
+            path = None
+            try:
+                with transaction.atomic(using=database.alias):
+                    with database.cursor() as cursor:
+                        cursor.execute(
+                            f"""
+                            DELETE FROM {table}
+                            WHERE peripheral_component_id = %s
+                                AND time >= %s AND time < %s AND time < %s
+                            RETURNING time, data_point_type_id, value
+                            """,
+                            [peripheral_id, month, archive.next_month(month), end],
+                        )
+                        rows = cursor.fetchall()
+                    if rows:
+                        path = archive.write_rows(month, peripheral_id, rows)
+            except Exception:
+                # Nothing was deleted, so the file would duplicate the data points
+                if path is not None:
+                    os.remove(path)
+                raise
+            archived += len(rows)
+        return archived
+
 
 class DataPoint(models.Model):
     """Data points generated by peripherals, described by the data point type."""
 
     objects = DataPointManager()
 
+    class Fill(models.TextChoices):
+        """How empty time buckets of an aligned matrix are filled."""
+
+        NULL = ("null", "Null")
+        LOCF = ("locf", "Last observation carried forward")
+        LINEAR = ("linear", "Linear interpolation")
+
+    class Aggregate(models.TextChoices):
+        """Aggregate functions that can be applied to time buckets."""
+
+        AVG = ("avg", "Average")
+        MIN = ("min", "Minimum")
+        MAX = ("max", "Maximum")
+        SUM = ("sum", "Sum")
+        COUNT = ("count", "Count")
+        FIRST = ("first", "First")
+        LAST = ("last", "Last")
+        PERCENTILE = ("percentile", "Percentile")
+
+    # SQL expressions of the aggregates. The percentile takes the fraction as parameter
+    AGGREGATE_SQL = {
+        Aggregate.AVG.value: "avg(value)",
+        Aggregate.MIN.value: "min(value)",
+        Aggregate.MAX.value: "max(value)",
+        Aggregate.SUM.value: "sum(value)",
+        Aggregate.COUNT.value: "count(value)",
+        Aggregate.FIRST.value: "first(value, time)",
+        Aggregate.LAST.value: "last(value, time)",
+        Aggregate.PERCENTILE.value: (
+            "percentile_cont(%s) WITHIN GROUP (ORDER BY value)"
+        ),
+    }
+
     time = models.DateTimeField(primary_key=True, default=datetime.now)
     peripheral_component = models.ForeignKey(
         PeripheralComponent,
@@ -81,11 +676,24 @@ class DataPoint(models.Model):
 
     class Meta:
         ordering = ['-time']
+        indexes = [
+            # Keyset pagination and time range queries of a peripheral's data points
+            models.Index(
+                fields=["peripheral_component", "-time"],
+                name="datapoint_peripheral_time_idx",
+            ),
+        ]
 
     def save(self, *args, **kwargs):  # pylint: disable=signature-differs
         # If it is a 'naive' datetime, no timezone info, raise an error
         self.time = self.to_timezone_datetime(self.time)
         self._save_and_smear_timestamp(*args, **kwargs)
+        if cache.is_settled(self.time):
+            series = [(str(self.peripheral_component_id), str(self.data_point_type_id))]
+            transaction.on_commit(
+                lambda: cache.invalidate(series),
+                using=router.db_for_write(type(self), instance=self),
+            )
 
     def _save_and_smear_timestamp(self, *args, **kwargs):
         """Recursivly try to save by incrementing the timestamp on duplicate error"""
@@ -102,6 +710,12 @@ class DataPoint(models.Model):
                 self.time = self.time + timedelta(microseconds=1)
                 self._save_and_smear_timestamp(*args, **kwargs)
 
+    @staticmethod
+    def group_name(peripheral_id: Any) -> str:
+        """The channel group new data points of a peripheral component are sent to"""
+
+        return f"data_points.{peripheral_id}"
+
     @staticmethod
     def to_timezone_datetime(raw_time: Any) -> datetime:
         """Try to convert it to a valid datetime with timezone"""
@@ -120,3 +734,37 @@ class DataPoint(models.Model):
 
     def __str__(self):
         return f"{self.value} {self.data_point_type.unit} from {self.peripheral_component.site_entity.name}"
+
+
+def _percentile_cont(values: List[float], fraction: float) -> float:
+    """The percentile of sorted values with linear interpolation, like percentile_cont"""
+
+    position = fraction * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _fill_locf(matrix: numpy.ndarray) -> numpy.ndarray:
+    """Fill the NaN cells of each row with the last value before them"""
+
+    columns = numpy.arange(matrix.shape[1])
+    last = numpy.where(numpy.isnan(matrix), 0, columns)
+    numpy.maximum.accumulate(last, axis=1, out=last)
+    return numpy.take_along_axis(matrix, last, axis=1)
+
+
+def _fill_linear(matrix: numpy.ndarray) -> numpy.ndarray:
+    """Interpolate the NaN cells of each row between the values around them. Cells
+    before the first or after the last value stay NaN."""
+
+    matrix = matrix.copy()
+    columns = numpy.arange(matrix.shape[1])
+    for row in matrix:
+        known = ~numpy.isnan(row)
+        if known.sum() < 2:
+            continue
+        known_columns = columns[known]
+        missing = ~known & (columns > known_columns[0]) & (columns < known_columns[-1])
+        row[missing] = numpy.interp(columns[missing], known_columns, row[known])
+    return matrix
@@ -1,11 +1,15 @@
 from asgiref.sync import async_to_sync
-from typing import Dict, List, Optional
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 import uuid
 
 from channels.layers import get_channel_layer
 from django.core.exceptions import ValidationError
 from django.db import models, IntegrityError, transaction
+from django.db.models import prefetch_related_objects
 
+from farms import scheduler
+from farms.models import transitions
 from farms.models.site import SiteEntity
 from farms.models.controller import ControllerComponent
 
@@ -112,29 +116,17 @@ class PeripheralComponentManager(models.Manager):
             commands.update({"remove": remove_peripherals})
         return commands
 
-    def from_results(self, results: Dict) -> List["PeripheralComponent"]:
-        """Update states from results commands"""
-
-        # Get all peripheral ids to update
-        uuids = [result["uuid"] for result in results.get("add", [])]
-        uuids.extend([result["uuid"] for result in results.get("remove", [])])
-        peripherals = self.select_for_update().filter(pk__in=uuids)
+    def from_results(
+        self, results: Dict
+    ) -> Tuple[List["PeripheralComponent"], Dict[str, str]]:
+        """Update states from results commands. Returns the changed peripherals and the
+        errors of invalid transitions by ID, which do not abort the other results, see
+        farms.models.transitions."""
 
         with transaction.atomic():
-            for add_result in results.get("add", []):
-                next(
-                    peripheral
-                    for peripheral in peripherals
-                    if str(peripheral.pk) == add_result["uuid"]
-                ).apply_add_result(add_result)
-            for remove_result in results.get("remove", []):
-                next(
-                    peripheral
-                    for peripheral in peripherals
-                    if str(peripheral.pk) == remove_result["uuid"]
-                ).apply_remove_result(remove_result)
-            self.bulk_update(peripherals, ["state"])
-        return peripherals
+            return transitions.apply_results(
+                self.model, self.model.RESULT_TRANSITIONS, results
+            )
 
     def commands_from_register(
         self, added_peripherals: List[str], controller_id: uuid.UUID
@@ -164,14 +156,59 @@ class PeripheralComponentManager(models.Manager):
             return {"add": commands}
         return {}
 
+    def retry_commands(
+        self, peripheral_ids: List[str], request_id: str, fail: bool
+    ) -> List[str]:
+        """Send the commands of the peripherals that are still adding or removing to
+        their controllers again, or move the peripherals to the failed state if fail.
+        Returns the IDs of the peripherals whose commands are still outstanding."""
+
+        with transaction.atomic():
+            peripherals = list(
+                self.select_for_update()
+                .filter(pk__in=peripheral_ids, state__in=self.model.PENDING_STATES)
+                .order_by("created_at")
+            )
+            if fail:
+                for peripheral in peripherals:
+                    peripheral.state = self.model.State.FAILED
+                self.bulk_update(peripherals, ["state"])
+                return []
+
+        prefetch_related_objects(peripherals, "data_point_type_edges")
+        peripherals_by_controller = defaultdict(list)
+        for peripheral in peripherals:
+            peripherals_by_controller[peripheral.controller_component_id].append(
+                peripheral
+            )
+        channel_names = dict(
+            ControllerComponent.objects.filter(
+                pk__in=peripherals_by_controller.keys()
+            ).values_list("pk", "channel_name")
+        )
+        for controller_id, controller_peripherals in peripherals_by_controller.items():
+            if channel_names.get(controller_id):
+                self._send_commands_to_controller(
+                    channel_names[controller_id],
+                    self.to_commands(controller_peripherals),
+                    request_id,
+                    track=False,
+                )
+        return [str(peripheral.pk) for peripheral in peripherals]
+
     @staticmethod
     def _send_commands_to_controller(
-        channel_name: str, peripheral_commands: List[Dict], request_id: str = None
+        channel_name: str,
+        peripheral_commands: List[Dict],
+        request_id: str = None,
+        track: bool = True,
     ) -> None:
-        """Send peripheral commands to the controller"""
+        """Send peripheral commands to the controller. Unless they are retried, they are
+        tracked until the controller acknowledges them."""
 
         if not channel_name:
             raise ValueError("Controller has not connected to the server")
+        request_id = request_id or uuid.uuid4().hex
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.send)(
             channel_name,
@@ -181,6 +218,8 @@ class PeripheralComponentManager(models.Manager):
                 "request_id": request_id,
             },
         )
+        if track:
+            scheduler.track(scheduler.PERIPHERAL, peripheral_commands, request_id)
 
 
 def validate_other_parameters(value):
@@ -215,6 +254,19 @@ class PeripheralComponent(models.Model):
     REMOVABLE_STATES = [State.ADDING.value, State.ADDED.value, State.REMOVING.value]
     # States to add peripherals again (registration after reboot)
     RE_ADD_STATES = [State.ADDING.value, State.ADDED.value]
+    # States waiting for the result of a command, see farms.scheduler
+    PENDING_STATES = [State.ADDING.value, State.REMOVING.value]
+    # State changes by the results of the controllers, see farms.models.transitions
+    RESULT_TRANSITIONS = {
+        "add": {
+            "success": {State.ADDING.value: State.ADDED.value},
+            "fail": {State.ADDING.value: State.FAILED.value},
+        },
+        "remove": {
+            "success": {State.REMOVING.value: State.REMOVED.value},
+            "fail": {State.REMOVING.value: State.ADDED.value},
+        },
+    }
 
     class PeripheralType(models.TextChoices):
         """Possible peripheral types."""
@@ -272,9 +324,16 @@ class PeripheralComponent(models.Model):
         """Get all peripheral setup parameters, combining the data point type ones with
         the others."""
 
+        return self.combine_parameters(self.data_point_type_edges.all())
+
+    def combine_parameters(
+        self, data_point_type_edges: Iterable["PeripheralDataPointType"]
+    ) -> Dict:
+        """Combine the parameters of the data point type edges with the others"""
+
         data_point_types = {
             parameter_name: str(dpt_id)
-            for edge in self.data_point_type_edges.all()
+            for edge in data_point_type_edges
             for parameter_name, dpt_id in edge.parameter.items()
         }
         return {**data_point_types, **self.other_parameters}
@@ -308,28 +367,23 @@ class PeripheralComponent(models.Model):
     def apply_add_result(self, result):
         """Modify the state accoring to the result"""
 
-        status = result["status"]
-        if self.state == self.State.ADDING and status == "success":
-            self.state = self.State.ADDED
-        elif self.state == self.State.ADDING and status == "fail":
-            self.state = self.State.FAILED
-        else:
-            raise self.InvalidTransition(
-                f"Apply add result {status} to {self.state}", id=self.pk
-            )
+        self._apply_result("add", result)
 
     def apply_remove_result(self, result):
         """Modify the state with a remove result"""
 
+        self._apply_result("remove", result)
+
+    def _apply_result(self, name: str, result: Dict):
         status = result["status"]
-        if self.state == self.State.REMOVING and status == "success":
-            self.state = self.State.REMOVED
-        elif self.state == self.State.REMOVING and status == "fail":
-            self.state = self.State.ADDED
-        else:
+        state = transitions.next_state(
+            self.RESULT_TRANSITIONS, name, status, self.state
+        )
+        if state is None:
             raise self.InvalidTransition(
-                f"Apply remove result {status} to {self.state}", id=self.pk
+                f"Apply {name} result {status} to {self.state} of {self.pk}"
             )
+        self.state = state
 
     def __str__(self):
         if self.site_entity.name:
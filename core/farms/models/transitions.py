@@ -0,0 +1,104 @@
+"""State transitions of tasks and peripherals by the results of controllers.
+
+The transitions of a model map the lists of a result message and the status of each
+result to the states it changes, e.g. {"start": {"success": {"starting": "running"}}}.
+The results of a message are applied with one conditional UPDATE, joining the expected
+and the new states of the results as VALUES, which only changes the rows that are still
+in an expected state. Results of objects that do not exist or are not in an expected
+state are returned as invalid transitions without aborting the others. Since the UPDATE
+locks its rows and checks their states again after waiting for concurrent transactions,
+the rows do not have to be selected for update before."""
+import uuid
+from typing import Dict, List, Optional, Tuple, Type
+
+from django.db import connections, models, router
+
+# The new state of each expected state by the status of each result list
+Transitions = Dict[str, Dict[str, Dict[str, str]]]
+
+
+def next_state(
+    transitions: Transitions, name: str, status: str, state: str
+) -> Optional[str]:
+    """The state after a result of the list, None if the transition is invalid"""
+
+    return transitions.get(name, {}).get(status, {}).get(state)
+
+
+def apply_results(
+    model: Type[models.Model], transitions: Transitions, results: Dict
+) -> Tuple[List[models.Model], Dict[str, str]]:
+    """Apply the result lists of a result message in order. Returns the changed objects
+    and the errors of the invalid transitions by object ID. Raises ValueError if a
+    result has no valid UUID or status."""
+
+    items = []
+    for name in transitions:
+        for result in results.get(name, []):
+            try:
+                items.append((name, str(uuid.UUID(result["uuid"])), result["status"]))
+            except KeyError as err:
+                raise ValueError(f"Missing key {err}") from err
+            except (AttributeError, TypeError, ValueError) as err:
+                value = result.get("uuid") if isinstance(result, dict) else result
+                raise ValueError(f"Invalid uuid {value}") from err
+
+    # Several results of an object are applied in successive statements
+    rounds: List[List[Tuple[str, str, str]]] = []
+    applied: Dict[str, int] = {}
+    for item in items:
+        index = applied.get(item[1], 0)
+        applied[item[1]] = index + 1
+        if index == len(rounds):
+            rounds.append([])
+        rounds[index].append(item)
+
+    changed: Dict[str, models.Model] = {}
+    errors: Dict[str, str] = {}
+    for round_items in rounds:
+        updated = {
+            str(instance.pk): instance
+            for instance in _update_states(
+                model,
+                [
+                    (pk, state, new_state)
+                    for name, pk, status in round_items
+                    for state, new_state in transitions[name].get(status, {}).items()
+                ],
+            )
+        }
+        for name, pk, status in round_items:
+            if pk in updated:
+                changed[pk] = updated[pk]
+                errors.pop(pk, None)
+            else:
+                errors[pk] = f"Invalid transition by {name} result {status}"
+    return list(changed.values()), errors
+
+
+def _update_states(
+    model: Type[models.Model], transitions: List[Tuple[str, str, str]]
+) -> List[models.Model]:
+    """Change the state of the rows by (primary key, expected state, new state) and
+    return the changed rows"""
+
+    if not transitions:
+        return []
+    database = connections[router.db_for_write(model)]
+    quote = database.ops.quote_name
+    pk_column = quote(model._meta.pk.column)
+    state_column = quote(model._meta.get_field("state").column)
+    pk_type = model._meta.pk.db_type(database)
+    values = ", ".join([f"(CAST(%s AS {pk_type}), %s, %s)"] * len(transitions))
+    return list(
+        model._default_manager.raw(
+            f"""
+            UPDATE {quote(model._meta.db_table)} AS t SET {state_column} = v.new_state
+            FROM (VALUES {values}) AS v (pk, state, new_state)
+            WHERE t.{pk_column} = v.pk AND t.{state_column} = v.state
+            RETURNING t.*
+            """,
+            [param for transition in transitions for param in transition],
+            using=database.alias,
+        )
+    )
@@ -0,0 +1,146 @@
+"""Tracking of the commands sent to controllers until they are acknowledged.
+
+Commands to start or stop tasks and to add or remove peripherals are tracked by the
+command scheduler worker, started with `./manage.py run_command_scheduler`. It
+keeps the outstanding commands of each request ID with their deadlines in a heap, so it
+only wakes up for the next deadline instead of scanning the tables. The results of the
+controllers acknowledge the commands of their tasks and peripherals.
+
+When a deadline passes, the commands of the tasks and peripherals that are still in
+their transitional states are sent again to the current channel of their controllers,
+with a deadline backing off by CONTROLLER_COMMAND_BACKOFF. After
+CONTROLLER_COMMAND_ATTEMPTS attempts, they are moved to the failed state."""
+import heapq
+import itertools
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "controller-commands"
+
+# The kinds of commands and the names of the lists of their commands and results
+TASK = "task"
+PERIPHERAL = "peripheral"
+COMMAND_LISTS = {TASK: ("start", "stop"), PERIPHERAL: ("add", "remove")}
+
+
+def command_ids(kind: str, commands: Dict) -> List[str]:
+    """The IDs of the tasks or peripherals of the commands or results"""
+
+    return [
+        str(command["uuid"])
+        for name in COMMAND_LISTS[kind]
+        for command in commands.get(name, [])
+        if "uuid" in command
+    ]
+
+
+def track(kind: str, commands: Dict, request_id: str):
+    """Track the commands sent to a controller with the request ID"""
+
+    ids = command_ids(kind, commands)
+    if ids:
+        _send(
+            {
+                "type": "commands.sent",
+                "kind": kind,
+                "ids": ids,
+                "request_id": request_id,
+            }
+        )
+
+
+def acknowledge(kind: str, results: Dict):
+    """Acknowledge the commands of the tasks or peripherals of the results"""
+
+    ids = command_ids(kind, results)
+    if ids:
+        _send({"type": "commands.acknowledged", "kind": kind, "ids": ids})
+
+
+def wake_up():
+    """Make the worker track the commands left outstanding before it started"""
+
+    _send({"type": "worker.started"})
+
+
+def _send(message: Dict):
+    try:
+        async_to_sync(get_channel_layer().send)(CHANNEL, message)
+    except ChannelFull:
+        logger.warning("The command scheduler does not keep up, is it running?")
+
+
+class Command:
+    """Outstanding commands of tasks or peripherals sent with a request ID"""
+
+    def __init__(self, kind: str, ids: Iterable[str], request_id: str, attempt: int):
+        self.kind = kind
+        self.ids: Set[str] = set(ids)
+        self.request_id = request_id
+        self.attempt = attempt
+
+
+class CommandScheduler:
+    """The outstanding commands with their deadlines in a heap. Acknowledged commands
+    are removed from the heap once their deadline is reached."""
+
+    def __init__(self, timeout: float, backoff: float, attempts: int):
+        self.timeout = timeout
+        self.backoff = backoff
+        self.attempts = attempts
+        self._heap: List[Tuple[float, int, Command]] = []
+        self._counter = itertools.count()
+        # The outstanding command of each task or peripheral
+        self._commands: Dict[Tuple[str, str], Command] = {}
+
+    def __len__(self):
+        return len(self._commands)
+
+    def add(
+        self, kind: str, ids: Iterable[str], request_id: str, now: float, attempt=1
+    ) -> Command:
+        """Add commands sent at the time, replacing previous commands of the same tasks
+        or peripherals"""
+
+        command = Command(kind, ids, request_id, attempt)
+        for pk in command.ids:
+            previous = self._commands.get((kind, pk))
+            if previous is not None:
+                previous.ids.discard(pk)
+            self._commands[(kind, pk)] = command
+        deadline = now + self.timeout * self.backoff ** (attempt - 1)
+        heapq.heappush(self._heap, (deadline, next(self._counter), command))
+        return command
+
+    def acknowledge(self, kind: str, ids: Iterable[str]):
+        for pk in ids:
+            command = self._commands.pop((kind, pk), None)
+            if command is not None:
+                command.ids.discard(pk)
+
+    def next_deadline(self) -> Optional[float]:
+        """The earliest deadline of an outstanding command"""
+
+        while self._heap and not self._heap[0][2].ids:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: float) -> List[Command]:
+        """Remove and return the outstanding commands whose deadline passed"""
+
+        expired = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            command = heapq.heappop(self._heap)[2]
+            for pk in command.ids:
+                del self._commands[(command.kind, pk)]
+            expired.append(command)
+        return expired
+
+    def is_last_attempt(self, command: Command) -> bool:
+        return command.attempt >= self.attempts
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.graphql import reference
+from farms.models import ControllerComponentType, DataPointType
+
+
+@receiver(post_save, sender=DataPointType)
+@receiver(post_delete, sender=DataPointType)
+@receiver(post_save, sender=ControllerComponentType)
+@receiver(post_delete, sender=ControllerComponentType)
+def bump_reference_version(sender, **kwargs):
+    """Invalidate the cached GraphQL responses with reference data when it changes"""
+
+    reference.bump_version()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from farms import archive
+from farms.cache import CACHE_ALIAS
+from farms.export import data_point_rows
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    Site,
+    SiteEntity,
+)
+
+
+@unittest.skipIf(archive.pyarrow is None, "The archive requires pyarrow")
+class DataPointArchiveTestCase(TestCase):
+    """Test moving old data points to the archive and reading them back"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(DATA_POINT_ARCHIVE_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        caches[CACHE_ALIAS].clear()
+
+        site = Site.objects.create(
+            name="Site A",
+            owner=get_user_model().objects.create_user(
+                email="owner@bar.com", password="foo"
+            ),
+        )
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+            ),
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        # One data point every 10 days from December to February
+        self.start = datetime(2020, 12, 1, tzinfo=timezone.utc)
+        for day in range(0, 90, 10):
+            DataPoint.objects.create(
+                time=self.start + timedelta(days=day),
+                value=day,
+                peripheral_component=self.bme280,
+                data_point_type=self.air_temperature,
+            )
+        self.end = self.start + timedelta(days=90)
+
+    def test_archive(self):
+        """Test that the months before the horizon are moved to the archive"""
+
+        archived = DataPoint.objects.archive(datetime(2021, 2, 15, tzinfo=timezone.utc))
+        self.assertEqual(archived, 7)
+        self.assertEqual(
+            archive.get_watermark(), datetime(2021, 2, 1, tzinfo=timezone.utc)
+        )
+        self.assertEqual(DataPoint.objects.count(), 2)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ["2020-12", "2021-01", "WATERMARK"]
+        )
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, "2021-01")), [str(self.bme280.pk)]
+        )
+        # Archiving again finds nothing to move
+        self.assertEqual(
+            DataPoint.objects.archive(datetime(2021, 2, 15, tzinfo=timezone.utc)), 0
+        )
+
+    def test_merged_reads(self):
+        """Test that reads return the same data points before and after archiving"""
+
+        def read():
+            series = DataPoint.objects.series(
+                self.bme280.pk, self.air_temperature.pk, self.start, self.end
+            )
+            buckets = DataPoint.objects.aggregate_buckets(
+                series=[(self.bme280.pk, self.air_temperature.pk)],
+                start=self.start + timedelta(days=5),
+                end=self.end,
+                bucket_width=timedelta(days=30),
+                aggregates=["avg", "count", "first", "percentile"],
+                percentile=0.5,
+            )[0]
+            rows = list(data_point_rows(peripheral_ids=[self.bme280.pk]))
+            return series, buckets, rows
+
+        before = read()
+        caches[CACHE_ALIAS].clear()
+        DataPoint.objects.archive(datetime(2021, 2, 15, tzinfo=timezone.utc))
+        after = read()
+        self.assertEqual(after, before)
+        self.assertEqual(after[0]["value"], list(range(0, 90, 10)))
+        self.assertEqual([row[-1] for row in after[2]], list(range(0, 90, 10)))
+        self.assertEqual(after[2][0][5:7], ("Air Temp", "°C"))
+
+    @override_settings(DATA_POINT_ARCHIVE_DIR="")
+    def test_archive_unavailable(self):
+        with self.assertRaises(ValueError):
+            DataPoint.objects.archive(datetime(2021, 2, 15, tzinfo=timezone.utc))
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+
+from farms.cache import BlockCache
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    Site,
+    SiteEntity,
+)
+
+
+class DataPointCacheTestCase(TransactionTestCase):
+    """Test caching data point queries of closed time ranges. The data points are
+    committed, since the cache is invalidated after the commit."""
+
+    def setUp(self):
+        site = Site.objects.create(
+            name="Site A",
+            owner=get_user_model().objects.create_user(
+                email="owner@bar.com", password="foo"
+            ),
+        )
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+            ),
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        self.start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for minute in range(0, 120, 10):
+            DataPoint.objects.create(
+                time=self.start + timedelta(minutes=minute),
+                value=minute,
+                peripheral_component=self.bme280,
+                data_point_type=self.air_temperature,
+            )
+
+    def aggregate(self, start, end):
+        return DataPoint.objects.aggregate_buckets(
+            series=[(self.bme280.pk, self.air_temperature.pk)],
+            start=start,
+            end=end,
+            bucket_width=timedelta(minutes=30),
+            aggregates=["avg", "count"],
+        )[0]
+
+    def test_aggregate_buckets_cached(self):
+        """Test that closed blocks are read from the cache until a late data point"""
+
+        end = self.start + timedelta(hours=2)
+        with self.assertNumQueries(1):
+            result = self.aggregate(self.start, end)
+        self.assertEqual(result["values"]["count"], [3, 3, 3, 3])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.aggregate(self.start, end), result)
+
+        # The partial buckets at the borders are read from the database
+        with self.assertNumQueries(1):
+            result = self.aggregate(
+                self.start + timedelta(minutes=5), end - timedelta(minutes=5)
+            )
+        self.assertEqual(result["values"]["count"], [2, 3, 3, 3])
+        self.assertEqual(result["values"]["avg"], [15, 40, 70, 100])
+
+        # A late data point invalidates the series
+        DataPoint.objects.from_telemetry(
+            {
+                "time": (self.start + timedelta(minutes=45)).isoformat(),
+                "peripheral": str(self.bme280.pk),
+                "data_points": [
+                    {"value": 100, "data_point_type": str(self.air_temperature.pk)}
+                ],
+            }
+        )
+        with self.assertNumQueries(1):
+            result = self.aggregate(self.start, end)
+        self.assertEqual(result["values"]["count"], [3, 4, 3, 3])
+
+    def test_series_cached(self):
+        """Test that the open right edge of a series is always read"""
+
+        now = datetime.now(timezone.utc)
+        DataPoint.objects.create(
+            time=now - timedelta(seconds=1),
+            value=42,
+            peripheral_component=self.bme280,
+            data_point_type=self.air_temperature,
+        )
+        start = now - timedelta(days=1)
+        arguments = (self.bme280.pk, self.air_temperature.pk, start, now)
+        for hours in (2, 12):
+            DataPoint.objects.create(
+                time=now - timedelta(hours=hours),
+                value=hours,
+                peripheral_component=self.bme280,
+                data_point_type=self.air_temperature,
+            )
+        series = DataPoint.objects.series(*arguments)
+        self.assertEqual(series["value"], [12, 2, 42])
+        DataPoint.objects.create(
+            time=now - timedelta(milliseconds=1),
+            value=43,
+            peripheral_component=self.bme280,
+            data_point_type=self.air_temperature,
+        )
+        with self.assertNumQueries(1):
+            series = DataPoint.objects.series(*arguments)
+        self.assertEqual(series["value"], [12, 2, 42, 43])
+
+    def test_block_cache_fetch_ranges(self):
+        """Test the ranges read for a range between block borders"""
+
+        fetched = []
+
+        def fetch(ranges):
+            fetched.extend(ranges)
+            return [[] for _ in ranges]
+
+        key = ("peripheral", "type")
+        block_cache = BlockCache(
+            "test", block_width=timedelta(hours=1), step=timedelta(minutes=30)
+        )
+        now = self.start + timedelta(hours=3, minutes=50)
+        block_cache.get([key], self.start + timedelta(minutes=10), now, fetch, now=now)
+        self.assertEqual(
+            fetched,
+            [
+                # Partial bucket at the start
+                (
+                    key,
+                    self.start + timedelta(minutes=10),
+                    self.start + timedelta(minutes=30),
+                ),
+                # Open right edge
+                (key, self.start + timedelta(hours=3), now),
+                # Closed blocks
+                (key, self.start, self.start + timedelta(hours=3)),
+            ],
+        )
+        fetched.clear()
+        block_cache.get([key], self.start + timedelta(minutes=10), now, fetch, now=now)
+        self.assertEqual(len(fetched), 2)
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    ControllerMessage,
+    Site,
+    SiteEntity,
+)
+
+
+class ControllerMessageTestCase(TestCase):
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        site = Site.objects.create(name="Site A", owner=self.owner)
+        self.controller = ControllerComponent.objects.create(
+            component_type=ControllerComponentType.objects.create(name="ESP32"),
+            site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+        )
+        self.now = datetime.now(timezone.utc)
+        for days in range(5):
+            message = ControllerMessage.objects.create(
+                controller=self.controller,
+                message={"type": ControllerMessage.TELEMETRY_TYPE},
+                request_id=f"request-{days}",
+            )
+            ControllerMessage.objects.filter(pk=message.pk).update(
+                created_at=self.now - timedelta(days=days * 10)
+            )
+
+    def test_purge(self):
+        """Test deleting old messages in batches"""
+
+        deleted = ControllerMessage.objects.purge(
+            self.now - timedelta(days=15), batch_size=1
+        )
+        self.assertEqual(deleted, 3)
+        self.assertQuerysetEqual(
+            ControllerMessage.objects.order_by("request_id").values_list(
+                "request_id", flat=True
+            ),
+            ["request-0", "request-1"],
+            transform=str,
+        )
+
+        output = StringIO()
+        call_command("purge_controller_messages", days=5, stdout=output)
+        self.assertIn("Deleted 1 messages", output.getvalue())
+        self.assertEqual(ControllerMessage.objects.count(), 1)
+
+    def test_admin_changelist(self):
+        self.owner.is_staff = self.owner.is_superuser = True
+        self.owner.save()
+        self.client.force_login(self.owner)
+        response = self.client.get(
+            reverse("admin:farms_controllermessage_changelist"), {"q": "request-3"}
+        )
+        self.assertContains(response, "request-3")
+        self.assertNotContains(response, "request-2")
@@ -1,4 +1,6 @@
 import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
 from django.test import TestCase
 from django.contrib.auth import get_user_model
@@ -10,6 +12,7 @@ from farms.models import (
     SiteEntity,
     Site,
 )
+from farms.models.controller_task import ControllerTaskManager
 
 
 class ControllerTaskTests(TestCase):
@@ -213,7 +216,7 @@ class ControllerTaskTests(TestCase):
             state=ControllerTask.State.RUNNING,
         )
 
-        self.assertFalse(ControllerTask.objects.from_results({"foo": "bar"}))
+        self.assertEqual(ControllerTask.objects.from_results({"foo": "bar"}), ([], {}))
         with self.assertRaisesMessage(ValueError, "uuid"):
             ControllerTask.objects.from_results({"start": [{"foo": "bar"}]})
 
@@ -228,7 +231,8 @@ class ControllerTaskTests(TestCase):
                 {"uuid": str(starting_task_c.pk), "status": "success"},
             ],
         }
-        tasks = ControllerTask.objects.from_results(results)
+        tasks, errors = ControllerTask.objects.from_results(results)
+        self.assertFalse(errors)
         self.assertEqual(
             [task for task in tasks if task.pk == starting_task_a.pk][0].state,
             ControllerTask.State.RUNNING,
@@ -250,6 +254,56 @@ class ControllerTaskTests(TestCase):
             ControllerTask.State.STOPPED,
         )
 
+    def test_from_results_invalid_transitions(self):
+        """Test that results are applied with one statement in order and that invalid
+        transitions do not abort the others"""
+
+        tasks = [
+            ControllerTask.objects.create(
+                task_type=ControllerTask.TaskType.POLL_SENSOR,
+                controller_component=self.controller_a,
+                state=state,
+            )
+            for state in [
+                ControllerTask.State.STARTING,
+                ControllerTask.State.STOPPED,
+                ControllerTask.State.STARTING,
+            ]
+        ]
+        results = {
+            "start": [
+                {"uuid": str(tasks[0].pk), "status": "success"},
+                {"uuid": str(tasks[1].pk), "status": "success"},
+                {"uuid": str(uuid.uuid4()), "status": "success"},
+                {"uuid": str(tasks[2].pk), "status": "success"},
+            ],
+            "stop": [{"uuid": str(tasks[2].pk), "status": "success"}],
+        }
+        with self.assertNumQueries(4):
+            # The savepoint and an UPDATE each for the start and the stop result of the
+            # third task
+            updated, errors = ControllerTask.objects.from_results(results)
+        self.assertCountEqual([task.pk for task in updated], [tasks[0].pk, tasks[2].pk])
+        self.assertCountEqual(errors, [str(tasks[1].pk), results["start"][2]["uuid"]])
+        self.assertEqual(
+            errors[str(tasks[1].pk)], "Invalid transition by start result success"
+        )
+        self.assertEqual(
+            [ControllerTask.objects.get(pk=task.pk).state for task in tasks],
+            [
+                ControllerTask.State.RUNNING,
+                ControllerTask.State.STOPPED,
+                ControllerTask.State.STOPPED,
+            ],
+        )
+
+        with self.assertRaisesMessage(ValueError, "Invalid uuid"):
+            ControllerTask.objects.from_results(
+                {"start": [{"uuid": "foo", "status": "success"}]}
+            )
+        with self.assertRaisesMessage(ValueError, "Invalid uuid foo"):
+            ControllerTask.objects.from_results({"start": ["foo"]})
+
     def test_from_results_errors(self):
         """Test the error handling of handling task results"""
 
@@ -330,6 +384,100 @@ class ControllerTaskTests(TestCase):
         self.assertNotIn(str(stopped_task.pk), start_uuids)
         self.assertNotIn(str(failed_task.pk), start_uuids)
 
+    @mock.patch.object(ControllerTaskManager, "_send_commands_to_controller")
+    def test_retry_commands(self, send_commands):
+        """Test that commands of starting and stopping tasks are sent again to connected
+        controllers and failed on the last attempt"""
+
+        tasks = [
+            ControllerTask.objects.create(
+                task_type=ControllerTask.TaskType.POLL_SENSOR,
+                controller_component=self.controller_a,
+                state=state,
+            )
+            for state in [
+                ControllerTask.State.STARTING,
+                ControllerTask.State.STOPPING,
+                ControllerTask.State.RUNNING,
+            ]
+        ]
+        task_ids = [str(task.pk) for task in tasks]
+
+        # The controller is not connected
+        pending_ids = ControllerTask.objects.retry_commands(task_ids, "request", False)
+        self.assertCountEqual(pending_ids, task_ids[:2])
+        send_commands.assert_not_called()
+
+        self.controller_a.channel_name = "some_channel"
+        self.controller_a.save()
+        pending_ids = ControllerTask.objects.retry_commands(task_ids, "request", False)
+        self.assertCountEqual(pending_ids, task_ids[:2])
+        send_commands.assert_called_once()
+        commands = send_commands.call_args[0][1]
+        self.assertEqual(commands["start"][0]["uuid"], task_ids[0])
+        self.assertEqual(commands["stop"][0]["uuid"], task_ids[1])
+
+        self.assertEqual(
+            ControllerTask.objects.retry_commands(task_ids, "request", True), []
+        )
+        self.assertEqual(
+            [ControllerTask.objects.get(pk=pk).state for pk in task_ids],
+            [
+                ControllerTask.State.FAILED,
+                ControllerTask.State.FAILED,
+                ControllerTask.State.RUNNING,
+            ],
+        )
+
+    @mock.patch.object(ControllerTaskManager, "_send_commands_to_controller")
+    def test_stop_expired(self, send_commands):
+        """Test that running tasks past their run until time are stopped with a command
+        message per connected controller"""
+
+        now = datetime.now(tz=timezone.utc)
+        controller_b = ControllerComponent.objects.create(
+            component_type=self.controller_a.component_type,
+            site_entity=SiteEntity.objects.create(
+                name="ControllerB", site=self.controller_a.site_entity.site
+            ),
+            channel_name="some_channel",
+        )
+        tasks = [
+            ControllerTask.objects.create(
+                task_type=ControllerTask.TaskType.POLL_SENSOR,
+                controller_component=controller,
+                state=state,
+                run_until=now + timedelta(minutes=minutes),
+            )
+            for controller, state, minutes in [
+                (self.controller_a, ControllerTask.State.RUNNING, -1),
+                (controller_b, ControllerTask.State.RUNNING, -2),
+                (controller_b, ControllerTask.State.RUNNING, -1),
+                (controller_b, ControllerTask.State.RUNNING, 1),
+                (controller_b, ControllerTask.State.STARTING, -1),
+            ]
+        ]
+        self.assertEqual(ControllerTask.objects.next_run_until(), tasks[1].run_until)
+
+        self.assertEqual(len(ControllerTask.objects.stop_expired(now)), 3)
+        self.assertEqual(
+            [ControllerTask.objects.get(pk=task.pk).state for task in tasks],
+            [
+                ControllerTask.State.STOPPED,
+                ControllerTask.State.STOPPING,
+                ControllerTask.State.STOPPING,
+                ControllerTask.State.RUNNING,
+                ControllerTask.State.STARTING,
+            ],
+        )
+        send_commands.assert_called_once()
+        self.assertEqual(send_commands.call_args[0][0], "some_channel")
+        self.assertCountEqual(
+            send_commands.call_args[0][1]["stop"],
+            [{"uuid": str(task.pk)} for task in tasks[1:3]],
+        )
+        self.assertEqual(ControllerTask.objects.next_run_until(), tasks[3].run_until)
+
     def test_to_string(self):
         """Test the to string method"""
 
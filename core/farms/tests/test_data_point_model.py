@@ -1,10 +1,16 @@
+import shutil
+import tempfile
 import uuid
 from datetime import datetime, timezone, timedelta
+from unittest import mock
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.utils.dateparse import parse_datetime
 
+from farms import archive
 from farms.models import (
     ControllerComponent,
     ControllerComponentType,
@@ -14,6 +20,7 @@ from farms.models import (
     Site,
     SiteEntity,
 )
+from farms.models.data_point import DataPointManager
 
 
 class DataPointTests(TestCase):
@@ -215,3 +222,229 @@ class DataPointTests(TestCase):
 
         data_point_type = DataPointType(name="Some name", unit="Some unit")
         self.assertIn(data_point_type.name, str(data_point_type))
+
+    def test_aggregate_buckets(self):
+        """Test aggregating data points into time buckets"""
+
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for minute, value in enumerate([1, 2, 3, 4, 5, 6]):
+            DataPoint.objects.create(
+                time=start + timedelta(minutes=minute * 10),
+                value=value,
+                peripheral_component=self.bme280_a,
+                data_point_type=self.air_temperature,
+            )
+        # Another series in the same time range that must not be included
+        DataPoint.objects.create(
+            time=start,
+            value=100,
+            peripheral_component=self.bme280_a,
+            data_point_type=self.air_pressure,
+        )
+
+        results = DataPoint.objects.aggregate_buckets(
+            series=[(self.bme280_a.pk, self.air_temperature.pk)],
+            start=start,
+            end=start + timedelta(hours=1),
+            bucket_width=timedelta(minutes=30),
+            aggregates=["avg", "min", "max", "sum", "count", "first", "last"],
+        )
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result["peripheral_component_id"], str(self.bme280_a.pk))
+        self.assertEqual(result["data_point_type_id"], str(self.air_temperature.pk))
+        self.assertEqual(result["time"], [start, start + timedelta(minutes=30)])
+        self.assertEqual(result["values"]["avg"], [2, 5])
+        self.assertEqual(result["values"]["min"], [1, 4])
+        self.assertEqual(result["values"]["max"], [3, 6])
+        self.assertEqual(result["values"]["sum"], [6, 15])
+        self.assertEqual(result["values"]["count"], [3, 3])
+        self.assertEqual(result["values"]["first"], [1, 4])
+        self.assertEqual(result["values"]["last"], [3, 6])
+
+        results = DataPoint.objects.aggregate_buckets(
+            series=[(self.bme280_a.pk, self.air_temperature.pk)],
+            start=start,
+            end=start + timedelta(hours=1),
+            bucket_width=timedelta(hours=1),
+            aggregates=["percentile"],
+            percentile=0.5,
+        )
+        self.assertEqual(results[0]["values"]["percentile"], [3.5])
+
+    def test_aligned_matrix(self):
+        """Test aligning series on one time axis with the gap fillings"""
+
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for minute, value in [(0, 1), (30, 4)]:
+            DataPoint.objects.create(
+                time=start + timedelta(minutes=minute),
+                value=value,
+                peripheral_component=self.bme280_a,
+                data_point_type=self.air_temperature,
+            )
+        DataPoint.objects.create(
+            time=start + timedelta(minutes=10),
+            value=100,
+            peripheral_component=self.bme280_a,
+            data_point_type=self.air_pressure,
+        )
+        arguments = {
+            "series": [
+                (self.bme280_a.pk, self.air_temperature.pk),
+                (self.bme280_a.pk, self.air_pressure.pk),
+            ],
+            "start": start,
+            "end": start + timedelta(minutes=40),
+            "step": timedelta(minutes=10),
+        }
+
+        result = DataPoint.objects.aligned_matrix(**arguments)
+        self.assertEqual(
+            result["time"], [start + timedelta(minutes=m) for m in (0, 10, 20, 30)]
+        )
+        self.assertEqual(
+            result["series"][0]["data_point_type_id"], str(self.air_temperature.pk)
+        )
+        self.assertEqual(result["series"][0]["values"], [1, None, None, 4])
+        self.assertEqual(result["series"][1]["values"], [None, 100, None, None])
+
+        result = DataPoint.objects.aligned_matrix(**arguments, fill="locf")
+        self.assertEqual(result["series"][0]["values"], [1, 1, 1, 4])
+        self.assertEqual(result["series"][1]["values"], [None, 100, 100, 100])
+
+        result = DataPoint.objects.aligned_matrix(**arguments, fill="linear")
+        self.assertEqual(result["series"][0]["values"], [1, 2, 3, 4])
+        self.assertEqual(result["series"][1]["values"], [None, 100, None, None])
+
+        with self.assertRaisesRegex(ValueError, "Unknown fill"):
+            DataPoint.objects.aligned_matrix(**arguments, fill="zero")
+
+    def test_aggregate_buckets_errors(self):
+        """Test the validation of the aggregation arguments"""
+
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        series = [(self.bme280_a.pk, self.air_temperature.pk)]
+        arguments = {
+            "series": series,
+            "start": start,
+            "end": start + timedelta(hours=1),
+            "bucket_width": timedelta(minutes=30),
+            "aggregates": ["avg"],
+        }
+        aggregate = DataPoint.objects.aggregate_buckets
+        with self.assertRaisesMessage(ValueError, "series"):
+            aggregate(**{**arguments, "series": []})
+        with self.assertRaisesMessage(ValueError, "Invalid series"):
+            aggregate(**{**arguments, "series": [("foo", "bar")]})
+        with self.assertRaisesMessage(ValueError, "Unknown aggregate"):
+            aggregate(**{**arguments, "aggregates": ["median"]})
+        with self.assertRaisesMessage(ValueError, "before the end"):
+            aggregate(**{**arguments, "end": start})
+        with self.assertRaisesMessage(ValueError, "positive"):
+            aggregate(**{**arguments, "bucket_width": timedelta(0)})
+        with self.assertRaisesMessage(ValueError, "buckets requested"):
+            aggregate(**{**arguments, "bucket_width": timedelta(microseconds=1)})
+        with self.assertRaisesMessage(ValueError, "percentile"):
+            aggregate(**{**arguments, "aggregates": ["percentile"], "percentile": 2})
+
+    def test_series(self):
+        """Test reading a series as parallel lists"""
+
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for minute, data_point_type in enumerate(
+            [self.air_temperature, self.air_pressure] * 3
+        ):
+            DataPoint.objects.create(
+                time=start + timedelta(minutes=minute),
+                value=minute,
+                peripheral_component=self.bme280_a,
+                data_point_type=data_point_type,
+            )
+        series = DataPoint.objects.series(
+            self.bme280_a.pk, self.air_temperature.pk, start, start + timedelta(hours=1)
+        )
+        self.assertEqual(
+            series["time"], [start + timedelta(minutes=minute) for minute in (0, 2, 4)]
+        )
+        self.assertEqual(series["value"], [0, 2, 4])
+        series = DataPoint.objects.series(
+            self.bme280_a.pk, self.air_pressure.pk, start, start + timedelta(minutes=3)
+        )
+        self.assertEqual(series["value"], [1])
+
+        with self.assertRaisesMessage(ValueError, "before the end"):
+            DataPoint.objects.series(self.bme280_a.pk, self.air_pressure.pk, start, start)
+        with self.assertRaisesMessage(ValueError, "Invalid series"):
+            DataPoint.objects.series(
+                "foo", self.air_pressure.pk, start, start + timedelta(hours=1)
+            )
+
+
+class RollupTests(TransactionTestCase):
+    """Downsampling with the continuous aggregates, which cannot be refreshed in a
+    transaction"""
+
+    def setUp(self):
+        cache.clear()
+        site = Site.objects.create(
+            name="Site A",
+            owner=get_user_model().objects.create_user(
+                email="owner@bar.com", password="foo"
+            ),
+        )
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+            ),
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        self.series = [(self.bme280.pk, self.air_temperature.pk)]
+
+    def test_refreshed_rollups(self):
+        """Test that the rollups cover the whole history and that ranges before the
+        archive watermark are read from the data points and the archive"""
+
+        hour = datetime.now(tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+        starts = [hour - timedelta(days=10), hour - timedelta(days=1)]
+        for start in starts:
+            for minute in range(0, 240, 10):
+                DataPoint.objects.create(
+                    time=start + timedelta(minutes=minute),
+                    value=minute,
+                    peripheral_component=self.bme280,
+                    data_point_type=self.air_temperature,
+                )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CALL refresh_continuous_aggregate('farms_datapoint_1h', NULL, NULL);"
+            )
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for start, watermark, reads_rollup in [
+            (starts[0], None, True),
+            (starts[1], None, True),
+            (starts[0], hour - timedelta(days=5), False),
+        ]:
+            with mock.patch.object(
+                DataPointManager,
+                "_rollup_buckets",
+                side_effect=DataPoint.objects._rollup_buckets,
+            ) as rollup_buckets, mock.patch.object(
+                archive, "get_watermark", return_value=watermark
+            ), override_settings(DATA_POINT_ARCHIVE_DIR=directory):
+                result = DataPoint.objects.downsample(
+                    self.series,
+                    start,
+                    start + timedelta(hours=4),
+                    timedelta(0),
+                    2,
+                    "max",
+                )
+            self.assertEqual(rollup_buckets.called, reads_rollup)
+            self.assertEqual(result[0]["time"], [start, start + timedelta(hours=2)])
+            self.assertEqual(result[0]["values"]["max"], [110, 230])
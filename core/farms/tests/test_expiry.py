@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.worker import Worker
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from farms import expiry
+
+from farms.consumers import TaskExpiryConsumer
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    ControllerTask,
+    Site,
+    SiteEntity,
+)
+from farms.models.controller_task import ControllerTaskManager
+
+
+class TaskExpiryConsumerTest(TransactionTestCase):
+    def setUp(self):
+        controller = ControllerComponent.objects.create(
+            component_type=ControllerComponentType.objects.create(name="TypeA"),
+            site_entity=SiteEntity.objects.create(
+                name="ControllerA",
+                site=Site.objects.create(
+                    name="SiteA",
+                    owner=get_user_model().objects.create_user(
+                        email="owner@bar.com", password="foo"
+                    ),
+                ),
+            ),
+            channel_name="some_channel",
+        )
+        self.task = ControllerTask.objects.create(
+            controller_component=controller,
+            task_type=ControllerTask.TaskType.SET_VALUE,
+            state=ControllerTask.State.RUNNING,
+            run_until=datetime.now(tz=timezone.utc) + timedelta(seconds=0.2),
+        )
+
+    @mock.patch.object(ControllerTaskManager, "_send_commands_to_controller")
+    async def test_stop_at_run_until(self, send_commands):
+        """Test that the worker sleeps until the run until time and stops the task"""
+
+        consumer = TaskExpiryConsumer()
+        await consumer.tasks_changed({"type": "tasks.changed"})
+        await asyncio.sleep(0.1)
+        send_commands.assert_not_called()
+        await asyncio.sleep(0.4)
+        consumer.timer.cancel()
+
+        send_commands.assert_called_once()
+        self.assertEqual(
+            send_commands.call_args[0][1], {"stop": [{"uuid": str(self.task.pk)}]}
+        )
+        task = await database_sync_to_async(ControllerTask.objects.get)(
+            pk=self.task.pk
+        )
+        self.assertEqual(task.state, ControllerTask.State.STOPPING)
+
+    @mock.patch.object(Worker, "run")
+    @mock.patch.object(expiry, "wake_up")
+    def test_command(self, wake_up, run):
+        """Test that the worker is woken up when it starts"""
+
+        call_command("run_task_expiry")
+        wake_up.assert_called_once()
+        run.assert_called_once()
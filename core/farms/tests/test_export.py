@@ -0,0 +1,190 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipIf
+
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from core.handlers import get_asgi_application
+from farms.export import data_point_rows, export_data_points
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    Site,
+    SiteEntity,
+)
+
+try:
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+class DataPointExportTestCase(TestCase):
+    """Test exporting data points"""
+
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(self.owner)
+        self.site = Site.objects.create(name="Site A", owner=self.owner)
+        controller = ControllerComponent.objects.create(
+            component_type=ControllerComponentType.objects.create(name="ESP32"),
+            site_entity=SiteEntity.objects.create(name="ESP32 A", site=self.site),
+        )
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=self.site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=controller,
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        self.start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for minute in range(0, 50, 10):
+            DataPoint.objects.create(
+                time=self.start + timedelta(minutes=minute),
+                value=minute,
+                peripheral_component=self.bme280,
+                data_point_type=self.air_temperature,
+            )
+
+    def export(self, **params) -> bytes:
+        response = self.client.get(reverse("data-point-export"), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_export_csv(self):
+        """Test streaming a CSV export in multiple chunks"""
+
+        rows = data_point_rows(site_ids=[self.site.pk], start=self.start)
+        content = b"".join(export_data_points(rows, "csv", chunk_size=2))
+        lines = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0]["time"], self.start.isoformat())
+        self.assertEqual(lines[0]["peripheral_component"], str(self.bme280.pk))
+        self.assertEqual(lines[0]["peripheral_component_name"], "BME280 A")
+        self.assertEqual(lines[0]["unit"], "°C")
+        self.assertEqual([float(line["value"]) for line in lines], [0, 10, 20, 30, 40])
+
+        # Time range filter over the API
+        content = self.export(
+            peripheral=self.bme280.pk,
+            start=(self.start + timedelta(minutes=10)).isoformat(),
+            end=(self.start + timedelta(minutes=30)).isoformat(),
+        )
+        lines = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual([float(line["value"]) for line in lines], [10, 20])
+
+    def test_export_ndjson(self):
+        content = self.export(site=self.site.pk, file_format="ndjson")
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[-1]["value"], 40)
+        self.assertEqual(lines[-1]["data_point_type"], str(self.air_temperature.pk))
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_export_parquet(self):
+        rows = data_point_rows(peripheral_ids=[self.bme280.pk])
+        content = b"".join(export_data_points(rows, "parquet", chunk_size=2))
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(content))
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.column("value").to_pylist(), [0, 10, 20, 30, 40])
+        self.assertEqual(table.column("time").to_pylist()[0], self.start)
+        self.assertEqual(
+            pyarrow.parquet.ParquetFile(pyarrow.BufferReader(content)).num_row_groups, 3
+        )
+
+    def test_export_errors(self):
+        url = reverse("data-point-export")
+        response = self.client.get(url, {"file_format": "xlsx"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {"site": "not-a-uuid"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {"start": "2021-01-01T00:00:00"})
+        self.assertContains(response, "timezone", status_code=400)
+
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertIn(response.status_code, (401, 403))
+
+
+class DataPointExportASGITestCase(TransactionTestCase):
+    """Test exporting data points under ASGI, which reads the content of streaming
+    responses in a thread, see core.handlers"""
+
+    def setUp(self):
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(owner)
+        site = Site.objects.create(name="Site A", owner=owner)
+        peripheral = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+            ),
+        )
+        air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        for minute in range(3):
+            DataPoint.objects.create(
+                time=datetime(2021, 1, 1, 0, minute, tzinfo=timezone.utc),
+                value=minute,
+                peripheral_component=peripheral,
+                data_point_type=air_temperature,
+            )
+
+    @mock.patch(
+        "farms.views.export_data_points",
+        side_effect=lambda rows, file_format: export_data_points(
+            rows, file_format, chunk_size=1
+        ),
+    )
+    async def test_export_csv(self, _):
+        """Test that each chunk is sent as soon as it was read"""
+
+        communicator = ApplicationCommunicator(
+            get_asgi_application(),
+            {
+                "type": "http",
+                "method": "GET",
+                "path": reverse("data-point-export"),
+                "query_string": b"file_format=csv",
+                "headers": [
+                    (b"host", b"testserver"),
+                    (
+                        b"cookie",
+                        f"sessionid={self.client.cookies['sessionid'].value}".encode(),
+                    )
+                ],
+            },
+        )
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output()
+        self.assertEqual(start["status"], 200)
+        self.assertIn(
+            (b"Content-Disposition", b'attachment; filename="data_points.csv"'),
+            start["headers"],
+        )
+        content = b""
+        parts = 0
+        while True:
+            message = await communicator.receive_output()
+            content += message.get("body", b"")
+            parts += bool(message.get("body"))
+            if not message.get("more_body"):
+                break
+        # The response is closed after its content was sent
+        await communicator.wait()
+        self.assertEqual(parts, 3)
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([row[-1] for row in rows[1:]], ["0.0", "1.0", "2.0"])
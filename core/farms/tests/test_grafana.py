@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    ControllerMessage,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    PeripheralDataPointType,
+    Site,
+    SiteEntity,
+)
+
+
+class GrafanaDatasourceTestCase(TestCase):
+    """Test the Grafana JSON datasource API"""
+
+    def setUp(self):
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.client.force_login(owner)
+        self.site = Site.objects.create(name="Site A", owner=owner)
+        self.controller = ControllerComponent.objects.create(
+            component_type=ControllerComponentType.objects.create(name="ESP32"),
+            site_entity=SiteEntity.objects.create(name="ESP32 A", site=self.site),
+        )
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=self.site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=self.controller,
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        PeripheralDataPointType.objects.create(
+            peripheral=self.bme280, data_point_type=self.air_temperature
+        )
+        self.target = f"{self.bme280.pk}:{self.air_temperature.pk}"
+        self.start = datetime.now(tz=timezone.utc).replace(
+            minute=0, second=0, microsecond=0
+        ) - timedelta(days=1)
+        # One data point every 10 minutes for 4 hours
+        for minute in range(0, 240, 10):
+            DataPoint.objects.create(
+                time=self.start + timedelta(minutes=minute),
+                value=minute,
+                peripheral_component=self.bme280,
+                data_point_type=self.air_temperature,
+            )
+
+    def post(self, name, body):
+        return self.client.post(
+            reverse(f"grafana-{name}"), body, content_type="application/json"
+        )
+
+    def query(self, interval_ms, max_data_points, aggregate="avg"):
+        response = self.post(
+            "query",
+            {
+                "range": {
+                    "from": self.start.isoformat(),
+                    "to": (self.start + timedelta(hours=4)).isoformat(),
+                },
+                "intervalMs": interval_ms,
+                "maxDataPoints": max_data_points,
+                "targets": [
+                    {
+                        "refId": "A",
+                        "target": self.target,
+                        "data": {"aggregate": aggregate},
+                    }
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_connection(self):
+        self.assertEqual(self.client.get(reverse("grafana")).status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("grafana")).status_code, 401)
+
+    def test_search(self):
+        response = self.post("search", {"target": "temp"})
+        self.assertEqual(
+            response.json(),
+            [{"text": "Site A / BME280 A / Air Temp (°C)", "value": self.target}],
+        )
+        self.assertEqual(self.post("search", {"target": "ph"}).json(), [])
+
+    def test_query(self):
+        """Test that the bucket width follows the interval and maximum data points"""
+
+        output = self.query(interval_ms=30 * 60 * 1000, max_data_points=100)
+        self.assertEqual(output[0]["target"], "Site A / BME280 A / Air Temp (°C)")
+        datapoints = output[0]["datapoints"]
+        self.assertEqual(len(datapoints), 8)
+        self.assertEqual(datapoints[0], [10, int(self.start.timestamp() * 1000)])
+
+        # Two data points at most, read from the hourly rollup
+        output = self.query(interval_ms=1000, max_data_points=2, aggregate="max")
+        self.assertEqual([value for value, _ in output[0]["datapoints"]], [110, 230])
+
+        # Aggregates the rollups do not have are computed from the data points
+        output = self.query(interval_ms=0, max_data_points=4, aggregate="last")
+        self.assertEqual(
+            [value for value, _ in output[0]["datapoints"]], [50, 110, 170, 230]
+        )
+
+    def test_query_errors(self):
+        response = self.post("query", {"range": {"from": "yesterday"}})
+        self.assertEqual(response.status_code, 400)
+        response = self.post(
+            "query",
+            {
+                "range": {"from": self.start.isoformat(), "to": self.start.isoformat()},
+                "targets": [{"target": "invalid"}],
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_annotations(self):
+        message = ControllerMessage.objects.create(
+            controller=self.controller,
+            message={"type": ControllerMessage.ERROR_TYPE, "errors": "Sensor failed"},
+        )
+        ControllerMessage.objects.create(
+            controller=self.controller, message={"type": ControllerMessage.SYSTEM_TYPE}
+        )
+        response = self.post(
+            "annotations",
+            {
+                "range": {
+                    "from": (message.created_at - timedelta(hours=1)).isoformat(),
+                    "to": (message.created_at + timedelta(hours=1)).isoformat(),
+                },
+                "annotation": {"name": "Errors", "query": str(self.site.pk)},
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        annotations = response.json()
+        self.assertEqual(len(annotations), 1)
+        self.assertEqual(annotations[0]["text"], "Sensor failed")
+        self.assertEqual(
+            annotations[0]["time"], int(message.created_at.timestamp() * 1000)
+        )
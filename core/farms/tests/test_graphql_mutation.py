@@ -1,10 +1,11 @@
 import json
 from datetime import datetime, timezone, timedelta
 from functools import reduce
+from unittest import mock
 
 from graphene_django.utils.testing import GraphQLTestCase
 from django.contrib.auth import get_user_model
-from graphql_relay import to_global_id
+from graphql_relay import from_global_id, to_global_id
 
 from farms.graphql.nodes import (
     ControllerComponentNode,
@@ -21,6 +22,7 @@ from farms.models import (
     SiteEntity,
     Site,
 )
+from farms.models.controller_task import ControllerTaskManager
 
 
 class ControllerTaskTestCase(GraphQLTestCase):
@@ -172,6 +174,110 @@ class ControllerTaskTestCase(GraphQLTestCase):
         self.assertEqual(output["state"], ControllerTask.State.STOPPING.value)
         self.assertEqual(output["controllerComponent"]["id"], self.controller_a_gid)
 
+    @mock.patch.object(ControllerTaskManager, "_send_commands_to_controller")
+    def test_bulk_controller_tasks(self, send_commands):
+        """Test that tasks are started and stopped in bulk with one command message per
+        controller"""
+
+        controller_b = ControllerComponent.objects.create(
+            component_type=self.controller_a.component_type,
+            site_entity=SiteEntity.objects.create(
+                name="ControllerB", site=self.controller_a.site_entity.site
+            ),
+            channel_name="other_channel",
+        )
+        controller_b_gid = to_global_id(
+            ControllerComponentNode._meta.name, controller_b.pk
+        )
+        input_data = {
+            "tasks": [
+                {
+                    "controllerComponent": controller_gid,
+                    "taskType": ControllerTask.TaskType.SET_VALUE.value,
+                    "parameters": json.dumps({"value": value}),
+                }
+                for controller_gid, value in [
+                    (self.controller_a_gid, 1),
+                    (controller_b_gid, 2),
+                    (self.controller_a_gid, 3),
+                ]
+            ]
+        }
+        response = self.query(
+            """
+            mutation startControllerTasks($input: StartControllerTasksInput!) {
+                startControllerTasks(input: $input) {
+                    controllerTasks {
+                        id
+                        state
+                    }
+                }
+            }
+            """,
+            op_name="startControllerTasks",
+            input_data=input_data,
+        )
+        self.assertResponseNoErrors(response)
+        output = json.loads(response.content)["data"]["startControllerTasks"]
+        self.assertEqual(len(output["controllerTasks"]), 3)
+        self.assertEqual(ControllerTask.objects.count(), 3)
+        self.assertEqual(send_commands.call_count, 2)
+        commands = {args[0]: args[1] for args, _ in send_commands.call_args_list}
+        self.assertEqual(
+            [command["value"] for command in commands["some_channel"]["start"]], [1, 3]
+        )
+        self.assertEqual(len(commands["other_channel"]["start"]), 1)
+
+        send_commands.reset_mock()
+        task_ids = [task["id"] for task in output["controllerTasks"]]
+        stop_query = """
+            mutation stopControllerTasks($input: StopControllerTasksInput!) {
+                stopControllerTasks(input: $input) {
+                    controllerTasks {
+                        state
+                    }
+                }
+            }
+        """
+        # Repeated tasks are stopped once
+        response = self.query(
+            stop_query,
+            op_name="stopControllerTasks",
+            input_data={"taskIds": task_ids + task_ids[:1]},
+        )
+        self.assertResponseNoErrors(response)
+        output = json.loads(response.content)["data"]["stopControllerTasks"]
+        self.assertEqual(len(output["controllerTasks"]), 3)
+        self.assertEqual(send_commands.call_count, 2)
+        commands = {args[0]: args[1] for args, _ in send_commands.call_args_list}
+        self.assertEqual(len(commands["some_channel"]["stop"]), 2)
+        stopping = ControllerTask.objects.filter(state=ControllerTask.State.STOPPING)
+        self.assertEqual(stopping.count(), 3)
+
+        # Restarting tasks that are not stopped changes none of them
+        send_commands.reset_mock()
+        ControllerTask.objects.filter(pk=from_global_id(task_ids[0])[1]).update(
+            state=ControllerTask.State.STOPPED
+        )
+        response = self.query(
+            """
+            mutation restartControllerTasks($input: RestartControllerTasksInput!) {
+                restartControllerTasks(input: $input) {
+                    controllerTasks {
+                        state
+                    }
+                }
+            }
+            """,
+            op_name="restartControllerTasks",
+            input_data={"taskIds": task_ids},
+        )
+        self.assertResponseHasErrors(response)
+        send_commands.assert_not_called()
+        self.assertFalse(
+            ControllerTask.objects.filter(state=ControllerTask.State.STARTING).exists()
+        )
+
 
 class PeripheralControllerTestCase(GraphQLTestCase):
     def setUp(self):
@@ -1,10 +1,25 @@
 import json
+from datetime import datetime, timedelta, timezone
 from functools import reduce
 
 from graphene_django.utils.testing import GraphQLTestCase
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from graphql_relay import to_global_id
 
-from farms.models import ControllerTask, PeripheralComponent
+from farms.graphql.nodes import DataPointTypeNode, PeripheralComponentNode
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    ControllerTask,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    PeripheralDataPointType,
+    Site,
+    SiteEntity,
+)
 
 
 class QueryTestCase(GraphQLTestCase):
@@ -64,3 +79,409 @@ class QueryTestCase(GraphQLTestCase):
         for peripheral_type in output["peripheralTypes"]:
             self.assertIn(peripheral_type["value"], PeripheralComponent.PeripheralType)
 
+
+class DataPointQueryTestCase(GraphQLTestCase):
+    """Test GraphQL queries of data points"""
+
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self._client.force_login(self.owner)
+        site = Site.objects.create(name="Site A", owner=self.owner)
+        controller = ControllerComponent.objects.create(
+            component_type=ControllerComponentType.objects.create(name="ESP32"),
+            site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+        )
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=controller,
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        self.start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for minute in range(0, 120, 10):
+            DataPoint.objects.create(
+                time=self.start + timedelta(minutes=minute),
+                value=minute,
+                peripheral_component=self.bme280,
+                data_point_type=self.air_temperature,
+            )
+        self.series = {
+            "peripheralComponent": to_global_id(
+                PeripheralComponentNode._meta.name, self.bme280.pk
+            ),
+            "dataPointType": to_global_id(
+                DataPointTypeNode._meta.name, self.air_temperature.pk
+            ),
+        }
+
+    def test_aggregated_data_points(self):
+        """Test querying hourly aggregates of a series"""
+
+        response = self.query(
+            """
+            query aggregatedDataPoints(
+                $series: [DataPointSeriesInput!]!, $start: DateTime!, $end: DateTime!
+            ) {
+                aggregatedDataPoints(
+                    series: $series,
+                    start: $start,
+                    end: $end,
+                    bucketWidth: 3600,
+                    aggregates: ["avg", "count"]
+                ) {
+                    peripheralComponent
+                    dataPointType
+                    time
+                    columns {
+                        aggregate
+                        values
+                    }
+                }
+            }
+            """,
+            op_name="aggregatedDataPoints",
+            variables={
+                "series": [self.series],
+                "start": self.start.isoformat(),
+                "end": (self.start + timedelta(hours=2)).isoformat(),
+            },
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        output = reduce(dict.get, ["data", "aggregatedDataPoints"], content)
+        self.assertEqual(len(output), 1)
+        self.assertEqual(
+            output[0]["peripheralComponent"], self.series["peripheralComponent"]
+        )
+        self.assertEqual(output[0]["dataPointType"], self.series["dataPointType"])
+        self.assertEqual(
+            output[0]["time"],
+            [self.start.isoformat(), (self.start + timedelta(hours=1)).isoformat()],
+        )
+        columns = {
+            column["aggregate"]: column["values"] for column in output[0]["columns"]
+        }
+        self.assertEqual(columns["avg"], [25, 85])
+        self.assertEqual(columns["count"], [6, 6])
+
+    def test_aggregated_data_points_errors(self):
+        """Test that invalid aggregation arguments are reported"""
+
+        response = self.query(
+            """
+            query aggregatedDataPoints($series: [DataPointSeriesInput!]!) {
+                aggregatedDataPoints(
+                    series: $series,
+                    start: "2021-01-01T00:00:00+00:00",
+                    end: "2021-01-01T01:00:00+00:00",
+                    bucketWidth: 60,
+                    aggregates: ["mode"]
+                ) {
+                    time
+                }
+            }
+            """,
+            op_name="aggregatedDataPoints",
+            variables={"series": [self.series]},
+        )
+        self.assertResponseHasErrors(response)
+        self.assertIn("Unknown aggregate", response.content.decode())
+
+    def test_data_point_matrix(self):
+        """Test querying an aligned matrix of series with gap filling"""
+
+        response = self.query(
+            """
+            query dataPointMatrix(
+                $series: [DataPointSeriesInput!]!, $start: DateTime!, $end: DateTime!
+            ) {
+                dataPointMatrix(
+                    series: $series, start: $start, end: $end, step: 300, fill: "locf"
+                ) {
+                    time
+                    series {
+                        peripheralComponent
+                        dataPointType
+                        values
+                    }
+                }
+            }
+            """,
+            op_name="dataPointMatrix",
+            variables={
+                "series": [self.series],
+                "start": self.start.isoformat(),
+                "end": (self.start + timedelta(minutes=20)).isoformat(),
+            },
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        output = reduce(dict.get, ["data", "dataPointMatrix"], content)
+        self.assertEqual(len(output["time"]), 4)
+        self.assertEqual(
+            output["series"][0]["dataPointType"], self.series["dataPointType"]
+        )
+        self.assertEqual(output["series"][0]["values"], [0, 0, 10, 10])
+
+    def test_peripheral_component_series(self):
+        """Test querying a series of a peripheral component as parallel lists"""
+
+        response = self.query(
+            """
+            query peripheralComponent($id: ID!, $dataPointType: ID!) {
+                peripheralComponent(id: $id) {
+                    series(
+                        dataPointType: $dataPointType,
+                        start: "2021-01-01T00:10:00+00:00",
+                        end: "2021-01-01T00:40:00+00:00"
+                    ) {
+                        time
+                        value
+                    }
+                }
+            }
+            """,
+            op_name="peripheralComponent",
+            variables={
+                "id": self.series["peripheralComponent"],
+                "dataPointType": self.series["dataPointType"],
+            },
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        output = reduce(dict.get, ["data", "peripheralComponent", "series"], content)
+        self.assertEqual(
+            output["time"],
+            [
+                (self.start + timedelta(minutes=minute)).isoformat()
+                for minute in (10, 20, 30)
+            ],
+        )
+        self.assertEqual(output["value"], [10, 20, 30])
+
+    def test_peripheral_component_series_errors(self):
+        """Test that an invalid time range is reported"""
+
+        response = self.query(
+            """
+            query peripheralComponent($id: ID!, $dataPointType: ID!) {
+                peripheralComponent(id: $id) {
+                    series(
+                        dataPointType: $dataPointType,
+                        start: "2021-01-01T01:00:00+00:00",
+                        end: "2021-01-01T00:00:00+00:00"
+                    ) {
+                        time
+                    }
+                }
+            }
+            """,
+            op_name="peripheralComponent",
+            variables={
+                "id": self.series["peripheralComponent"],
+                "dataPointType": self.series["dataPointType"],
+            },
+        )
+        self.assertResponseHasErrors(response)
+        self.assertIn("start has to be before", response.content.decode())
+
+    def query_data_point_page(self, **arguments):
+        """Query a page of data points with the given pagination arguments"""
+
+        response = self.query(
+            """
+            query allDataPoints(
+                $first: Int, $after: String, $last: Int, $before: String
+            ) {
+                allDataPoints(
+                    first: $first, after: $after, last: $last, before: $before
+                ) {
+                    pageInfo {
+                        hasNextPage
+                        hasPreviousPage
+                        startCursor
+                        endCursor
+                    }
+                    edges {
+                        node {
+                            value
+                        }
+                    }
+                }
+            }
+            """,
+            op_name="allDataPoints",
+            variables=arguments,
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        output = reduce(dict.get, ["data", "allDataPoints"], content)
+        values = [edge["node"]["value"] for edge in output["edges"]]
+        return values, output["pageInfo"]
+
+    def test_data_point_keyset_pagination(self):
+        """Test paginating data points forwards and backwards with keyset cursors"""
+
+        # Data points are ordered from newest to oldest
+        values, page_info = self.query_data_point_page(first=5)
+        self.assertEqual(values, [110, 100, 90, 80, 70])
+        self.assertTrue(page_info["hasNextPage"])
+
+        values, page_info = self.query_data_point_page(
+            first=5, after=page_info["endCursor"]
+        )
+        self.assertEqual(values, [60, 50, 40, 30, 20])
+        self.assertTrue(page_info["hasNextPage"])
+        self.assertTrue(page_info["hasPreviousPage"])
+
+        last_page_info = page_info
+        values, page_info = self.query_data_point_page(
+            first=5, after=page_info["endCursor"]
+        )
+        self.assertEqual(values, [10, 0])
+        self.assertFalse(page_info["hasNextPage"])
+
+        values, page_info = self.query_data_point_page(
+            last=2, before=last_page_info["startCursor"]
+        )
+        self.assertEqual(values, [80, 70])
+        self.assertTrue(page_info["hasPreviousPage"])
+        self.assertTrue(page_info["hasNextPage"])
+
+    def test_data_point_invalid_cursor(self):
+        """Test that invalid cursors are rejected"""
+
+        response = self.query(
+            """
+            {
+                allDataPoints(first: 1, after: "bm90IGEgY3Vyc29y") {
+                    edges {
+                        cursor
+                    }
+                }
+            }
+            """
+        )
+        self.assertResponseHasErrors(response)
+        self.assertIn("Invalid cursor", response.content.decode())
+
+
+class PeripheralComponentQueryTestCase(GraphQLTestCase):
+    """Test that the relations of a page of nodes are loaded in batches"""
+
+    def setUp(self):
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self._client.force_login(owner)
+        site = Site.objects.create(name="Site A", owner=owner)
+        component_type = ControllerComponentType.objects.create(name="ESP32")
+        air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        for controller_index in range(10):
+            controller = ControllerComponent.objects.create(
+                component_type=component_type,
+                site_entity=SiteEntity.objects.create(
+                    name=f"ESP32 {controller_index}", site=site
+                ),
+            )
+            for peripheral_index in range(10):
+                peripheral = PeripheralComponent.objects.create(
+                    site_entity=SiteEntity.objects.create(
+                        name=f"BME280 {controller_index}.{peripheral_index}", site=site
+                    ),
+                    peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR,
+                    controller_component=controller,
+                    other_parameters={"i2c_address": 119},
+                )
+                PeripheralDataPointType.objects.create(
+                    peripheral=peripheral,
+                    data_point_type=air_temperature,
+                    parameter_prefix="temperature",
+                )
+
+    def test_all_peripheral_components_query_count(self):
+        """Test that a page of 100 peripherals resolves in a constant number of
+        queries"""
+
+        query = """
+            {
+                allPeripheralComponents(first: 100) {
+                    edges {
+                        node {
+                            parameters
+                            siteEntity {
+                                name
+                                site {
+                                    name
+                                }
+                            }
+                            controllerComponent {
+                                siteEntity {
+                                    name
+                                }
+                                componentType {
+                                    name
+                                }
+                            }
+                            dataPointTypeEdges {
+                                parameterPrefix
+                                dataPointType {
+                                    name
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        """
+        # The first request caches the row estimates of the query cost analysis
+        self.query(query)
+        # Session, user, count, the page joined with the relations and the edges
+        with self.assertNumQueries(5):
+            response = self.query(query)
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        edges = reduce(dict.get, ["data", "allPeripheralComponents", "edges"], content)
+        self.assertEqual(len(edges), 100)
+        node = edges[0]["node"]
+        self.assertEqual(node["siteEntity"]["site"]["name"], "Site A")
+        self.assertEqual(node["controllerComponent"]["componentType"]["name"], "ESP32")
+        self.assertEqual(
+            json.loads(node["parameters"]),
+            {
+                "temperature_data_point_type": str(DataPointType.objects.get().pk),
+                "i2c_address": 119,
+            },
+        )
+        self.assertEqual(
+            node["dataPointTypeEdges"][0]["dataPointType"]["name"], "Air Temp"
+        )
+
+    def test_selected_fields(self):
+        """Test that only the selected columns and relations are loaded"""
+
+        query = """
+            {
+                allSiteEntities(first: 10) {
+                    edges {
+                        node {
+                            name
+                            %s
+                        }
+                    }
+                }
+            }
+        """
+        with CaptureQueriesContext(connection) as context:
+            self.assertResponseNoErrors(self.query(query % ""))
+        page_sql = context.captured_queries[-1]["sql"]
+        self.assertNotIn("JOIN", page_sql)
+        self.assertNotIn("modified_at", page_sql)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertResponseNoErrors(self.query(query % "site { name }"))
+        page_sql = context.captured_queries[-1]["sql"]
+        self.assertIn('JOIN "farms_site"', page_sql)
+        self.assertNotIn("modified_at", page_sql)
@@ -0,0 +1,163 @@
+import gzip
+from datetime import datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from farms.line_protocol import parse_line, write
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    Site,
+    SiteEntity,
+)
+
+
+class LineProtocolTestCase(TestCase):
+    """Test writing data points in the InfluxDB line protocol"""
+
+    def setUp(self):
+        cache.clear()
+        owner = get_user_model().objects.create_user(
+            email="owner@bar.com", password="foo"
+        )
+        self.token = Token.objects.create(user=owner).key
+        site = Site.objects.create(name="Site A", owner=owner)
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=site),
+            ),
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        self.humidity = DataPointType.objects.create(name="Humidity", unit="%")
+
+    def test_parse_line(self):
+        self.assertEqual(
+            parse_line(b"bme280,peripheral=a air_temp=21.5,humidity=40i 1609459200"),
+            (
+                "bme280",
+                {"peripheral": "a"},
+                {"air_temp": 21.5, "humidity": 40},
+                1609459200,
+            ),
+        )
+        # Escaped characters and quoted strings with separators
+        self.assertEqual(
+            parse_line(rb'my\ sensor,peripheral=BME280\ A,note=a\,b on=t'),
+            ("my sensor", {"peripheral": "BME280 A", "note": "a,b"}, {"on": 1.0}, None),
+        )
+        with self.assertRaisesRegex(ValueError, "String fields"):
+            parse_line(b'bme280 status="a b, c=d",value=1')
+        for line in (b"bme280", b"bme280 value=", b"bme280 value=1 now", b"bme280 =1"):
+            with self.assertRaises(ValueError):
+                parse_line(line)
+
+    def test_write(self):
+        """Test that lines are written in batches, the valid lines despite errors"""
+
+        lines = [
+            f"{self.bme280.pk} air_temp=21.5,Humidity=40i 1609459200000",
+            "bme280,peripheral=BME280\\ A air_temp=22 1609459200000",
+            "# A comment",
+            "unknown air_temp=22 1609459200000",
+            f"{self.bme280.pk} air_temp=23,pressure=1000 1609459200000",
+            "",
+        ]
+        body = "\n".join(lines).encode()
+        chunks = [body[i : i + 7] for i in range(0, len(body), 7)]
+        written, errors = write(chunks, precision="ms")
+        self.assertEqual(written, 3)
+        self.assertEqual(len(errors), 2)
+        self.assertIn("line 4: Unknown or ambiguous peripheral", errors[0])
+        self.assertIn("line 5: Unknown data point type", errors[1])
+        data_points = DataPoint.objects.order_by("time")
+        self.assertEqual(
+            [data_point.value for data_point in data_points], [21.5, 40, 22]
+        )
+        # Equal times are smeared
+        self.assertEqual(
+            data_points[0].time, datetime(2021, 1, 1, tzinfo=timezone.utc)
+        )
+        self.assertEqual(data_points[2].time.microsecond, 2)
+
+        # Unknown peripheral components can be written to once they are created
+        PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(
+                name="unknown", site=self.bme280.site_entity.site
+            ),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=self.bme280.controller_component,
+        )
+        self.assertEqual(write([lines[3].encode()], precision="ms"), (1, []))
+        # And new data point types although the types are cached
+        DataPointType.objects.create(name="Pressure", unit="hPa")
+        self.assertEqual(write([lines[4].encode()], precision="ms"), (2, []))
+
+    def test_write_endpoint(self):
+        """Test the InfluxDB compatible endpoint with token and password auth"""
+
+        url = reverse("influx-write")
+        body = f"{self.bme280.pk} air_temp=21.5 1609459200".encode()
+        response = self.client.post(
+            f"{url}?precision=s",
+            body,
+            content_type="text/plain",
+            HTTP_AUTHORIZATION=f"Token {self.token}",
+        )
+        self.assertEqual(response.status_code, 204)
+        response = self.client.post(
+            f"{url}?precision=s&u=owner&p={self.token}",
+            gzip.compress(body.replace(b"21.5", b"23")),
+            content_type="text/plain",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            sorted(DataPoint.objects.values_list("value", flat=True)), [21.5, 23]
+        )
+
+        response = self.client.post(
+            f"{url}?precision=s&p={self.token}", b"bme280", content_type="text/plain"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Missing fields", response.json()["error"])
+        response = self.client.post(url, body, content_type="text/plain")
+        self.assertEqual(response.status_code, 401)
+
+    def test_deleted_peripheral(self):
+        """Test that lines of peripheral components deleted while cached are errors"""
+
+        self.assertEqual(write([b"BME280\\ A humidity=40i 1609459200"], "s"), (1, []))
+        other = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(
+                name="BME280 B", site=self.bme280.site_entity.site
+            ),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=self.bme280.controller_component,
+        )
+        bme280_id = self.bme280.pk
+        self.bme280.delete()
+        lines = [b"BME280\\ A humidity=41i 1\n", b"BME280\\ B humidity=42i 1"]
+        written, errors = write(lines, "s")
+        self.assertEqual(written, 1)
+        self.assertEqual(
+            errors, [f"line 1: Unknown or ambiguous peripheral component: {bme280_id}"]
+        )
+        self.assertEqual(
+            list(DataPoint.objects.values_list("peripheral_component", "value")),
+            [(other.pk, 42)],
+        )
+        # The deleted peripheral component is no longer cached
+        _, errors = write(lines, "s")
+        self.assertEqual(
+            errors, ["line 1: Unknown or ambiguous peripheral component: BME280 A"]
+        )
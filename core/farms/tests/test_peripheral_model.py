@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 
@@ -10,6 +12,7 @@ from farms.models import (
     SiteEntity,
     Site,
 )
+from farms.models.peripheral import PeripheralComponentManager
 
 
 class PeripheralModelAddRemoveTests(TestCase):
@@ -275,3 +278,37 @@ class PeripheralModelResultRegisterTests(TestCase):
         self.assertIn(str(self.peripheral_b.pk), add_uuids)
         self.assertNotIn(str(self.peripheral_c.pk), add_uuids)
         self.assertNotIn(str(self.peripheral_d.pk), add_uuids)
+
+    @mock.patch.object(PeripheralComponentManager, "_send_commands_to_controller")
+    def test_retry_commands(self, send_commands):
+        """Test that commands of adding and removing peripherals are sent again and
+        failed on the last attempt"""
+
+        self.esp32_a_controller.channel_name = "some_channel"
+        self.esp32_a_controller.save()
+        self.peripheral_b.state = PeripheralComponent.State.ADDED.value
+        self.peripheral_b.save()
+        peripheral_ids = [str(self.peripheral_a.pk), str(self.peripheral_b.pk)]
+        peripheral_ids.append(str(self.peripheral_c.pk))
+
+        pending_ids = PeripheralComponent.objects.retry_commands(
+            peripheral_ids, "request", fail=False
+        )
+        self.assertCountEqual(
+            pending_ids, [str(self.peripheral_a.pk), str(self.peripheral_c.pk)]
+        )
+        send_commands.assert_called_once()
+        channel_name, commands, request_id = send_commands.call_args[0]
+        self.assertEqual((channel_name, request_id), ("some_channel", "request"))
+        self.assertFalse(send_commands.call_args[1]["track"])
+        self.assertEqual(commands["add"][0]["uuid"], str(self.peripheral_a.pk))
+        self.assertEqual(commands["remove"][0]["uuid"], str(self.peripheral_c.pk))
+
+        self.assertEqual(
+            PeripheralComponent.objects.retry_commands(peripheral_ids, "request", True),
+            [],
+        )
+        self.peripheral_a.refresh_from_db()
+        self.assertEqual(self.peripheral_a.state, PeripheralComponent.State.FAILED)
+        self.peripheral_b.refresh_from_db()
+        self.assertEqual(self.peripheral_b.state, PeripheralComponent.State.ADDED)
@@ -0,0 +1,140 @@
+import asyncio
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.worker import Worker
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from farms import scheduler
+from farms.consumers import CommandSchedulerConsumer
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    ControllerTask,
+    Site,
+    SiteEntity,
+)
+from farms.models.controller_task import ControllerTaskManager
+
+
+class CommandSchedulerTest(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = scheduler.CommandScheduler(timeout=10, backoff=2, attempts=3)
+
+    def test_deadlines(self):
+        """Test that commands expire in the order of their deadlines with backoff"""
+
+        self.scheduler.add(scheduler.TASK, ["a"], "request_a", now=0, attempt=2)
+        self.scheduler.add(scheduler.PERIPHERAL, ["a", "b"], "request_b", now=5)
+        self.assertEqual(self.scheduler.next_deadline(), 15)
+        self.assertEqual(self.scheduler.pop_expired(14), [])
+
+        expired = self.scheduler.pop_expired(19)
+        self.assertEqual([command.request_id for command in expired], ["request_b"])
+        self.assertEqual(expired[0].ids, {"a", "b"})
+        self.assertFalse(self.scheduler.is_last_attempt(expired[0]))
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.next_deadline(), 20)
+
+    def test_acknowledge(self):
+        """Test that acknowledged and replaced commands do not expire"""
+
+        self.scheduler.add(scheduler.TASK, ["a", "b"], "request_a", now=0)
+        self.scheduler.add(scheduler.TASK, ["b"], "request_b", now=5, attempt=3)
+        self.scheduler.acknowledge(scheduler.TASK, ["a"])
+        self.assertEqual(self.scheduler.next_deadline(), 45)
+
+        expired = self.scheduler.pop_expired(45)
+        self.assertEqual([command.request_id for command in expired], ["request_b"])
+        self.assertTrue(self.scheduler.is_last_attempt(expired[0]))
+        self.assertIsNone(self.scheduler.next_deadline())
+
+    def test_command_ids(self):
+        commands = {"start": [{"uuid": "a", "type": "Foo"}], "stop": [{"uuid": "b"}]}
+        self.assertEqual(scheduler.command_ids(scheduler.TASK, commands), ["a", "b"])
+        self.assertEqual(scheduler.command_ids(scheduler.PERIPHERAL, commands), [])
+
+
+@override_settings(
+    CONTROLLER_COMMAND_TIMEOUT=0.05,
+    CONTROLLER_COMMAND_BACKOFF=2,
+    CONTROLLER_COMMAND_ATTEMPTS=2,
+)
+class CommandSchedulerConsumerTest(TransactionTestCase):
+    def setUp(self):
+        controller = ControllerComponent.objects.create(
+            component_type=ControllerComponentType.objects.create(name="TypeA"),
+            site_entity=SiteEntity.objects.create(
+                name="ControllerA",
+                site=Site.objects.create(
+                    name="SiteA",
+                    owner=get_user_model().objects.create_user(
+                        email="owner@bar.com", password="foo"
+                    ),
+                ),
+            ),
+            channel_name="some_channel",
+        )
+        self.tasks = [
+            ControllerTask.objects.create(
+                controller_component=controller,
+                task_type=ControllerTask.TaskType.SET_VALUE,
+                state=ControllerTask.State.STARTING,
+            )
+            for _ in range(2)
+        ]
+
+    @mock.patch.object(ControllerTaskManager, "_send_commands_to_controller")
+    async def test_retry_and_fail(self, send_commands):
+        """Test that commands without result are retried and then failed"""
+
+        consumer = CommandSchedulerConsumer()
+        task_ids = [str(task.pk) for task in self.tasks]
+        await consumer.commands_sent(
+            {"kind": scheduler.TASK, "ids": task_ids, "request_id": "request"}
+        )
+        await consumer.commands_acknowledged(
+            {"kind": scheduler.TASK, "ids": task_ids[1:]}
+        )
+        await asyncio.sleep(0.5)
+        consumer.timer.cancel()
+
+        send_commands.assert_called_once()
+        args = send_commands.call_args[0]
+        self.assertEqual(args[0], "some_channel")
+        self.assertEqual(
+            [command["uuid"] for command in args[1]["start"]], task_ids[:1]
+        )
+        self.assertEqual(args[2:], ("request", False))
+        states = await database_sync_to_async(
+            lambda: [ControllerTask.objects.get(pk=pk).state for pk in task_ids]
+        )()
+        self.assertEqual(
+            states, [ControllerTask.State.FAILED, ControllerTask.State.STARTING]
+        )
+
+    async def test_pending_at_start(self):
+        """Test that the commands left outstanding are tracked once the worker starts"""
+
+        consumer = CommandSchedulerConsumer()
+        await consumer.worker_started({"type": "worker.started"})
+        consumer.timer.cancel()
+        self.assertCountEqual(
+            [
+                pk
+                for command in consumer.scheduler.pop_expired(float("inf"))
+                for pk in command.ids
+            ],
+            [str(task.pk) for task in self.tasks],
+        )
+
+    @mock.patch.object(Worker, "run")
+    @mock.patch.object(scheduler, "wake_up")
+    def test_command(self, wake_up, run):
+        """Test that the worker is woken up when it starts"""
+
+        call_command("run_command_scheduler")
+        wake_up.assert_called_once()
+        run.assert_called_once()
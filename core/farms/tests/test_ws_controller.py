@@ -5,9 +5,11 @@ from django.contrib.auth import get_user_model
 from django.test import Client, TransactionTestCase, AsyncClient
 from django.urls import reverse
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 
 from core.routing import application
+from farms.consumers import CommandBatch
 from farms.models import (
     Site,
     SiteEntity,
@@ -181,8 +183,15 @@ class TestControllerMessage(TransactionTestCase):
         saved_message = await database_sync_to_async(ControllerMessage.objects.first)()
         self.assertDictEqual(data, saved_message.message)
 
+        # The controller stays connected until the second connection closes
         await first_communicator.disconnect()
+        controller = await database_sync_to_async(ControllerComponent.objects.get)(
+            pk=self.controller_entity.controller_component.pk
+        )
+        self.assertTrue(controller.channel_name)
         await second_communicator.disconnect()
+        await database_sync_to_async(controller.refresh_from_db)()
+        self.assertEqual(controller.channel_name, "")
 
     # async def test_rest_api_to_ws_connection(self):
     #     """Test that the messages are validated"""
@@ -379,4 +388,104 @@ class TestControllerMessage(TransactionTestCase):
         task_b = await database_sync_to_async(ControllerTask.objects.get)(pk=task_b.pk)
         self.assertEqual(task_b.state, ControllerTask.State.STOPPED)
 
+        # Repeated results are logged as invalid transitions
+        with self.assertLogs("farms.consumers", "WARNING") as logs:
+            await communicator.send_json_to(data)
+            self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn(str(peripheral_a.pk), logs.output[0])
+        self.assertIn(str(task_a.pk), logs.output[1])
+
         await communicator.disconnect()
+
+    async def test_register_message(self):
+        """Test that the commands of the register message are sent in one message"""
+
+        communicator = WebsocketCommunicator(
+            application,
+            self.ws_url,
+            subprotocols=[self.auth_token],
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        task = await database_sync_to_async(ControllerTask.objects.create)(
+            task_type=ControllerTask.TaskType.READ_SENSOR,
+            controller_component=self.controller_entity.controller_component,
+            state=ControllerTask.State.RUNNING,
+            parameters={},
+        )
+
+        await communicator.send_json_to(
+            {
+                "type": ControllerMessage.REGISTER_TYPE,
+                "request_id": "some_request",
+                "peripherals": [],
+                "tasks": [],
+            }
+        )
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], ControllerMessage.COMMAND_TYPE)
+        self.assertEqual(response["request_id"], "some_request")
+        self.assertEqual(response["task"]["start"][0]["uuid"], str(task.pk))
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.disconnect()
+
+    async def test_coalesced_commands(self):
+        """Test that commands sent in short succession are coalesced in order"""
+
+        communicator = WebsocketCommunicator(
+            application,
+            self.ws_url,
+            subprotocols=[self.auth_token],
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        controller = await database_sync_to_async(ControllerComponent.objects.get)(
+            pk=self.controller_entity.controller_component.pk
+        )
+
+        channel_layer = get_channel_layer()
+        for kind, commands in [
+            ("peripheral", {"add": [{"uuid": "a"}]}),
+            ("controller.task", {"start": [{"uuid": "b"}]}),
+            ("controller.task", {"start": [{"uuid": "c"}]}),
+            ("controller.task", {"stop": [{"uuid": "b"}]}),
+        ]:
+            await channel_layer.send(
+                controller.channel_name,
+                {
+                    "type": f"send.{kind}.commands",
+                    "commands": commands,
+                    "request_id": "some_request",
+                },
+            )
+        self.assertEqual(
+            await communicator.receive_json_from(),
+            {
+                "type": ControllerMessage.COMMAND_TYPE,
+                "peripheral": {"add": [{"uuid": "a"}]},
+                "task": {"start": [{"uuid": "b"}, {"uuid": "c"}]},
+                "request_id": "some_request",
+            },
+        )
+        self.assertEqual(
+            (await communicator.receive_json_from())["task"],
+            {"stop": [{"uuid": "b"}]},
+        )
+
+        await communicator.disconnect()
+
+    def test_command_batch(self):
+        """Test that commands are only coalesced if they keep their order"""
+
+        batch = CommandBatch("some_request")
+        self.assertTrue(batch.add("peripheral", {"add": [{"uuid": "a"}]}))
+        self.assertTrue(batch.add("task", {"start": [{"uuid": "b"}]}))
+        self.assertFalse(batch.add("peripheral", {"add": [{"uuid": "c"}]}))
+        self.assertFalse(batch.add("task", {"stop": [{"uuid": "c"}]}))
+        self.assertFalse(batch.add("task", {"start": [{"uuid": "b"}]}))
+        self.assertTrue(batch.add("task", {"start": [{"uuid": "c"}]}))
+        self.assertEqual(
+            batch.to_message()["task"], {"start": [{"uuid": "b"}, {"uuid": "c"}]}
+        )
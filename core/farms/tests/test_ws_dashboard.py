@@ -0,0 +1,165 @@
+from datetime import datetime, timezone
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from graphql_relay import to_global_id
+from rest_framework.authtoken.models import Token
+
+from core.routing import application
+from farms.consumers import DashboardConsumer
+from farms.models import (
+    ControllerComponent,
+    ControllerComponentType,
+    DataPoint,
+    DataPointType,
+    PeripheralComponent,
+    Site,
+    SiteEntity,
+)
+
+
+@override_settings(DASHBOARD_MAX_UPDATES_PER_SECOND=2)
+class TestDashboardConsumer(TransactionTestCase):
+    """Test streaming new data points to dashboards"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user("user_a@example.com", "passwd_a")
+        self.token = f"token_{Token.objects.create(user=user).key}"
+        self.site = Site.objects.create(name="Site A", owner=user)
+        self.bme280 = PeripheralComponent.objects.create(
+            site_entity=SiteEntity.objects.create(name="BME280 A", site=self.site),
+            peripheral_type=PeripheralComponent.PeripheralType.BME280_SENSOR.value,
+            controller_component=ControllerComponent.objects.create(
+                component_type=ControllerComponentType.objects.create(name="ESP32"),
+                site_entity=SiteEntity.objects.create(name="ESP32 A", site=self.site),
+            ),
+        )
+        self.air_temperature = DataPointType.objects.create(name="Air Temp", unit="°C")
+        self.air_pressure = DataPointType.objects.create(name="Air Pressure", unit="Pa")
+        self.ws_url = "ws-api/v1/farms/dashboards/"
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            application, self.ws_url, subprotocols=[self.token]
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, self.token)
+        return communicator
+
+    @database_sync_to_async
+    def ingest(self, value, data_point_type=None):
+        DataPoint.objects.from_telemetry(
+            {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "peripheral": str(self.bme280.pk),
+                "data_points": [
+                    {
+                        "value": value,
+                        "data_point_type": str(
+                            (data_point_type or self.air_temperature).pk
+                        ),
+                    }
+                ],
+            }
+        )
+
+    async def test_authentication(self):
+        """Test that only authenticated users can connect"""
+
+        for subprotocols in ([], ["token_invalid"]):
+            communicator = WebsocketCommunicator(
+                application, self.ws_url, subprotocols=subprotocols
+            )
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+            await communicator.disconnect()
+
+    async def test_series_subscription(self):
+        """Test that updates of a series are coalesced and other series filtered"""
+
+        communicator = await self.connect()
+        series = {
+            "peripheral_component": to_global_id(
+                "PeripheralComponentNode", self.bme280.pk
+            ),
+            "data_point_type": to_global_id(
+                "DataPointTypeNode", self.air_temperature.pk
+            ),
+        }
+        await communicator.send_json_to({"type": "subscribe", "series": [series]})
+        self.assertEqual(await communicator.receive_json_from(), {"type": "subscribed"})
+
+        # The first data point is sent right away, the next ones within the interval
+        # are sent together once it passed
+        await self.ingest(1)
+        update = await communicator.receive_json_from()
+        self.assertEqual(update["type"], "data_points")
+        self.assertEqual(update["peripheral_component"], series["peripheral_component"])
+        self.assertEqual(update["data_point_type"], series["data_point_type"])
+        self.assertEqual(update["value"], [1])
+        await self.ingest(2)
+        await self.ingest(100, self.air_pressure)
+        await self.ingest(3)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        update = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(update["value"], [2, 3])
+        self.assertEqual(len(update["time"]), 2)
+
+        await communicator.send_json_to({"type": "unsubscribe", "series": [series]})
+        await communicator.receive_json_from()
+        await self.ingest(4)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.7))
+        await communicator.disconnect()
+
+    @mock.patch.object(DashboardConsumer, "MAX_PENDING_POINTS", 2)
+    async def test_full_update(self):
+        """Test that the pending data points of a series are sent once there are
+        MAX_PENDING_POINTS, without waiting for the interval"""
+
+        communicator = await self.connect()
+        await communicator.send_json_to(
+            {"type": "subscribe", "sites": [to_global_id("SiteNode", self.site.pk)]}
+        )
+        await communicator.receive_json_from()
+        await self.ingest(1)
+        self.assertEqual((await communicator.receive_json_from())["value"], [1])
+        await self.ingest(2)
+        await self.ingest(3)
+        await self.ingest(4)
+        update = await communicator.receive_json_from(timeout=0.2)
+        self.assertEqual(update["value"], [2, 3])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        update = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(update["value"], [4])
+        await communicator.disconnect()
+
+    async def test_site_subscription(self):
+        """Test subscribing to all series of a site"""
+
+        communicator = await self.connect()
+        await communicator.send_json_to(
+            {"type": "subscribe", "sites": [to_global_id("SiteNode", self.site.pk)]}
+        )
+        await communicator.receive_json_from()
+        await self.ingest(100, self.air_pressure)
+        update = await communicator.receive_json_from()
+        self.assertEqual(
+            update["data_point_type"],
+            to_global_id("DataPointTypeNode", self.air_pressure.pk),
+        )
+        self.assertEqual(update["value"], [100])
+        await communicator.disconnect()
+
+    async def test_invalid_message(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({"type": "subscribe", "sites": ["invalid"]})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["type"], "error")
+        await communicator.send_json_to({"type": "publish"})
+        response = await communicator.receive_json_from()
+        self.assertIn("Unknown message type", response["errors"])
+        await communicator.disconnect()
@@ -0,0 +1,36 @@
+"""
+API urls for the farms app
+"""
+
+from django.urls import path
+
+from .views import (
+    DataPointExportView,
+    GrafanaAnnotationsView,
+    GrafanaQueryView,
+    GrafanaSearchView,
+    GrafanaView,
+    InfluxWriteView,
+)
+
+
+urlpatterns = [
+    path(
+        "v1/farms/data-points/export/",
+        DataPointExportView.as_view(),
+        name="data-point-export",
+    ),
+    # Grafana appends the endpoints to the datasource URL without a trailing slash
+    path("v1/farms/grafana/", GrafanaView.as_view(), name="grafana"),
+    path(
+        "v1/farms/grafana/search", GrafanaSearchView.as_view(), name="grafana-search"
+    ),
+    path("v1/farms/grafana/query", GrafanaQueryView.as_view(), name="grafana-query"),
+    path(
+        "v1/farms/grafana/annotations",
+        GrafanaAnnotationsView.as_view(),
+        name="grafana-annotations",
+    ),
+    # InfluxDB clients append /write to the URL of the server
+    path("v1/farms/influx/write", InfluxWriteView.as_view(), name="influx-write"),
+]
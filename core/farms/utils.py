@@ -1,5 +1,7 @@
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
+from rest_framework.authtoken.models import Token
+
 from farms.models import ControllerAuthToken, ControllerComponent
 
 
@@ -43,3 +45,36 @@ class TokenAuthMiddleware:
                 except ControllerComponent.DoesNotExist:
                     pass
         return None
+
+
+class UserTokenAuthMiddleware:
+    """
+    A token auth middleware for users, e.g., dashboards, that are not logged in with a
+    session. The API token of the user is given as a subprotocol like the token of a
+    controller: token_abc123
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        user = scope.get("user")
+        if user is None or not user.is_authenticated:
+            if token_user := await self.get_user(scope.get("subprotocols")):
+                scope["user"] = token_user
+        return await self.app(scope, receive, send)
+
+    @staticmethod
+    async def get_user(subprotocols):
+        """Return the user of the first token subprotocol, None if there is none"""
+
+        for subprotocol in subprotocols or []:
+            if subprotocol.startswith("token_"):
+                try:
+                    token = await database_sync_to_async(
+                        Token.objects.select_related("user").get
+                    )(key=subprotocol.split("_")[1])
+                    return token.user
+                except Token.DoesNotExist:
+                    return None
+        return None
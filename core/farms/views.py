@@ -0,0 +1,134 @@
+import zlib
+
+from django.http import StreamingHttpResponse
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.db.routers import iterate_with_replica_reads, replica_reads
+from core.views import AsyncViewMixin
+from farms import grafana, line_protocol
+from farms.export import FORMATS, data_point_rows, export_data_points
+
+
+class DataPointExportView(AsyncViewMixin, APIView):
+    """Streams the data points of the selected sites, peripheral components and time
+    range as a CSV, NDJSON or Parquet file. All query parameters are optional:
+
+        ?site=<uuid>&peripheral=<uuid>&start=<iso datetime>&end=<iso datetime>
+            &file_format=<csv|ndjson|parquet>
+
+    The site and peripheral parameters may be repeated to select multiple ones. Under
+    ASGI, the content is read in a thread of its own, see core.handlers."""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        file_format = request.query_params.get("file_format", "csv")
+        try:
+            rows = data_point_rows(
+                site_ids=request.query_params.getlist("site"),
+                peripheral_ids=request.query_params.getlist("peripheral"),
+                start=request.query_params.get("start"),
+                end=request.query_params.get("end"),
+            )
+            content = export_data_points(rows, file_format)
+        except ValueError as err:
+            raise ValidationError(detail=str(err)) from err
+        content_type, extension = FORMATS[file_format]
+        filename = f"data_points.{extension}"
+        # The content is read after the view returned
+        response = StreamingHttpResponse(
+            iterate_with_replica_reads(content), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class GrafanaView(APIView):
+    """The Grafana JSON datasource, answers the connection test of Grafana. The search,
+    query and annotations requests are posted to the subpaths of the same name."""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        return Response({})
+
+
+class GrafanaSearchView(APIView):
+    """Lists the series Grafana can query as targets"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        with replica_reads():
+            return Response(grafana.search(str(request.data.get("target") or "")))
+
+
+class GrafanaQueryView(APIView):
+    """Answers Grafana queries with the downsampled series of the targets"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            with replica_reads():
+                return Response(grafana.query(request.data))
+        except ValueError as err:
+            raise ValidationError(detail=str(err)) from err
+
+
+class GrafanaAnnotationsView(APIView):
+    """Answers Grafana annotation queries with the errors of the controllers"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            with replica_reads():
+                return Response(grafana.annotations(request.data))
+        except ValueError as err:
+            raise ValidationError(detail=str(err)) from err
+
+
+class QueryTokenAuthentication(TokenAuthentication):
+    """Token authentication with the token given as password query parameter, like
+    the credentials of InfluxDB 1.x clients: ?u=<user>&p=<token>"""
+
+    def authenticate(self, request):
+        if token := request.query_params.get("p"):
+            return self.authenticate_credentials(token)
+        return None
+
+
+class InfluxWriteView(APIView):
+    """Writes data points in the InfluxDB line protocol, compatible with the /write
+    endpoint of InfluxDB 1.x. The body may be gzip compressed. The optional precision
+    query parameter sets the unit of the timestamps and defaults to nanoseconds.
+
+    Valid lines are written even if others have errors. Like InfluxDB, it answers with
+    204 No Content if all lines were written and 400 with the errors otherwise."""
+
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (TokenAuthentication, QueryTokenAuthentication)
+
+    def post(self, request, *args, **kwargs):
+        # The body is read in chunks instead of being parsed as a whole
+        chunks = []
+        if stream := request.stream:
+            chunks = iter(lambda: stream.read(line_protocol.READ_SIZE), b"")
+        if request.META.get("HTTP_CONTENT_ENCODING") == "gzip":
+            chunks = line_protocol.gunzip(chunks)
+        try:
+            _, errors = line_protocol.write(
+                chunks, request.query_params.get("precision", "ns")
+            )
+        except ValueError as err:
+            errors = [str(err)]
+        except zlib.error as err:
+            errors = [f"Invalid gzip body: {err}"]
+        if errors:
+            return Response({"error": "; ".join(errors)}, status=400)
+        return Response(status=204)
@@ -186,6 +186,9 @@ fi
 if [[ -z $1 ]]; then
   echo "Starting Celery processes"
   pipenv run celery -A core worker -l info &
+  echo "Starting the controller command scheduler and task expiry workers"
+  pipenv run ./manage.py run_command_scheduler &
+  pipenv run ./manage.py run_task_expiry &
 
   # Start the app server, either for the dev or prod environment
   if [[ $DJANGO_DEBUG != "False" ]]; then